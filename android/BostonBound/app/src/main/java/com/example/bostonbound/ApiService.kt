@@ -1,10 +1,14 @@
 package com.example.bostonbound
 
 import com.squareup.moshi.Moshi
+import retrofit2.Response
 import retrofit2.Retrofit
 import retrofit2.converter.moshi.MoshiConverterFactory
 import retrofit2.http.Body
+import retrofit2.http.GET
+import retrofit2.http.Header
 import retrofit2.http.POST
+import retrofit2.http.Query
 import com.squareup.moshi.kotlin.reflect.KotlinJsonAdapterFactory
 
 interface ApiService {
@@ -12,6 +16,18 @@ interface ApiService {
     @POST("/plan")
     suspend fun planTrip(@Body request: PlanRequest): PlanResponse
 
+    @POST("/plan/batch")
+    suspend fun planBatch(@Body request: PlanBatchRequest): PlanBatchResponse
+
+    // Catalog changes after the cached version; 304 (empty body) when the
+    // ETag sent as If-None-Match is still current
+    @GET("/pois")
+    suspend fun syncPois(
+        @Query("since") since: Int,
+        @Header("If-None-Match") etag: String? = null,
+        @Query("city") city: String = "Boston"
+    ): Response<PoisDeltaResponse>
+
     companion object {
         private const val BASE_URL = "http://10.0.2.2:8000"
 
@@ -53,7 +53,7 @@ class MetricsActivity : AppCompatActivity() {
             budget_total = budget.toDouble(),
             mobility = mobility,
             preferences = PreferencesPayload(like = prefsLike),
-            strategy = "static_budget", // will override per call below
+            strategy = "static_budget", // the batch plans it once per strategy
             must_see = emptyList(),
             days = days,
             has_car = hasCar,
@@ -66,13 +66,13 @@ class MetricsActivity : AppCompatActivity() {
 
         GlobalScope.launch(Dispatchers.IO) {
             try {
-                // Greedy (static_budget)
-                val greedyResp = api.planTrip(baseRequest.copy(strategy = "static_budget"))
-                // A* (astar_budget)
-                val astarResp = api.planTrip(baseRequest.copy(strategy = "astar_budget"))
+                // Greedy (static_budget) and A* (astar_budget) in one round-trip
+                val batch = api.planBatch(
+                    PlanBatchRequest(trip = baseRequest, strategies = listOf("static_budget", "astar_budget"))
+                )
 
-                val greedyMetrics = greedyResp.metrics
-                val astarMetrics = astarResp.metrics
+                val greedyMetrics = batch.results.first { it.strategy == "static_budget" }.metrics
+                val astarMetrics = batch.results.first { it.strategy == "astar_budget" }.metrics
 
                 // Decide which is more efficient (lower runtime)
                 val moreEfficientName: String
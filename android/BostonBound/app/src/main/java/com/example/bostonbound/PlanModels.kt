@@ -41,6 +41,28 @@ data class PlanResponse(
     val metrics: Metrics
 )
 
+// Request body for POST /plan/batch: one trip planned with each strategy
+data class PlanBatchRequest(
+    val trip: PlanRequest,
+    val strategies: List<String>
+)
+
+// One plan from POST /plan/batch (same fields as PlanResponse, plus which plan it is)
+data class PlanBatchResult(
+    val trip: Int,
+    val strategy: String,
+    val itinerary_id: String,
+    val stops: List<ItineraryStop>,
+    val legs: List<Leg>,
+    val cost_summary: CostSummary,
+    val metrics: Metrics
+)
+
+// Response from POST /plan/batch
+data class PlanBatchResponse(
+    val results: List<PlanBatchResult>
+)
+
 data class ItineraryStop(
     val poi_id: String,
     val name: String,
@@ -63,4 +85,27 @@ data class CostSummary(
     val admissions: Double,
     val transport: Double,
     val total: Double
-)
\ No newline at end of file
+)
+data class PoiPayload(
+    val id: String,
+    val name: String,
+    val lat: Double,
+    val lon: Double,
+    val category: String,
+    val price_tier: String,
+    val open_from: String,
+    val open_to: String,
+    val hours: String,
+    val avg_dwell_min: Int,
+    val admission_cost: Double
+)
+
+// Response from GET /pois?since=<version>: POIs added or changed after that
+// version plus removed ids; reset = true means pois is the whole catalog
+data class PoisDeltaResponse(
+    val version: Int,
+    val since: Int,
+    val reset: Boolean,
+    val pois: List<PoiPayload>,
+    val removed: List<String>
+)
@@ -0,0 +1,304 @@
+"""
+Planner benchmark with scaling curves and regression gates.
+
+Builds synthetic POI catalogs of growing size from the pois_boston_seed.csv
+schema (seed rows resampled and scattered around Boston), then plans every
+combination of catalog size, strategy, trip length and budget/mobility
+variant. Each case records:
+- latency over at least --repeats runs (ms): the minimum and percentiles; the
+  gate uses the minimum relative to a calibration loop timed alongside (see CALIBRATION_LOOPS)
+- peak traced memory and allocated blocks for one run (tracemalloc)
+- search effort (greedy evaluations / A* expansions / ILS rounds / CSP calls) and total itinerary score
+
+The CSP and ILS searches normally stop on a wall-clock limit, so how far they
+get depends on machine load. Here they stop at fixed caps instead
+(BENCH_CSP_MAX_CALLS, BENCH_ILS_MAX_ITERATIONS), which makes effort, score
+and memory repeatable; --wall-clock keeps the production limits, and then
+scores are recorded but not gated.
+
+Results go to --out as JSON. With a baseline (--baseline, saved earlier with
+--save-baseline) the run fails when any case is slower, allocates more or
+scores lower than the baseline by more than the thresholds; cases that look
+slower are benched again first (LATENCY_RETRIES). A missing baseline fails
+the run too, unless it is being saved. bench_baseline.json holds the quick
+profile; save it again when a change moves scores, memory or effort on purpose.
+
+Usage:
+    python bench.py --profile quick          # exit 1 on regressions
+    python bench.py --profile quick --save-baseline
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+import numpy as np
+
+import main
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# strategy label -> (PlanReq.strategy, extra PlanReq fields); "csp" calls the fallback directly
+STRATEGIES = {
+    "greedy": ("static_budget", {}),
+    "astar": ("astar_budget", {}),
+    "beam": ("astar_explorer", {"search_mode": "beam"}),
+    "csp": ("static_budget", {}),
+    "ils": ("ils_budget", {}),
+}
+
+# (mobility, budget per day)
+VARIANTS = [("walk", 30.0), ("mbta", 150.0)]
+
+PROFILES = {
+    "quick": {"sizes": [65, 500], "days": [1, 3], "strategies": ["greedy", "astar", "ils", "csp"], "repeats": 7},
+    "full": {"sizes": [65, 500, 2000, 5000], "days": [1, 3, 7, 14],
+             "strategies": list(STRATEGIES), "repeats": 7},
+}
+
+# per-day search caps replacing the CSP / ILS wall-clock limits (see the module docstring)
+BENCH_CSP_MAX_CALLS = 20000
+BENCH_ILS_MAX_ITERATIONS = 20
+UNBOUNDED_S = 3600.0
+
+# latency samples per case: at least the profile's repeats, more until MIN_CASE_S have passed
+MIN_CASE_S = 1.0
+MAX_REPEATS = 200
+# the machine's speed drifts by tens of percent on shared hosts; latency is
+# gated relative to this loop, timed between the samples of every case
+CALIBRATION_LOOPS = 20000
+# times a case slower than the baseline is benched again before it counts
+LATENCY_RETRIES = 2
+
+
+def synthetic_catalog(size: int, seed: int = 7) -> main.PoiCatalog:
+    """size POIs resampled from the seed CSV, scattered wider as the catalog grows."""
+    seed_rows = main.read_poi_csv(main.CSV_PATH)
+    if size <= len(seed_rows):
+        return main.PoiCatalog(seed_rows[:size])
+
+    rng = random.Random(seed)
+    spread = 0.02 * (size / len(seed_rows)) ** 0.5  # degrees; keeps POI density roughly constant
+    rows = list(seed_rows)
+    for k in range(size - len(seed_rows)):
+        base = rng.choice(seed_rows)
+        rows.append({
+            **base,
+            "id": f"syn-{k}",
+            "name": f"{base['name']} #{k}",
+            "lat": main.START_LOC["lat"] + rng.gauss(0, spread),
+            "lon": main.START_LOC["lon"] + rng.gauss(0, spread),
+        })
+    return main.PoiCatalog(rows)
+
+
+def make_req(strategy: str, days: int, mobility: str, budget_per_day: float) -> main.PlanReq:
+    name, extra = STRATEGIES[strategy]
+    return main.PlanReq(
+        date="2025-06-03",
+        start_time="09:00",
+        end_time="18:00",
+        budget_total=budget_per_day * days,
+        mobility=mobility,
+        strategy=name,
+        days=days,
+        **extra,
+    )
+
+
+def run_once(strategy: str, req: main.PlanReq):
+    """Plan once; returns (score, stops, search effort)."""
+    if strategy != "csp":
+        res = main.plan(req)
+        m = res["metrics"]
+        return m["total_score"], m["total_stops"], m["search_effort"]
+
+    ctx = main.make_scoring_context(req.strategy)
+    dow = main.parse_day_of_week(req.date)
+    mode = main.get_travel_mode(req)
+    used = set()
+    total, stops, effort = 0.0, 0, 0
+    for day in range(1, (req.days or 1) + 1):
+        route, _, calls = main.csp_fill_day_by_backtracking(req, ctx, day, used, mode, dow)
+        total += sum(main.score(ctx.catalog.get(s["poi_id"]), ctx) for s in route)
+        stops += len(route)
+        effort += calls
+    return total, stops, effort
+
+
+def use_search_caps(wall_clock: bool):
+    """Stop the time-bounded searches at fixed caps, unless wall_clock."""
+    if wall_clock:
+        return
+    main.CSP_TIME_LIMIT_S = main.ILS_TIME_LIMIT_S = UNBOUNDED_S
+    main.CSP_MAX_CALLS = BENCH_CSP_MAX_CALLS
+    main.ILS_MAX_ITERATIONS = BENCH_ILS_MAX_ITERATIONS
+
+
+def calibration_ms() -> float:
+    """Time of a fixed pure-Python loop: how fast the machine runs right now."""
+    t0 = time.perf_counter()
+    acc = 0
+    for i in range(CALIBRATION_LOOPS):
+        acc += i * i % 7
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def bench_case(strategy: str, req: main.PlanReq, repeats: int) -> dict:
+    run_once(strategy, req)  # warm per-mode matrices
+
+    # cheap cases keep sampling for MIN_CASE_S, so their minimum comes from many runs;
+    # the calibration loop runs between samples, under the same load
+    latencies, calibration = [], []
+    gc.collect()
+    until = time.perf_counter() + MIN_CASE_S
+    while len(latencies) < repeats or (time.perf_counter() < until and len(latencies) < MAX_REPEATS):
+        calibration.append(calibration_ms())
+        t0 = time.perf_counter()
+        score, stops, effort = run_once(strategy, req)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    gc.collect()
+    tracemalloc.start()
+    run_once(strategy, req)
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+
+    return {
+        "min_ms": min(latencies),
+        "calibration_ms": min(calibration),
+        "relative": min(latencies) / min(calibration),  # what the latency gate compares
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "peak_kb": peak / 1024.0,
+        "live_blocks": blocks,
+        "effort": effort,
+        "score": score,
+        "stops": stops,
+    }
+
+
+def run_suite(profile: dict, wall_clock: bool = False, only: Optional[set] = None) -> dict:
+    """Every case of profile (or just the keys in only)."""
+    main.PLAN_CACHE.maxsize = 0  # every run must plan, not hit the cache
+    use_search_caps(wall_clock)
+    cases = {}
+    for size in profile["sizes"]:
+        if only is not None and not any(key.startswith(f"n={size}/") for key in only):
+            continue
+        main.use_catalog(synthetic_catalog(size))
+        for strategy in profile["strategies"]:
+            for days in profile["days"]:
+                for mobility, budget in VARIANTS:
+                    key = f"n={size}/{strategy}/days={days}/{mobility}/budget={budget:g}"
+                    if only is not None and key not in only:
+                        continue
+                    c = cases[key] = bench_case(strategy, make_req(strategy, days, mobility, budget),
+                                                profile["repeats"])
+                    c["deterministic"] = not wall_clock
+                    print(f"{key:48s} min {c['min_ms']:9.2f} ms  p99 {c['p99_ms']:9.2f} ms  "
+                          f"peak {c['peak_kb']:9.1f} KB  effort {c['effort']:8d}  score {c['score']:7.2f}",
+                          flush=True)
+    return cases
+
+
+def is_slower(cur: dict, base: dict, latency_tol: float) -> bool:
+    # the fastest run relative to the calibration loop is the least disturbed
+    # by other load; a 1 ms floor keeps tiny cases from flapping on noise
+    return cur["relative"] > base["relative"] * (1 + latency_tol) and cur["min_ms"] - base["min_ms"] > 1.0
+
+
+def remeasure_slow_cases(profile: dict, wall_clock: bool, cases: dict, baseline: dict, latency_tol: float):
+    """
+    Bench cases slower than baseline again (up to LATENCY_RETRIES times),
+    keeping each one's best measurement: a slowdown has to persist to count.
+    """
+    for _ in range(LATENCY_RETRIES):
+        slow = {key for key, base in baseline.items() if key in cases and is_slower(cases[key], base, latency_tol)}
+        if not slow:
+            return
+        print(f"re-measuring {len(slow)} slow cases", flush=True)
+        for key, c in run_suite(profile, wall_clock, only=slow).items():
+            if c["relative"] < cases[key]["relative"]:
+                cases[key] = c
+
+
+def compare(cases: dict, baseline: dict, latency_tol: float, memory_tol: float, score_tol: float) -> list:
+    """Human-readable regressions of cases against baseline cases."""
+    regressions = []
+    for key, base in baseline.items():
+        cur = cases.get(key)
+        if cur is None:
+            continue
+        if is_slower(cur, base, latency_tol):
+            regressions.append(f"{key}: min {base['min_ms']:.2f} -> {cur['min_ms']:.2f} ms "
+                               f"({base['relative']:.2f} -> {cur['relative']:.2f} x calibration)")
+        # 64 KB floor: tracemalloc peaks of tiny cases move by a few blocks
+        if cur["peak_kb"] > base["peak_kb"] * (1 + memory_tol) and cur["peak_kb"] - base["peak_kb"] > 64:
+            regressions.append(f"{key}: peak {base['peak_kb']:.0f} -> {cur['peak_kb']:.0f} KB")
+        # scores only compare when neither run depended on wall-clock search limits
+        deterministic = cur.get("deterministic") and base.get("deterministic")
+        if deterministic and cur["score"] < base["score"] - score_tol * max(1.0, abs(base["score"])):
+            regressions.append(f"{key}: score {base['score']:.3f} -> {cur['score']:.3f}")
+    return regressions
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    ap.add_argument("--out", default=os.path.join(BASE_DIR, "bench_results.json"))
+    ap.add_argument("--baseline", default=os.path.join(BASE_DIR, "bench_baseline.json"))
+    ap.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    ap.add_argument("--wall-clock", action="store_true",
+                    help="keep the CSP / ILS time limits instead of fixed caps (scores are not gated)")
+    ap.add_argument("--latency-tol", type=float, default=0.5,
+                    help="allowed relative slowdown of min latency / calibration")
+    ap.add_argument("--memory-tol", type=float, default=0.25, help="allowed relative peak-memory growth")
+    ap.add_argument("--score-tol", type=float, default=0.01, help="allowed relative score drop")
+    args = ap.parse_args()
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline} (run with --save-baseline first)")
+        raise SystemExit(1)
+
+    profile = PROFILES[args.profile]
+    results = {
+        "meta": {
+            "profile": args.profile,
+            "python": sys.version.split()[0],
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "wall_clock": args.wall_clock,
+        },
+        "cases": run_suite(profile, args.wall_clock),
+    }
+    if args.save_baseline:
+        for path in (args.out, args.baseline):
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    remeasure_slow_cases(profile, args.wall_clock, results["cases"], baseline["cases"], args.latency_tol)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    regressions = compare(results["cases"], baseline["cases"], args.latency_tol, args.memory_tol, args.score_tol)
+    for line in regressions:
+        print("REGRESSION", line)
+    print(f"{len(regressions)} regressions against {args.baseline}")
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,27 @@
+"""Shared fixtures: tests never write the SQLite files next to main.py."""
+import os
+
+# read by main at import: keep the change log, ratings and itineraries in memory
+os.environ.setdefault("CATALOG_CHANGES_DB", "")
+os.environ.setdefault("PREFERENCES_DB", "")
+os.environ.setdefault("ITINERARY_DB", "")
+
+import pytest  # noqa: E402
+
+import main  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    """Every test starts without cached plans, logged catalog versions or learned ratings."""
+    main.PLAN_CACHE.clear()
+    monkeypatch.setattr(main, "CATALOG_CHANGES", main.CatalogChangeLog(path=""))
+    monkeypatch.setattr(main, "PREFERENCES", main.PreferenceStore(path=""))
+
+
+@pytest.fixture()
+def catalog():
+    """A private copy of the Boston catalog, so tests can change it."""
+    catalog = main.PoiCatalog(main.read_poi_csv(main.CSV_PATH), city="boston")
+    main.use_catalog(catalog)
+    return catalog
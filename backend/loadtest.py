@@ -0,0 +1,101 @@
+"""
+Concurrency load test for /plan.
+
+1) Correctness: fires requests with different preferences from many threads
+   at once and checks every itinerary matches the one planned sequentially.
+2) Throughput: runs the same request mix in 1..N worker processes (like
+   uvicorn --workers N) and reports requests/s and speedup per worker count.
+
+Usage: python loadtest.py [--threads 16] [--rounds 5] [--workers 1 2 4]
+Exits non-zero if any concurrent itinerary differs from the sequential one.
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import main
+
+LIKES = [[], ["museums"], ["parks"], ["restaurants"], ["history", "seafood"], ["shopping", "nightlife"]]
+STRATEGIES = ["static_budget", "static_explorer", "astar_budget", "astar_explorer"]
+
+
+def request_mix():
+    reqs = []
+    for like in LIKES:
+        for strategy in STRATEGIES:
+            reqs.append(main.PlanReq(
+                date="2025-06-03",
+                start_time="09:00",
+                end_time="18:00",
+                budget_total=80,
+                strategy=strategy,
+                days=2,
+                preferences={"like": like},
+            ))
+    return reqs
+
+
+def itinerary(req):
+    res = main.plan(req)
+    return [(s["poi_id"], s["start"], s["day"]) for s in res["stops"]], res["metrics"]["total_score"]
+
+
+def _init_worker():
+    # every request must be planned, not served from the cache
+    main.PLAN_CACHE.maxsize = 0
+
+
+def _run_batch(n: int) -> int:
+    reqs = request_mix()
+    for k in range(n):
+        itinerary(reqs[k % len(reqs)])
+    return n
+
+
+def check_correctness(threads: int, rounds: int) -> int:
+    reqs = request_mix()
+    expected = [itinerary(r) for r in reqs]
+
+    jobs = [k for k in range(len(reqs)) for _ in range(rounds)]
+    random.shuffle(jobs)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        got = list(pool.map(lambda k: (k, itinerary(reqs[k])), jobs))
+
+    mismatches = sum(1 for k, result in got if result != expected[k])
+    print(f"correctness: {len(got)} concurrent plans on {threads} threads, {mismatches} mismatches")
+    return mismatches
+
+
+def measure_throughput(workers_list, per_worker: int):
+    base_rate = None
+    for workers in workers_list:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            # warm every worker before timing
+            list(pool.map(_run_batch, [1] * workers))
+            t0 = time.perf_counter()
+            done = sum(pool.map(_run_batch, [per_worker] * workers))
+            elapsed = time.perf_counter() - t0
+
+        rate = done / elapsed
+        base_rate = base_rate or rate
+        print(f"throughput: {workers} workers, {rate:8.1f} req/s, speedup {rate / base_rate:.2f}x")
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--per-worker", type=int, default=48)
+    args = ap.parse_args()
+
+    _init_worker()
+    mismatches = check_correctness(args.threads, args.rounds)
+    measure_throughput([w for w in args.workers if w <= (os.cpu_count() or 1)], args.per_worker)
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
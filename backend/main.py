@@ -1,32 +1,71 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import Optional, List, Dict
-import csv, math, os, time
-from dataclasses import dataclass, field
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Callable, Optional, List, Dict, Tuple, Union
+import asyncio, csv, gzip, hashlib, json, math, multiprocessing, os, shutil, sqlite3, sys, threading, time, uuid
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import dataclass
+from bisect import bisect_left, insort
 from heapq import heappush, heappop
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from datetime import datetime
 
-app = FastAPI()
+try:
+    import orjson  # optional: much faster JSON encoding of responses
+except ImportError:
+    orjson = None
+try:
+    import brotli  # optional: Content-Encoding br
+except ImportError:
+    brotli = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    PREFERENCES.load()
+    # fork before any other thread starts: a fork while another thread holds a
+    # lock (metrics, catalog loading) leaves that lock held forever in the worker
+    start_plan_pool()
+    ITINERARIES.load()
+    WARMUP.start()
+    yield
+    WARMUP.join()
+    stop_plan_pool()
+    ITINERARIES.close()
+    PREFERENCES.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # --------- LOAD POIS FROM CSV ---------
 BASE_DIR = os.path.dirname(__file__)
 CSV_PATH = os.path.join(BASE_DIR, "pois_boston_seed.csv")
 
-POIS: List[Dict] = []
-with open(CSV_PATH) as f:
-    for row in csv.DictReader(f):
-        row["lat"] = float(row["lat"])
-        row["lon"] = float(row["lon"])
-        row["avg_dwell_min"] = int(row["avg_dwell_min"])
-        row["admission_cost"] = float(row["admission_cost"])
-        POIS.append(row)
 
-# will be set from each /plan request
-CURRENT_PREFS_LIKE = set()
 
-# category -> list of ratings (for simple preference learning)
-CATEGORY_RATINGS: Dict[str, List[int]] = defaultdict(list)
+def read_poi_csv(path: str) -> List[Dict]:
+    """CSV rows with numeric columns converted."""
+    rows = []
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            row["lat"] = float(row["lat"])
+            row["lon"] = float(row["lon"])
+            row["avg_dwell_min"] = int(row["avg_dwell_min"])
+            row["admission_cost"] = float(row["admission_cost"])
+            rows.append(row)
+    return rows
+
+
+# where every day's route begins (Boston center approx)
+START_LOC = {"lat": 42.3601, "lon": -71.0589, "name": "Start"}
+
+# most A* candidates per day a request may ask for (PlanReq.max_candidates)
+ASTAR_CANDIDATE_CAP = int(os.environ.get("ASTAR_CANDIDATE_CAP", "64"))
+# longest ILS search per day a request may ask for (PlanReq.ils_time_limit_s)
+ILS_MAX_LIMIT_S = float(os.environ.get("ILS_MAX_LIMIT_S", "2.0"))
 
 
 class PlanReq(BaseModel):
@@ -37,25 +76,278 @@ class PlanReq(BaseModel):
     budget_total: float
     mobility: str = "walk"
     preferences: dict = {}
-    strategy: str = "static_budget"   # "static_budget", "static_explorer", "astar_budget", ...
+    strategy: str = "static_budget"   # "static_budget", "static_explorer", "astar_budget", "ils_budget", ...
     must_see: list[str] = []
 
+    # A* tuning: "astar" (exact), or bounded-memory "beam" / "dfbnb"
+    search_mode: str = "astar"
+    max_candidates: Optional[int] = Field(None, ge=1, le=ASTAR_CANDIDATE_CAP)
+
+    # ILS search time per day in seconds (default ILS_TIME_LIMIT_S, at most ILS_MAX_LIMIT_S); more time, better routes
+    ils_time_limit_s: Optional[float] = Field(None, gt=0, le=ILS_MAX_LIMIT_S)
+
+    # A* execution: "inline" or "process" (PLAN_POOL); on timeout the best plan so far is returned
+    execution: str = "inline"
+    timeout_s: Optional[float] = None
+
+    # multi-day: "sequential" (day by day over leftovers) or "partitioned" (POIs split across days first;
+    # the days run side by side in PLAN_POOL, which is on by default on multi-core hosts)
+    multi_day_mode: str = "sequential"
+
+    # opt-in sampling profiler (/plan only): hottest frames go to metrics.profile, bypassing the cache
+    profile: bool = False
+
     # fields coming from your Android UI
     days: Optional[int] = None
     has_car: Optional[bool] = None
     max_distance_miles: Optional[int] = None
 
-    # new: toggle simulated "real-time" constraints
+    # new: toggle simulated "real-time" constraints (rush hours, per-weekday opening hours)
     use_live_constraints: bool = False
 
+    # user segment whose learned ratings apply; categories it has not rated use everyone's
+    segment: Optional[str] = None
+
 
 class Feedback(BaseModel):
     itinerary_id: str
     poi_id: str
-    rating: int  # assume 1–5
+    rating: int = Field(ge=1, le=5)
+    segment: Optional[str] = None
+
+
+class PlanBatchReq(BaseModel):
+    trip: Optional[PlanReq] = None     # planned once per entry of strategies
+    strategies: list[str] = []
+    trips: list[PlanReq] = []          # further trips, each with its own strategy
+
+
+class ReplanReq(BaseModel):
+    itinerary_id: str
+    current_time: str                  # "HH:MM"
+    day: Optional[int] = None          # trip day in progress; default: first day with stops not done
+    lat: Optional[float] = None        # where the user is; default: the day's last done stop
+    lon: Optional[float] = None
+    done: list[str] = []               # poi_ids already visited
+    skip: list[str] = []               # poi_ids the user no longer wants
+
+
+# response bodies, for the OpenAPI schema: handlers send pre-encoded JSON (json_response)
+class StopOut(BaseModel):
+    poi_id: str
+    name: str
+    start: str                         # "HH:MM"
+    end: str
+    dwell_min: int
+    admission_est: float
+    day: int
+
+
+class LegOut(BaseModel):
+    from_: str = Field(alias="from")   # the previous stop, or where the day starts
+    to: str
+    mode: str
+    eta_min: int
+    day: int
+
+
+class CostSummaryOut(BaseModel):
+    admissions: float
+    transport: float
+    total: float
+
+
+class PlanOut(BaseModel):
+    itinerary_id: Optional[str]
+    stops: List[StopOut]
+    legs: List[LegOut]                 # legs[i] leads to stops[i]
+    cost_summary: CostSummaryOut
+    metrics: dict
+
+
+class CompactDayOut(BaseModel):
+    day: int
+    stops: List[list]                  # rows of COMPACT_STOP_FIELDS
+
+
+class CompactPlanOut(BaseModel):
+    itinerary_id: Optional[str]
+    format: str = "compact"
+    stop_fields: List[str]
+    mode: Optional[str]
+    days: List[CompactDayOut]
+    cost_summary: CostSummaryOut
+    metrics: dict
+
+
+class BatchPlanOut(PlanOut):
+    trip: int
+    strategy: str
+
+
+class BatchCompactPlanOut(CompactPlanOut):
+    trip: int
+    strategy: str
+
+
+class PlanBatchOut(BaseModel):
+    results: List[Union[BatchPlanOut, BatchCompactPlanOut]]
+    metrics: dict
+
+
+class PoiOut(BaseModel):
+    id: str
+    name: str
+    lat: float
+    lon: float
+    category: str
+    price_tier: str
+    open_from: str
+    open_to: str
+    hours: str
+    avg_dwell_min: int
+    admission_cost: float
+
+
+class PoisOut(BaseModel):
+    version: int
+    pois: List[PoiOut]
+
+
+class PoisDeltaOut(PoisOut):
+    since: int
+    reset: bool                        # pois is the whole catalog: replace, don't patch
+    removed: List[str]
+
+
+# --------- LEARNED PREFERENCES ---------
+# SQLite file the rating aggregates are kept in ("" keeps them in memory only)
+PREFERENCES_DB = os.environ.get("PREFERENCES_DB", os.path.join(BASE_DIR, "preferences.db"))
+# half-life of a rating for the decayed mean, in days; 0 scores with the plain mean
+RATING_HALF_LIFE_DAYS = float(os.environ.get("RATING_HALF_LIFE_DAYS", "0"))
+ALL_SEGMENTS = "*"  # aggregate over every segment
+
+
+class RatingStats:
+    """Running rating aggregates for one (segment, category); O(1) to update."""
+    __slots__ = ("count", "total", "decayed_sum", "decayed_weight", "updated_at")
+
+    def __init__(self, count=0, total=0.0, decayed_sum=0.0, decayed_weight=0.0, updated_at=0.0):
+        self.count = count
+        self.total = total
+        self.decayed_sum = decayed_sum        # ratings weighted by 0.5 ** (age / half-life)
+        self.decayed_weight = decayed_weight  # the same weights summed
+        self.updated_at = updated_at
+
+    def add(self, rating: float, now: float, half_life_s: float):
+        keep = 0.5 ** (max(0.0, now - self.updated_at) / half_life_s) if half_life_s else 1.0
+        self.count += 1
+        self.total += rating
+        self.decayed_sum = self.decayed_sum * keep + rating
+        self.decayed_weight = self.decayed_weight * keep + 1.0
+        self.updated_at = now
+
+    def mean(self, decayed: bool) -> float:
+        # decaying both sums to "now" would scale them alike, so their ratio is already current
+        if decayed:
+            return self.decayed_sum / self.decayed_weight
+        return self.total / self.count
+
+
+class PreferenceStore:
+    """
+    Rating aggregates per (segment, category), plus the ALL_SEGMENTS total.
+    - add() updates them in O(1) per rating and upserts the touched rows
+      to SQLite in one transaction per batch
+    - load() reads every aggregate back at startup
+    - learned(segment) is cached until the next rating arrives
+    """
+
+    def __init__(self, path: str = PREFERENCES_DB, half_life_days: float = RATING_HALF_LIFE_DAYS):
+        self.path = path
+        self.half_life_s = half_life_days * 86400.0
+        self._stats: Dict[tuple, RatingStats] = {}
+        self._learned: Dict[Optional[str], Dict[str, float]] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not self.path:
+            return
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS rating_stats ("
+            " segment TEXT, category TEXT, count INTEGER, total REAL,"
+            " decayed_sum REAL, decayed_weight REAL, updated_at REAL,"
+            " PRIMARY KEY (segment, category))"
+        )
+        rows = db.execute(
+            "SELECT segment, category, count, total, decayed_sum, decayed_weight, updated_at FROM rating_stats"
+        ).fetchall()
+        with self._lock:
+            self._db = db
+            self._stats = {(seg, cat): RatingStats(*values) for seg, cat, *values in rows}
+            self._learned.clear()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def add(self, ratings):
+        """Record (segment or None, category, rating) triples."""
+        now = time.time()
+        with self._lock:
+            touched = {}
+            for segment, cat, rating in ratings:
+                for key in {(ALL_SEGMENTS, cat), (segment or ALL_SEGMENTS, cat)}:
+                    stats = self._stats.get(key)
+                    if stats is None:
+                        stats = self._stats[key] = RatingStats()
+                    stats.add(rating, now, self.half_life_s)
+                    touched[key] = stats
+            self._learned.clear()
+
+            if self._db is not None and touched:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO rating_stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(seg, cat, s.count, s.total, s.decayed_sum, s.decayed_weight, s.updated_at)
+                         for (seg, cat), s in touched.items()],
+                    )
+
+    def learned(self, segment: Optional[str] = None) -> Dict[str, float]:
+        """category -> learned bonus; a segment's own ratings override everyone's."""
+        with self._lock:
+            learned = self._learned.get(segment)
+            if learned is None:
+                decayed = bool(self.half_life_s)
+                learned = {cat: category_preference_bonus(s.mean(decayed))
+                           for (seg, cat), s in self._stats.items() if seg == ALL_SEGMENTS}
+                if segment:
+                    learned.update({cat: category_preference_bonus(s.mean(decayed))
+                                    for (seg, cat), s in self._stats.items() if seg == segment})
+                self._learned[segment] = learned
+            return learned
+
+    def stats(self, segment: str = ALL_SEGMENTS) -> Dict[str, dict]:
+        with self._lock:
+            return {cat: {"count": s.count, "mean": s.mean(bool(self.half_life_s))}
+                    for (seg, cat), s in self._stats.items() if seg == segment}
+
+
+PREFERENCES = PreferenceStore()
 
 
 # --------- UTILS ---------
+def encode_json(obj) -> bytes:
+    """Compact JSON bytes: orjson when installed, else the json module."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
 def minutes(t: str) -> int:
     """Convert 'HH:MM' to minutes after midnight."""
     h, m = map(int, t.split(":"))
@@ -85,616 +377,3736 @@ def haversine_mins(a, b, speed_kmh: float = 5.0) -> int:
     return int(hours * 60)
 
 
-def adjust_travel_mins(base_mins: int, current_time_min: int, use_live: bool) -> int:
-    """
-    Simulate "live" travel times:
-    - Rush hours (8–10, 17–19) are slower.
-    """
-    if not use_live:
+def slow_down(base_mins: np.ndarray, factor: float) -> np.ndarray:
+    """Travel minutes stretched by a time-of-day factor (rounded up, at least 1 minute)."""
+    if factor == 1.0:
         return base_mins
-
-    hour = (current_time_min // 60) % 24
-    factor = 1.0
-    if 8 <= hour <= 10 or 17 <= hour <= 19:
-        factor = 1.5  # heavier traffic
-
-    return max(1, int(math.ceil(base_mins * factor)))
+    return np.maximum(1, np.ceil(base_mins * factor)).astype(base_mins.dtype)
 
 
 def price_norm(p):
     return {"$": 0.2, "$$": 0.5, "$$$": 0.9}.get(p, 0.5)
 
 
-def category_preference_bonus(cat: str) -> float:
+def category_preference_bonus(avg: float) -> float:
     """
-    Simple "learning" from ratings in CATEGORY_RATINGS.
+    Simple "learning" from a category's mean rating.
     If avg rating is 1–5, map to [-0.5, 0.5] bonus.
     """
-    scores = CATEGORY_RATINGS.get(cat, [])
-    if not scores:
-        return 0.0
-    avg = sum(scores) / len(scores)  # 1..5
     return (avg - 3.0) * 0.25  # center at 3, scale down
 
 
-def score(poi, strategy: str) -> float:
-    """
-    Base scoring for each strategy, plus:
-      - bump for liked categories (CURRENT_PREFS_LIKE)
-      - bump/penalty from learned category ratings
-    """
-    base = 0.0
-    cat = poi["category"].lower()
-
-    if strategy == "static_budget" or strategy == "astar_budget":
-        # strongly penalize expensive places, favor history/outdoors
-        base += -(price_norm(poi["price_tier"])) * 1.5
-        if cat in {"history", "outdoors"}:
-            base += 0.6
-    elif strategy == "static_explorer" or strategy == "astar_explorer":
-        # mild cost penalty, favor museums / food / history
-        base += -price_norm(poi["price_tier"]) * 0.4
-        if cat in {"museums", "food", "history"}:
-            base += 0.8
-    else:
-        # fallback similar to explorer
-        base += -price_norm(poi["price_tier"]) * 0.4
-        if cat in {"museums", "food", "history"}:
-            base += 0.8
+# strategy family -> weights used by score(); "static_*" and "astar_*" share a family
+STRATEGY_WEIGHTS = {
+    # strongly penalize expensive places, favor history/outdoors
+    "budget": {"price_weight": 1.5, "bonus_cats": {"history", "outdoors"}, "cat_bonus": 0.6},
+    # mild cost penalty, favor museums / food / history
+    "explorer": {"price_weight": 0.4, "bonus_cats": {"museums", "food", "history"}, "cat_bonus": 0.8},
+}
 
-    # extra bump if this category is in the user's explicit "like" list
-    if CURRENT_PREFS_LIKE and cat in CURRENT_PREFS_LIKE:
-        base += 1.0
 
-    # learned preference from feedback
-    base += category_preference_bonus(cat)
+def strategy_family(strategy: str) -> str:
+    """Map a strategy name onto its STRATEGY_WEIGHTS family (explorer is the fallback)."""
+    if strategy in ("static_budget", "astar_budget", "ils_budget"):
+        return "budget"
+    return "explorer"
+
 
+def strategy_planner(strategy: str) -> str:
+    """Planner chain for a strategy: "astar_*" -> astar, "ils_*" -> ils, otherwise greedy."""
+    if strategy.startswith("astar"):
+        return "astar"
+    if strategy.startswith("ils"):
+        return "ils"
+    return "greedy"
+
+
+def base_score(price_tier: str, cat: str, w: dict) -> float:
+    """Strategy-only part of score() for one STRATEGY_WEIGHTS row."""
+    base = 0.0
+    base += -(price_norm(price_tier)) * w["price_weight"]
+    if cat in w["bonus_cats"]:
+        base += w["cat_bonus"]
     return base
 
 
-def get_speed_kmh(req: PlanReq) -> float:
-    """Convert has_car/mobility into an approximate travel speed."""
-    if req.has_car:
-        return 25.0  # simple city driving
-    mob = (req.mobility or "walk").lower()
-    if mob == "mbta":
-        return 15.0
-    if mob == "rideshare":
-        return 25.0
-    return 5.0  # walk by default
+@dataclass(frozen=True)
+class ScoringContext:
+    """
+    Everything score() needs for one request, fixed when the request starts:
+    - likes: the request's normalized preferences.like categories
+    - weights: the STRATEGY_WEIGHTS row for the request's strategy
+    - learned: category -> learned rating bonus, snapshotted from PREFERENCES
+    - catalog: the PoiCatalog of the request's city
+    Planners take this instead of reading module state, so concurrent
+    requests never see each other's preferences or cities.
+    """
+    strategy: str
+    likes: frozenset
+    weights: dict
+    learned: Dict[str, float]
+    catalog: "PoiCatalog"
+
+
+def make_scoring_context(strategy: str, likes=(), segment: Optional[str] = None,
+                         catalog: Optional["PoiCatalog"] = None) -> ScoringContext:
+    return ScoringContext(
+        strategy=strategy,
+        likes=frozenset(likes),
+        weights=STRATEGY_WEIGHTS[strategy_family(strategy)],
+        learned=PREFERENCES.learned(segment),
+        catalog=CATALOGS.get(DEFAULT_CITY) if catalog is None else catalog,
+    )
 
 
-def is_poi_open_today(poi, dow: Optional[int], use_live: bool) -> bool:
+def score(poi, ctx: ScoringContext) -> float:
     """
-    Simulate real-time constraints: e.g. museums closed on Sunday.
+    Base scoring for the context's strategy, plus:
+      - bump for liked categories (ctx.likes)
+      - bump/penalty from learned category ratings (ctx.learned)
     """
-    if not use_live or dow is None:
-        return True
+    cat = poi.cat
+    base = base_score(poi.price_tier, cat, ctx.weights)
 
-    cat = poi["category"].lower()
-    # 6 = Sunday
-    if dow == 6 and cat == "museums":
-        return False
+    # extra bump if this category is in the user's explicit "like" list
+    if cat in ctx.likes:
+        base += 1.0
 
-    return True
+    # learned preference from feedback
+    base += ctx.learned.get(cat, 0.0)
 
+    return base
 
-# --------- A* SEARCH STRUCT ---------
-@dataclass(order=True)
-class AStarNode:
-    f: float
-    g: float = field(compare=False)        # negative total score so far (we minimize)
-    time: int = field(compare=False)
-    budget: float = field(compare=False)
-    cur_idx: int = field(compare=False)    # index into candidates, -1 for "start"
-    visited_mask: int = field(compare=False)
-    route: list = field(compare=False, default_factory=list)
-    legs: list = field(compare=False, default_factory=list)
 
+# --------- TRAVEL MODES ---------
+# per-mode speed and hour-of-week travel-time factors, applied with live constraints
+TRAVEL_PROFILES_PATH = os.environ.get("TRAVEL_PROFILES", os.path.join(BASE_DIR, "travel_profiles.json"))
+HOURS_PER_WEEK = 7 * 24
 
-# --------- SINGLE-DAY GREEDY PLANNER ---------
-def greedy_plan_one_day(
-    req: PlanReq,
-    day: int,
-    used_pois: set,
-    speed_kmh: float,
-    dow: Optional[int],
-):
-    start = minutes(req.start_time)
-    end = minutes(req.end_time)
-    days = req.days or 1
-    budget_per_day = req.budget_total / days
 
-    t = start
-    cur = {"lat": 42.3601, "lon": -71.0589, "name": "Start"}  # Boston center approx
-    budget = budget_per_day
+@dataclass(frozen=True)
+class TravelMode:
+    """
+    How fast one way of getting around is at every hour of the week.
+    - hours with the same factor share a slice; TRAVEL keeps one minutes
+      matrix per slice, so a lookup is slice_at() plus an array index
+    - slice_at(dow, t): the slice for a leg leaving at minute t of weekday dow
+    """
+    name: str
+    speed_kmh: float
+    slice_factors: tuple   # travel-time factor of each slice, ascending
+    slice_of_hour: tuple   # hour of week (Monday 00:00 = 0) -> slice
 
-    route_day = []
-    legs_day = []
+    @classmethod
+    def from_factors(cls, name: str, speed_kmh: float, hourly) -> "TravelMode":
+        factors = tuple(sorted(set(hourly)))
+        return cls(name, speed_kmh, factors, tuple(factors.index(f) for f in hourly))
 
-    evals = 0
-    while True:
-        cands = []
-        for p in POIS:
-            evals += 1
-            if p["id"] in used_pois:
-                continue
+    def free_flow(self) -> "TravelMode":
+        return TravelMode(self.name, self.speed_kmh, (1.0,), (0,) * HOURS_PER_WEEK)
 
-            if not is_poi_open_today(p, dow, req.use_live_constraints):
-                continue
+    @property
+    def reach_speed_kmh(self) -> float:
+        """No leg of this mode is faster than this (for spatial pruning)."""
+        return self.speed_kmh / min(1.0, self.slice_factors[0])
 
-            # travel time with chosen speed (adjusted for rush hour if enabled)
-            base_travel = haversine_mins(cur, p, speed_kmh=speed_kmh)
-            travel = adjust_travel_mins(base_travel, t, req.use_live_constraints)
-            arrive = t + travel
+    def slice_at(self, dow: Optional[int], t: int) -> int:
+        return self.slice_of_hour[((dow or 0) * 24 + t // 60) % HOURS_PER_WEEK]
 
-            open_from = minutes(p["open_from"])
-            open_to = minutes(p["open_to"])
 
-            # must be open and have time for dwell
-            if not (open_from <= arrive <= open_to - p["avg_dwell_min"]):
-                continue
+def load_travel_modes(path: str) -> Dict[str, TravelMode]:
+    """TravelModes from a profile file: weekday/weekend hourly factors, or all 168 as hours_of_week."""
+    with open(path) as f:
+        spec = json.load(f)
+    modes = {}
+    for name, m in spec["modes"].items():
+        hourly = m.get("hours_of_week") or m["weekday"] * 5 + m["weekend"] * 2
+        if len(hourly) != HOURS_PER_WEEK:
+            raise ValueError(f"travel profile {name!r}: expected {HOURS_PER_WEEK} hourly factors")
+        modes[name] = TravelMode.from_factors(name, float(m["speed_kmh"]), [float(x) for x in hourly])
+    return modes
 
-            # respect daily budget
-            if budget - p["admission_cost"] < 0:
-                continue
 
-            # must fit in this day's time window
-            if arrive + p["avg_dwell_min"] > end:
-                continue
+TRAVEL_MODES = load_travel_modes(TRAVEL_PROFILES_PATH)
+FREE_FLOW_MODES = {name: mode.free_flow() for name, mode in TRAVEL_MODES.items()}
 
-            cands.append((score(p, req.strategy), p, travel))
 
-        if not cands:
-            break
+def get_travel_mode(req: PlanReq) -> TravelMode:
+    """
+    has_car/mobility -> TravelMode (unknown modes walk). Without live
+    constraints every hour runs at free-flow speed.
+    """
+    name = "car" if req.has_car else (req.mobility or "walk").lower()
+    modes = TRAVEL_MODES if req.use_live_constraints else FREE_FLOW_MODES
+    return modes.get(name, modes["walk"])
 
-        cands.sort(key=lambda x: x[0], reverse=True)
-        _, p, travel = cands[0]
 
-        # leg (movement between points)
-        legs_day.append({
-            "from": cur.get("name", "Start"),
-            "to": p["name"],
-            "mode": req.mobility,
-            "eta_min": travel,
-            "day": day,
-        })
+# --------- TRAVEL-TIME MATRIX ---------
+START = -1  # matrix index of the Start location
+MINUTES_DTYPE = np.int32  # travel minutes; one matrix per speed and time slice
+# n x n matrices cost about 4 bytes per pair per cached slice plus 8 for km
+# (20k POIs: 1.6 GB per slice); above this many POIs TravelMatrix keeps only
+# coordinates and computes the legs a planner asks for (a few rows, or the
+# block between its candidates) on demand
+TRAVEL_DENSE_MAX_POIS = int(os.environ.get("TRAVEL_DENSE_MAX_POIS", "5000"))
 
-        t += travel
-        start_str = f"{t // 60:02d}:{t % 60:02d}"
-        end_t = t + p["avg_dwell_min"]
-        end_str = f"{end_t // 60:02d}:{end_t % 60:02d}"
 
-        # record the stop; include day
-        route_day.append({
-            "poi_id": p["id"],
-            "name": p["name"],
-            "start": start_str,
-            "end": end_str,
-            "dwell_min": p["avg_dwell_min"],
-            "admission_est": p["admission_cost"],
-            "day": day,
-        })
+def _haversine_km(lat1, lon1, lat2, lon2):
+    """Same great-circle formula as haversine_mins, broadcast over arrays."""
+    R = 6371
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    la1, la2 = np.radians(lat1), np.radians(lat2)
+    x = np.sin(dlat / 2) ** 2 + np.cos(la1) * np.cos(la2) * np.sin(dlon / 2) ** 2
+    return 2 * R * np.arcsin(np.sqrt(x))
 
-        t += p["avg_dwell_min"]
-        budget -= p["admission_cost"]
-        cur = p
-        used_pois.add(p["id"])
 
-    return route_day, legs_day, evals
+def _km_to_minutes(km: np.ndarray, speed_kmh: float, factor: float = 1.0) -> np.ndarray:
+    return slow_down((km / max(speed_kmh, 1e-6) * 60).astype(MINUTES_DTYPE), factor)
 
 
-# --------- VERY LIGHT CSP/BACKTRACK FALLBACK ---------
-def csp_fill_day_by_backtracking(
-    req: PlanReq,
-    day: int,
-    used_pois: set,
-    dow: Optional[int],
-):
+class TravelMatrix:
     """
-    Tiny CSP-ish layer:
-    - choose a subset of POIs that fits time and budget
-    - uses backtracking over a small candidate set (max 8)
-    - ignores travel time to keep it simple, but respects open hours + dwell + budget
+    Pairwise POI distances computed once, plus a row from the Start location.
+    - POIs are addressed by their catalog row index; START (-1) is the Start row
+    - minutes() scales the km matrix to whole travel minutes for one speed and
+      time-slice factor (cached); row()/travel_mins() pick the slice by departure time
+    - add() only computes distances involving the new POIs, or takes the
+      matrix prebuilt (catalog artifacts) when the matrix is still empty
+    - past dense_max POIs it is not dense: no km or minutes matrices, and
+      from_poi()/between()/km_between() compute what is asked from coordinates
     """
 
-    start = minutes(req.start_time)
-    end = minutes(req.end_time)
-    days = req.days or 1
-    budget_per_day = req.budget_total / days
-
-    # small candidate pool: top K by score that are open today
-    candidates = []
-    for p in POIS:
-        if p["id"] in used_pois:
-            continue
-        if not is_poi_open_today(p, dow, req.use_live_constraints):
-            continue
-
-        candidates.append(p)
-
-    if not candidates:
-        return [], []
+    def __init__(self, start=START_LOC, dense_max: int = TRAVEL_DENSE_MAX_POIS):
+        self.start = start
+        self.dense_max = dense_max
+        self.dense = True
+        self.n = 0
+        self._lat = np.empty(0)
+        self._lon = np.empty(0)
+        self._km = np.empty((0, 0))       # capacity-sized; valid block is [:n, :n]
+        self._start_km = np.empty(0)
+        self._mins: Dict[tuple, tuple] = {}  # (speed_kmh, factor) -> (mins matrix, start mins)
+
+    @property
+    def km(self) -> np.ndarray:
+        return self._km[:self.n, :self.n]
+
+    @property
+    def start_km(self) -> np.ndarray:
+        return self._start_km[:self.n]
+
+    def add(self, lats, lons, arrays: Optional[Dict[str, np.ndarray]] = None):
+        """Add POIs; arrays may hold their prebuilt "km" and "start_km" (used as-is, e.g. memory-mapped)."""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        m = len(lats)
+        if m == 0:
+            return
+        n, total = self.n, self.n + m
+        if self.dense and total > self.dense_max:
+            self.dense = False
+            self._km = np.empty((0, 0))
+            self._mins.clear()
+        if arrays is not None and "start_km" in arrays and n == 0 and (not self.dense or "km" in arrays):
+            self._lat, self._lon = lats.copy(), lons.copy()
+            self._start_km = arrays["start_km"]
+            if self.dense:
+                self._km = arrays["km"]
+            self.n = total
+            self._mins.clear()
+            return
 
-    # sort by "earliest closing" as MRV-like heuristic
-    candidates.sort(key=lambda p: minutes(p["open_to"]))
-    candidates = candidates[:8]  # keep the search tiny
+        # grow storage geometrically so repeated small adds stay cheap
+        cap = len(self._lat)
+        if total > cap:
+            new_cap = max(total, 2 * cap, 16)
+            if self.dense:
+                grown = np.zeros((new_cap, new_cap))
+                grown[:n, :n] = self._km[:n, :n]
+                self._km = grown
+            self._lat = np.resize(self._lat, new_cap)
+            self._lon = np.resize(self._lon, new_cap)
+            self._start_km = np.resize(self._start_km, new_cap)
+
+        self._lat[n:total] = lats
+        self._lon[n:total] = lons
+
+        if self.dense:
+            # only rows/cols touching new POIs need fresh trig
+            block = _haversine_km(
+                lats[:, None], lons[:, None],
+                self._lat[None, :total], self._lon[None, :total],
+            )
+            self._km[n:total, :total] = block
+            self._km[:n, n:total] = block[:, :n].T
+        self._start_km[n:total] = _haversine_km(self.start["lat"], self.start["lon"], lats, lons)
+
+        self.n = total
+        self._mins.clear()
+
+    def replace(self, i: int, lat: float, lon: float):
+        """Move POI i to (lat, lon): only its row, column and Start distance are recomputed."""
+        if not self._start_km.flags.writeable:
+            # prebuilt (memory-mapped) matrices are read-only: take a private copy first
+            self._start_km = np.array(self.start_km)
+            if self.dense:
+                self._km = np.array(self.km)
+        self._lat[i], self._lon[i] = lat, lon
+        if self.dense:
+            row = _haversine_km(lat, lon, self._lat[:self.n], self._lon[:self.n])
+            self._km[i, :self.n] = row
+            self._km[:self.n, i] = row
+        self._start_km[i] = _haversine_km(self.start["lat"], self.start["lon"], lat, lon)
+        self._mins.clear()
+
+    def minutes(self, speed_kmh: float, factor: float = 1.0):
+        """
+        (n x n travel minutes, Start -> POI minutes) at this speed with legs
+        stretched by factor (cached); factor 1 mirrors haversine_mins.
+        Dense matrices only: use from_poi()/between() for any size.
+        """
+        key = (speed_kmh, factor)
+        cached = self._mins.get(key)
+        if cached is None:
+            if factor == 1.0:
+                cached = (_km_to_minutes(self.km, speed_kmh), _km_to_minutes(self.start_km, speed_kmh))
+            else:
+                cached = tuple(slow_down(m, factor) for m in self.minutes(speed_kmh))
+            self._mins[key] = cached
+        return cached
+
+    def slices(self, mode: TravelMode) -> List[tuple]:
+        """minutes() for every time slice of mode."""
+        return [self.minutes(mode.speed_kmh, f) for f in mode.slice_factors]
+
+    def km_between(self, rows, cols) -> np.ndarray:
+        """len(rows) x len(cols) km between POIs."""
+        if self.dense:
+            return self._km[np.ix_(rows, cols)]
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        return _haversine_km(self._lat[rows, None], self._lon[rows, None], self._lat[None, cols], self._lon[None, cols])
+
+    def between(self, rows, cols, speed_kmh: float, factor: float = 1.0) -> np.ndarray:
+        """len(rows) x len(cols) travel minutes between POIs at this speed and factor."""
+        if self.dense:
+            return self.minutes(speed_kmh, factor)[0][np.ix_(rows, cols)]
+        return _km_to_minutes(self.km_between(rows, cols), speed_kmh, factor)
+
+    def from_poi(self, i: int, speed_kmh: float, factor: float = 1.0, to=None) -> np.ndarray:
+        """Travel minutes from i (or START) to every POI (or just the indices in to)."""
+        if self.dense:
+            mins, start_mins = self.minutes(speed_kmh, factor)
+            base = start_mins if i == START else mins[i]
+            return base if to is None else base[to]
+        cols = slice(0, self.n) if to is None else to
+        if i == START:
+            return _km_to_minutes(self._start_km[cols], speed_kmh, factor)
+        return _km_to_minutes(_haversine_km(self._lat[i], self._lon[i], self._lat[cols], self._lon[cols]),
+                              speed_kmh, factor)
+
+    def row(self, i: int, mode: TravelMode, dow: Optional[int], t: int, to=None) -> np.ndarray:
+        """Travel minutes from i (or START) to every POI (or just the indices in to), leaving at minute t."""
+        return self.from_poi(i, mode.speed_kmh, mode.slice_factors[mode.slice_at(dow, t)], to)
+
+    def from_point(self, lat: float, lon: float, speed_kmh: float, factor: float = 1.0) -> np.ndarray:
+        """Travel minutes from any point to every POI, at this speed and factor (not cached)."""
+        km = _haversine_km(lat, lon, self._lat[:self.n], self._lon[:self.n])
+        return _km_to_minutes(km, speed_kmh, factor)
+
+    def travel_mins(self, i: int, j: int, mode: TravelMode, dow: Optional[int], t: int) -> int:
+        """Travel minutes from i (or START) to POI j, leaving at minute t of weekday dow."""
+        factor = mode.slice_factors[mode.slice_at(dow, t)]
+        if not self.dense:
+            return int(self.from_poi(i, mode.speed_kmh, factor, to=[j])[0])
+        mins, start_mins = self.minutes(mode.speed_kmh, factor)
+        return int(start_mins[j] if i == START else mins[i, j])
+
+    def nbytes(self) -> int:
+        """Memory held by the km matrix and every cached minutes matrix."""
+        cached = sum(mins.nbytes + start_mins.nbytes for mins, start_mins in self._mins.values())
+        # prebuilt matrices are views of shared memory-mapped artifacts
+        own = self._km.nbytes + self._start_km.nbytes if self._start_km.flags.owndata else 0
+        return own + self._lat.nbytes + self._lon.nbytes + cached
+
+
+# --------- OPENING HOURS ---------
+# per-weekday hours come from the CSV's optional "hours" column and apply with
+# use_live_constraints; otherwise every day uses open_from/open_to
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")  # index == parse_day_of_week()
+CLOSED = -1  # opening and closing minute on a day a POI is closed
+
+
+def parse_week_hours(spec: str, open_from: int, open_to: int) -> Tuple[List[int], List[int]]:
+    """
+    (opening minutes, closing minutes) per weekday. spec lists the days that
+    differ from open_from/open_to, separated by ";": "sun closed",
+    "sat-sun 10:00-18:00", "mon closed; fri 09:00-21:00" (ranges may wrap).
+    """
+    opens, closes = [open_from] * 7, [open_to] * 7
+    for part in filter(None, (p.strip() for p in (spec or "").split(";"))):
+        days, _, value = part.partition(" ")
+        first, _, last = days.lower().partition("-")
+        if first not in WEEKDAYS or (last or first) not in WEEKDAYS:
+            raise ValueError(f"bad weekday in hours {spec!r}")
+        value = value.strip().lower()
+        if value == "closed":
+            hours = (CLOSED, CLOSED)
+        else:
+            frm, _, to = value.partition("-")
+            hours = (minutes(frm), minutes(to))
+        d, stop = WEEKDAYS.index(first), WEEKDAYS.index(last or first)
+        while True:
+            opens[d], closes[d] = hours
+            if d == stop:
+                break
+            d = (d + 1) % 7
+    return opens, closes
+
+
+class OpeningIndex:
+    """
+    One weekday's latest-arrival windows as a sorted endpoint array: order
+    holds the POIs open that day by latest arrival (closing minute - dwell).
+    Everything that can still be entered at minute t is a suffix of order
+    found by bisection, so queries late in the day skip the POIs that have
+    closed already instead of scanning them.
+    """
 
-    best_route: list = []
-    best_score: float = float("-inf")
+    def __init__(self, open_from: np.ndarray, latest: np.ndarray, is_open: np.ndarray):
+        idx = np.flatnonzero(is_open)
+        self.order = idx[np.argsort(latest[idx], kind="stable")]
+        self.latest = latest[self.order]
+        self.open_from = open_from[self.order]
+        for arr in (self.order, self.latest, self.open_from):
+            arr.flags.writeable = False
 
-    def backtrack(idx: int, current_time: int, current_budget: float, chosen: list, score_sum: float):
-        nonlocal best_route, best_score
+    def first_enterable(self, t: int) -> int:
+        """Position in order of the first POI that can still be entered at minute t or later."""
+        return int(np.searchsorted(self.latest, t, side="left"))
 
-        if idx == len(candidates):
-            if score_sum > best_score:
-                best_score = score_sum
-                best_route = list(chosen)
-            return
+    def enterable_after(self, t: int) -> np.ndarray:
+        """POIs that can still be entered at t or later (waiting for them to open)."""
+        return self.order[self.first_enterable(t):]
 
-        # Option 1: skip this POI
-        backtrack(idx + 1, current_time, current_budget, chosen, score_sum)
+    def enterable_at(self, t: int) -> np.ndarray:
+        """POIs that are open at t with time left for their dwell."""
+        k = self.first_enterable(t)
+        return self.order[k:][self.open_from[k:] <= t]
 
-        # Option 2: try to include this POI
-        p = candidates[idx]
-        open_from = minutes(p["open_from"])
-        open_to = minutes(p["open_to"])
-        dwell = p["avg_dwell_min"]
 
-        # ensure we respect time & budget (ignoring travel here)
-        arrive = max(current_time, open_from)
+# --------- COLUMNAR POI STORE ---------
+# score vectors / open-today masks PoiColumns keeps before starting over
+COLUMN_MEMO_SIZE = 256
 
-        if arrive + dwell > end:
-            return
 
-        if current_budget - p["admission_cost"] < 0:
-            return
+class PoiColumns:
+    """
+    POI attributes as parallel NumPy arrays (row i == catalog.records[i]), so
+    planners can test every candidate with a few vector ops instead of a Python loop.
+    - open/close times are parsed to minutes once; week_from/week_to hold
+      them per weekday (7 x n, CLOSED on closed days)
+    - categories are stored as integer codes into self.categories
+    - base_score holds the strategy-only part of score() per strategy family
+    - score vectors, per-day hours and OpeningIndexes are memoized (read-only),
+      so requests and /plan/batch entries with the same inputs share them
+    """
 
-        if not (open_from <= arrive <= open_to - dwell):
+    def __init__(self):
+        self.n = 0
+        self.categories: List[str] = []
+        self.category_codes: Dict[str, int] = {}
+        self.index: Dict[str, int] = {}  # poi id -> row
+        self.lat = np.empty(0)
+        self.lon = np.empty(0)
+        self.open_from = np.empty(0, dtype=np.int64)
+        self.open_to = np.empty(0, dtype=np.int64)
+        self.week_from = np.empty((7, 0), dtype=np.int64)
+        self.week_to = np.empty((7, 0), dtype=np.int64)
+        self.dwell = np.empty(0, dtype=np.int64)
+        self.cost = np.empty(0)
+        self.cat = np.empty(0, dtype=np.int64)
+        self.base_score = {fam: np.empty(0) for fam in STRATEGY_WEIGHTS}
+        self._memo: Dict[tuple, np.ndarray] = {}
+        self._indexes: Dict[tuple, OpeningIndex] = {}
+
+    def _memoized(self, key: tuple, build) -> np.ndarray:
+        arr = self._memo.get(key)
+        if arr is None:
+            arr = build()
+            arr.flags.writeable = False
+            if len(self._memo) >= COLUMN_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[key] = arr
+        return arr
+
+    def _cat_code(self, cat: str) -> int:
+        code = self.category_codes.get(cat)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(cat)
+            self.category_codes[cat] = code
+        return code
+
+    def add(self, rows: List["Poi"], arrays: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Append rows. arrays may hold their lat/lon/open_from/open_to/week_from/
+        week_to/dwell/cost/cat columns already built (e.g. memory-mapped, with cat coded in order of
+        first appearance) and "base_score" per strategy family; an empty store
+        uses them as they are, without a copy.
+        """
+        if not rows:
             return
+        for k, p in enumerate(rows):
+            self.index[p.id] = self.n + k
+        cats = [p.cat for p in rows]
+
+        prebuilt = arrays is not None and self.n == 0
+        if prebuilt:
+            for c in cats:
+                self._cat_code(c)
+            self.lat, self.lon = arrays["lat"], arrays["lon"]
+            self.open_from, self.open_to = arrays["open_from"], arrays["open_to"]
+            self.week_from, self.week_to = arrays["week_from"], arrays["week_to"]
+            self.dwell, self.cost, self.cat = arrays["dwell"], arrays["cost"], arrays["cat"]
+        else:
+            self.lat = np.concatenate([self.lat, [p.lat for p in rows]])
+            self.lon = np.concatenate([self.lon, [p.lon for p in rows]])
+            self.open_from = np.concatenate([self.open_from, [p.open_from_min for p in rows]])
+            self.open_to = np.concatenate([self.open_to, [p.open_to_min for p in rows]])
+            week = [parse_week_hours(p.hours, p.open_from_min, p.open_to_min) for p in rows]
+            self.week_from = np.concatenate([self.week_from, np.array([w[0] for w in week]).T], axis=1)
+            self.week_to = np.concatenate([self.week_to, np.array([w[1] for w in week]).T], axis=1)
+            self.dwell = np.concatenate([self.dwell, [p.avg_dwell_min for p in rows]])
+            self.cost = np.concatenate([self.cost, [p.admission_cost for p in rows]])
+            self.cat = np.concatenate([self.cat, [self._cat_code(c) for c in cats]]).astype(np.int64)
+        if prebuilt and "base_score" in arrays:
+            self.base_score = dict(arrays["base_score"])
+        else:
+            for fam in STRATEGY_WEIGHTS:
+                fresh = [base_score(p.price_tier, c, STRATEGY_WEIGHTS[fam]) for p, c in zip(rows, cats)]
+                self.base_score[fam] = np.concatenate([self.base_score[fam], fresh])
+        self.n += len(rows)
+        self._memo.clear()
+        self._indexes.clear()
+
+    def replace(self, i: int, p: "Poi"):
+        """Overwrite row i with p's attributes (memory-mapped columns are copied first)."""
+        opens, closes = parse_week_hours(p.hours, p.open_from_min, p.open_to_min)
+        for name in ("lat", "lon", "open_from", "open_to", "week_from", "week_to", "dwell", "cost", "cat"):
+            arr = getattr(self, name)
+            if not arr.flags.writeable:
+                setattr(self, name, np.array(arr))
+        self.base_score = {fam: s if s.flags.writeable else np.array(s) for fam, s in self.base_score.items()}
+
+        self.lat[i], self.lon[i] = p.lat, p.lon
+        self.open_from[i], self.open_to[i] = p.open_from_min, p.open_to_min
+        self.week_from[:, i], self.week_to[:, i] = opens, closes
+        self.dwell[i], self.cost[i] = p.avg_dwell_min, p.admission_cost
+        self.cat[i] = self._cat_code(p.cat)
+        for fam, w in STRATEGY_WEIGHTS.items():
+            self.base_score[fam][i] = base_score(p.price_tier, p.cat, w)
+        self._memo.clear()
+        self._indexes.clear()
+
+    def score_vector(self, ctx: ScoringContext) -> np.ndarray:
+        """score() for every POI: base score plus per-category like/learned bonuses."""
+        family = strategy_family(ctx.strategy)
+        key = ("score", family, ctx.likes, tuple(sorted(ctx.learned.items())))
+
+        def build():
+            like = np.array([1.0 if c in ctx.likes else 0.0 for c in self.categories])
+            learned = np.array([ctx.learned.get(c, 0.0) for c in self.categories])
+            return self.base_score[family] + like[self.cat] + learned[self.cat]
+
+        return self._memoized(key, build)
+
+    def hours(self, dow: Optional[int], use_live: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """(opening, closing) minute per POI on weekday dow; open_from/open_to unless live."""
+        if not use_live or dow is None:
+            return self.open_from, self.open_to
+        return self.week_from[dow], self.week_to[dow]
+
+    def latest_arrival(self, dow: Optional[int], use_live: bool) -> np.ndarray:
+        """Latest arrival per POI on weekday dow that still leaves time for its dwell."""
+        day = dow if use_live else None
+        return self._memoized(("latest", day), lambda: self.hours(day, use_live)[1] - self.dwell)
+
+    def open_today_mask(self, dow: Optional[int], use_live: bool) -> np.ndarray:
+        """POIs not closed on weekday dow."""
+        day = dow if use_live else None
+        return self._memoized(("open", day), lambda: self.hours(day, use_live)[1] != CLOSED)
+
+    def opening_index(self, dow: Optional[int], use_live: bool) -> OpeningIndex:
+        """OpeningIndex of weekday dow (built once per day and catalog)."""
+        day = dow if use_live else None
+        index = self._indexes.get(day)
+        if index is None:
+            index = OpeningIndex(self.hours(day, use_live)[0], self.latest_arrival(day, use_live),
+                                 self.open_today_mask(day, use_live))
+            self._indexes[day] = index
+        return index
+
+    def mask_of(self, ids) -> np.ndarray:
+        mask = np.zeros(self.n, dtype=bool)
+        rows = [self.index[x] for x in ids if x in self.index]
+        mask[rows] = True
+        return mask
+
+
+# --------- SPATIAL INDEX ---------
+KM_PER_DEG = 6371 * math.pi / 180   # great-circle km per degree of latitude
+KM_PER_MILE = 1.609344
+GRID_CELL_DEG = 0.01                # ~1.1 km grid cells
+
+
+class GridIndex:
+    """
+    Uniform lat/lon grid over POI coordinates (row i == catalog.records[i]).
+    POIs are kept sorted by cell key, so every grid row of a query box is
+    one contiguous slice found with searchsorted.
+    - bbox(): POIs inside a lat/lon box
+    - within(): POIs within a great-circle radius (same formula as TRAVEL)
+    - nearest(): the k closest POIs
+    """
 
-        chosen.append(p)
-        backtrack(
-            idx + 1,
-            arrive + dwell,
-            current_budget - p["admission_cost"],
-            chosen,
-            score_sum + score(p, req.strategy),
+    def __init__(self, cell_deg: float = GRID_CELL_DEG):
+        self.cell = cell_deg
+        self.stride = int(math.ceil(360 / cell_deg)) + 1  # cells per grid row
+        self.lat = np.empty(0)
+        self.lon = np.empty(0)
+        self._keys = np.empty(0, dtype=np.int64)   # sorted cell keys
+        self._order = np.empty(0, dtype=np.int64)  # POI index for each sorted key
+
+    @property
+    def n(self) -> int:
+        return len(self.lat)
+
+    def _rows_cols(self, lat, lon):
+        rows = np.floor((np.asarray(lat) + 90) / self.cell).astype(np.int64)
+        cols = np.floor((np.asarray(lon) + 180) / self.cell).astype(np.int64)
+        return rows, cols
+
+    def add(self, lats, lons):
+        self.lat = np.concatenate([self.lat, np.asarray(lats, dtype=float)])
+        self.lon = np.concatenate([self.lon, np.asarray(lons, dtype=float)])
+        self._sort()
+
+    def replace(self, i: int, lat: float, lon: float):
+        self.lat[i], self.lon[i] = lat, lon
+        self._sort()
+
+    def _sort(self):
+        rows, cols = self._rows_cols(self.lat, self.lon)
+        keys = rows * self.stride + cols
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    def bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> np.ndarray:
+        """Sorted indices of POIs with min_lat <= lat <= max_lat and min_lon <= lon <= max_lon."""
+        if self.n == 0 or min_lat > max_lat or min_lon > max_lon:
+            return np.empty(0, dtype=np.int64)
+        (r0, r1), (c0, c1) = self._rows_cols([min_lat, max_lat], [min_lon, max_lon])
+        row_base = np.arange(r0, r1 + 1) * self.stride
+        lo = np.searchsorted(self._keys, row_base + c0, side="left")
+        hi = np.searchsorted(self._keys, row_base + c1, side="right")
+        hits = np.concatenate([self._order[a:b] for a, b in zip(lo.tolist(), hi.tolist())])
+        inside = (
+            (self.lat[hits] >= min_lat) & (self.lat[hits] <= max_lat)
+            & (self.lon[hits] >= min_lon) & (self.lon[hits] <= max_lon)
         )
-        chosen.pop()
+        return np.sort(hits[inside])
+
+    def distances_km(self, lat: float, lon: float, idx: np.ndarray) -> np.ndarray:
+        return _haversine_km(lat, lon, self.lat[idx], self.lon[idx])
+
+    def within(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Sorted indices of POIs at most radius_km away."""
+        if radius_km < 0:
+            return np.empty(0, dtype=np.int64)
+        dlat = radius_km / KM_PER_DEG
+        if abs(lat) + dlat >= 90:
+            box = np.arange(self.n)  # circle reaches a pole: check everything
+        else:
+            # a degree of longitude is shortest at the box edge farthest from the equator
+            dlon = min(180.0, dlat / math.cos(math.radians(abs(lat) + dlat)))
+            box = self.bbox(lat - dlat, max(-180.0, lon - dlon), lat + dlat, min(180.0, lon + dlon))
+        return box[self.distances_km(lat, lon, box) <= radius_km]
+
+    def nearest(self, lat: float, lon: float, k: int) -> np.ndarray:
+        """Indices of the k POIs closest to (lat, lon), nearest first."""
+        k = min(k, self.n)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        # widen the radius until it holds k POIs; those include the k nearest
+        radius = self.cell * KM_PER_DEG
+        hits = self.within(lat, lon, radius)
+        while len(hits) < k and radius < math.pi * 6371:
+            radius *= 2
+            hits = self.within(lat, lon, radius)
+        if len(hits) < k:
+            hits = np.arange(self.n)
+        dist = self.distances_km(lat, lon, hits)
+        return hits[np.argsort(dist, kind="stable")[:k]]
+
+
+def reach_km(speed_kmh: float, mins_left: int) -> float:
+    """Farthest great-circle distance a leg of at most mins_left whole minutes can cover."""
+    # travel minutes are floored, so anything under mins_left + 1 still fits
+    return max(speed_kmh, 1e-6) * (mins_left + 1) / 60
+
+
+def within_max_distance(req: PlanReq, catalog: "PoiCatalog") -> np.ndarray:
+    """Mask of the catalog's POIs within req.max_distance_miles of its Start (all POIs if unset)."""
+    mask = np.ones(catalog.columns.n, dtype=bool)
+    if req.max_distance_miles is not None:
+        mask[:] = False
+        start = catalog.start
+        mask[catalog.spatial.within(start["lat"], start["lon"], req.max_distance_miles * KM_PER_MILE)] = True
+    return mask
+
+
+@dataclass(frozen=True)
+class DayStart:
+    """
+    Where, when and with how much budget a day's route begins.
+    idx is START for the Start location, a POI index when starting at a
+    POI, or None for any other point (e.g. the user's position in /replan).
+    end is when the route has to be done (None: the request's end_time).
+    """
+    name: str
+    lat: float
+    lon: float
+    time: int
+    budget: float
+    idx: Optional[int] = START
+    end: Optional[int] = None
 
-    backtrack(0, start, budget_per_day, [], 0.0)
 
-    if not best_route:
-        return [], []
+def day_candidate_mask(catalog: "PoiCatalog", req: PlanReq, dow: Optional[int], start: int, end: int,
+                       budget: float, mode: TravelMode, origin: Optional[DayStart] = None) -> np.ndarray:
+    """
+    The catalog's POIs open today, reachable from origin (its Start by
+    default), that could fit into [start, end] and the budget on their own.
+    """
+    cols = catalog.columns
+    lat, lon = (origin.lat, origin.lon) if origin else (catalog.start["lat"], catalog.start["lon"])
+    reachable = np.zeros(cols.n, dtype=bool)
+    reachable[catalog.spatial.within(lat, lon, reach_km(mode.reach_speed_kmh, end - start))] = True
+    enterable = np.zeros(cols.n, dtype=bool)
+    enterable[cols.opening_index(dow, req.use_live_constraints).enterable_after(start)] = True
+    open_from = cols.hours(dow, req.use_live_constraints)[0]
+    return (
+        enterable
+        & reachable
+        & within_max_distance(req, catalog)
+        & (np.maximum(open_from, start) + cols.dwell <= end)
+        & (budget - cols.cost >= 0)
+    )
 
-    # Convert best_route into route/legs without travel (legs eta=0)
-    route_day = []
-    legs_day = []
-    t = start
-    cur_name = "Start"
-    for p in best_route:
-        open_from = minutes(p["open_from"])
-        t = max(t, open_from)
-        start_str = f"{t // 60:02d}:{t % 60:02d}"
-        end_t = t + p["avg_dwell_min"]
-        end_str = f"{end_t // 60:02d}:{end_t % 60:02d}"
 
-        legs_day.append({
-            "from": cur_name,
-            "to": p["name"],
-            "mode": req.mobility,
-            "eta_min": 0,
-            "day": day,
-        })
-        cur_name = p["name"]
+def day_start(req: PlanReq, catalog: "PoiCatalog") -> DayStart:
+    """The usual start of a day: the catalog's Start at start_time with the daily budget."""
+    return DayStart("Start", catalog.start["lat"], catalog.start["lon"],
+                    minutes(req.start_time), req.budget_total / (req.days or 1))
 
-        route_day.append({
-            "poi_id": p["id"],
-            "name": p["name"],
-            "start": start_str,
-            "end": end_str,
-            "dwell_min": p["avg_dwell_min"],
-            "admission_est": p["admission_cost"],
-            "day": day,
-        })
 
-        t = end_t
-        used_pois.add(p["id"])
+def day_end(req: PlanReq, origin: DayStart) -> int:
+    """When a route starting at origin has to be done."""
+    return minutes(req.end_time) if origin.end is None else origin.end
 
-    return route_day, legs_day
 
+def origin_minutes(travel: "TravelMatrix", origin: DayStart, mode: TravelMode, k: int) -> np.ndarray:
+    """Travel minutes from origin to every POI in time slice k of mode."""
+    if origin.idx is None:
+        return travel.from_point(origin.lat, origin.lon, mode.speed_kmh, mode.slice_factors[k])
+    return travel.from_poi(origin.idx, mode.speed_kmh, mode.slice_factors[k])
 
-# --------- SINGLE-DAY A* PLANNER ---------
-def astar_plan_one_day(
-    req: PlanReq,
-    day: int,
-    used_pois: set,
-    speed_kmh: float,
-    dow: Optional[int],
-):
+
+def candidate_travel(travel: "TravelMatrix", cand_pos: np.ndarray, mode: TravelMode,
+                     origin: DayStart) -> np.ndarray:
     """
-    A* over a small candidate set.
-    - State: (time, budget, visited_mask, last_idx)
-    - Cost g = -sum(score(p)) so far (we want to maximize score)
-    - Heuristic h = 0 (still valid A*; just less pruned)
+    (slices, K + 1, K) travel minutes between K candidates in every time slice
+    of mode; row K (index -1) holds the legs from origin.
     """
+    return np.stack([
+        np.vstack([travel.between(cand_pos, cand_pos, mode.speed_kmh, f), origin_minutes(travel, origin, mode, k)[cand_pos]])
+        for k, f in enumerate(mode.slice_factors)
+    ])
 
-    start = minutes(req.start_time)
-    end = minutes(req.end_time)
-    days = req.days or 1
-    budget_per_day = req.budget_total / days
 
-    # Candidate pool: open today & not previously used
-    cand_list = []
-    for p in POIS:
-        if p["id"] in used_pois:
-            continue
-        if not is_poi_open_today(p, dow, req.use_live_constraints):
-            continue
-        cand_list.append(p)
+def knapsack_bound(base_np: np.ndarray, c_score: List[float], c_dwell: List[int], c_cost: List[float],
+                   c_latest: List[int], end: int) -> Callable[..., float]:
+    """
+    Fractional-knapsack upper bound for the exact day planners (CSP, A*):
+    bound(excluded, time, budget, first=0) is the most extra score candidates
+    first.. that are not in the bitmask excluded could still add.
+    - base_np is candidate_travel's matrix; each item weighs its dwell plus
+      the cheapest way into it over every time slice
+    - only positive scores count, taken best score per minute first
+    """
+    K = len(c_score)
+    into = base_np.min(axis=0)
+    into[np.arange(K), np.arange(K)] = np.iinfo(into.dtype).max
+    min_in = into.min(axis=0).tolist()
+    weight = [c_dwell[j] + min_in[j] for j in range(K)]
+    ratio_order = sorted(
+        (j for j in range(K) if c_score[j] > 0),
+        key=lambda j: c_score[j] / weight[j] if weight[j] else math.inf,
+        reverse=True,
+    )
 
-    # limit to top K by static score to keep state small
-    cand_list.sort(key=lambda p: score(p, req.strategy), reverse=True)
-    cand_list = cand_list[:8]
+    def bound(excluded: int, time: int, budget: float, first: int = 0) -> float:
+        cap = end - time
+        ub = 0.0
+        for j in ratio_order:
+            if j < first or excluded >> j & 1 or budget - c_cost[j] < 0 or c_latest[j] < time + min_in[j]:
+                continue
+            if weight[j] <= cap:
+                ub += c_score[j]
+                cap -= weight[j]
+            else:
+                ub += c_score[j] * cap / weight[j]
+                break
+        return ub
 
-    if not cand_list:
-        return [], [], 0
+    return bound
 
-    # Build A* frontier
-    start_node = AStarNode(
-        f=0.0,
-        g=0.0,
-        time=start,
-        budget=budget_per_day,
-        cur_idx=-1,
-        visited_mask=0,
-        route=[],
-        legs=[],
+
+# --------- POI CATALOG ---------
+class Poi:
+    """
+    One catalog row. Strings are interned (categories, tiers and hours repeat
+    across rows) and opening hours are pre-parsed to minutes.
+    """
+    __slots__ = (
+        "index", "id", "name", "lat", "lon", "category", "price_tier",
+        "open_from", "open_to", "hours", "avg_dwell_min", "admission_cost",
+        "cat", "open_from_min", "open_to_min",
     )
-    frontier: List[AStarNode] = []
-    heappush(frontier, start_node)
 
-    best_node = start_node
-    visited_states = {}
+    def __init__(self, row: Dict, index: int):
+        self.index = index
+        self.id = sys.intern(str(row["id"]))
+        self.name = str(row["name"])
+        self.lat = float(row["lat"])
+        self.lon = float(row["lon"])
+        self.category = sys.intern(str(row["category"]))
+        self.price_tier = sys.intern(str(row["price_tier"]))
+        self.open_from = sys.intern(str(row["open_from"]))
+        self.open_to = sys.intern(str(row["open_to"]))
+        self.hours = sys.intern(str(row.get("hours") or ""))  # per-weekday exceptions (parse_week_hours)
+        self.avg_dwell_min = int(row["avg_dwell_min"])
+        self.admission_cost = float(row["admission_cost"])
+        self.cat = sys.intern(self.category.lower())  # scoring / filtering key
+        self.open_from_min = minutes(self.open_from)
+        self.open_to_min = minutes(self.open_to)
+
+    def to_dict(self) -> Dict:
+        """Same fields and types as a parsed CSV row."""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "lat": self.lat,
+            "lon": self.lon,
+            "category": self.category,
+            "price_tier": self.price_tier,
+            "open_from": self.open_from,
+            "open_to": self.open_to,
+            "hours": self.hours,
+            "avg_dwell_min": self.avg_dwell_min,
+            "admission_cost": self.admission_cost,
+        }
+
+
+class PoiCatalog:
+    """
+    One city's POI catalog and everything precomputed from it (row i everywhere):
+    - records (Poi), by_id and by_category indexes
+    - columns / travel / spatial: the vectorized views the planners use
+    - start: where the city's days begin
+    - the /pois JSON, serialized once per POI and once per content encoding for the full list
+    - version and changes: its CatalogChangeLog history, for /pois ETags and since= deltas
+    - identity: which rows these are, for PLAN_POOL workers (see __reduce__):
+      the artifacts' digest when loaded from them, a fresh token after every add()
+    add() extends all of them in place (and counts as a new version); a row
+    with an id the catalog already has overwrites that POI's row instead.
+    """
 
-    expansions = 0
-    while frontier:
-        node = heappop(frontier)
-        expansions += 1
-
-        # If this node is better than the best we've seen, keep it
-        if node.g < best_node.g:  # remember g is negative total score
-            best_node = node
-
-        # expand
-        for i, p in enumerate(cand_list):
-            mask = 1 << i
-            if node.visited_mask & mask:
-                continue
+    def __init__(self, rows=(), start=START_LOC, city: Optional[str] = None, arrays=None):
+        self.city = city
+        self.start = start
+        self.records: List[Poi] = []
+        self.by_id: Dict[str, int] = {}
+        self.by_category: Dict[str, List[int]] = defaultdict(list)
+        self.columns = PoiColumns()
+        self.travel = TravelMatrix(start)
+        self.spatial = GridIndex()
+        self._poi_json: List[bytes] = []
+        self._all_json: Optional[bytes] = None
+        self._all_encoded: Dict[Optional[str], bytes] = {}
+        self._all_etag: Optional[str] = None
+        self._deltas: Dict[int, bytes] = {}
+        self.version = 0
+        self.version_floor = 0   # the oldest version delta_json() can start from
+        self.changes: List[Tuple[int, List[str], List[str], List[str]]] = []  # (version, added, changed, removed)
+        self.identity = uuid.uuid4().hex
+        self.add(rows, arrays)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __reduce__(self):
+        # a registered city goes to PLAN_POOL workers by name; the worker uses its
+        # own (inherited or memory-mapped) copy instead of unpickling every row,
+        # provided that copy has the same identity (registered_catalog)
+        if self.city is not None and CATALOGS.peek(self.city) is self:
+            return registered_catalog, (self.city, self.identity)
+        return PoiCatalog, ([p.to_dict() for p in self.records], self.start, self.city)
+
+    def nbytes(self) -> int:
+        """Rough private memory of the catalog (memory-mapped artifacts are shared, not counted)."""
+        return self.travel.nbytes() + len(self.records) * POI_RECORD_BYTES
+
+    def add(self, rows, arrays: Optional[Dict] = None):
+        """
+        Add POI rows; arrays are their prebuilt artifacts (see PoiColumns.add,
+        TravelMatrix.add). Rows with a known id (or an id repeated in rows)
+        replace that POI in place, so every id keeps exactly one row.
+        """
+        new: List[Poi] = []
+        fresh: Dict[str, int] = {}       # id -> position in new
+        replaced: Dict[int, Poi] = {}    # row -> its new Poi
+        for row in rows:
+            pid = str(row["id"])
+            i = self.by_id.get(pid)
+            if i is not None:
+                replaced[i] = Poi(row, i)
+            elif pid in fresh:
+                k = fresh[pid]
+                new[k] = Poi(row, len(self.records) + k)
+                arrays = None  # prebuilt artifacts hold the repeated row too
+            else:
+                fresh[pid] = len(new)
+                new.append(Poi(row, len(self.records) + len(new)))
+        if not new and not replaced:
+            return
+        self.identity = uuid.uuid4().hex
+        if self.records:
+            self.version += 1
+            self.changes.append((self.version, [p.id for p in new], [p.id for p in replaced.values()], []))
+        for p in replaced.values():
+            self._replace(p)
+        if new:
+            self._append(new, arrays)
+        self._reset_json()
+
+    def _replace(self, p: Poi):
+        old = self.records[p.index]
+        if old.cat != p.cat:
+            self.by_category[old.cat].remove(p.index)
+            if not self.by_category[old.cat]:
+                del self.by_category[old.cat]
+            insort(self.by_category[p.cat], p.index)
+        self.records[p.index] = p
+        self._poi_json[p.index] = encode_json(p.to_dict())
+        self.travel.replace(p.index, p.lat, p.lon)
+        self.spatial.replace(p.index, p.lat, p.lon)
+        self.columns.replace(p.index, p)
+
+    def _append(self, new: List[Poi], arrays: Optional[Dict]):
+        for p in new:
+            self.by_id[p.id] = p.index
+            self.by_category[p.cat].append(p.index)
+            self._poi_json.append(encode_json(p.to_dict()))
+        self.records.extend(new)
+
+        lats = [p.lat for p in new]
+        lons = [p.lon for p in new]
+        self.travel.add(lats, lons, arrays)
+        self.spatial.add(lats, lons)
+        self.columns.add(new, arrays)
+
+    def _reset_json(self):
+        self._all_json = None
+        self._all_encoded = {}
+        self._all_etag = None
+        self._deltas = {}
+
+    def set_history(self, version: int, floor: int, changes):
+        """Take the version and changes (oldest first) the change log has for this catalog."""
+        self.version = version
+        self.version_floor = floor
+        self.changes = changes
+        self._reset_json()
+
+    def get(self, poi_id: str) -> Optional[Poi]:
+        i = self.by_id.get(poi_id)
+        return None if i is None else self.records[i]
+
+    def pois_json(self, indices: Optional[List[int]] = None) -> bytes:
+        """{"version": v, "pois": [...]} for all POIs (cached) or for the given rows."""
+        if indices is None:
+            if self._all_json is None:
+                self._all_json = b'{"version":%d,"pois":[' % self.version + b",".join(self._poi_json) + b"]}"
+            return self._all_json
+        return b'{"version":%d,"pois":[' % self.version + b",".join(self._poi_json[i] for i in indices) + b"]}"
+
+    def pois_etag(self) -> str:
+        """ETag of the full /pois list (cached with it)."""
+        if self._all_etag is None:
+            self._all_etag = etag_of(self.pois_json())
+        return self._all_etag
+
+    def delta_json(self, since: int) -> bytes:
+        """
+        /pois?since= body: the POIs added or changed after version since and
+        the ids removed. When the log does not reach back to since (or since
+        is newer than this catalog) it holds every POI with "reset": true, and
+        clients replace their copy instead of patching it.
+        """
+        body = self._deltas.get(since)
+        if body is not None:
+            return body
+        if self.version_floor <= since <= self.version:
+            touched = set()
+            for version, added, changed, removed in self.changes:
+                if version > since:
+                    touched.update(added, changed, removed)
+            upserts = sorted(self.by_id[pid] for pid in touched if pid in self.by_id)
+            removed = sorted(pid for pid in touched if pid not in self.by_id)
+            reset = False
+        else:
+            upserts, removed, reset = range(len(self.records)), [], True
+        body = (b'{"version":%d,"since":%d,"reset":%s,"pois":[' % (self.version, since, b"true" if reset else b"false")
+                + b",".join(self._poi_json[i] for i in upserts) + b'],"removed":' + encode_json(removed) + b"}")
+        if len(self._deltas) >= CATALOG_CHANGES_KEPT:
+            self._deltas.clear()
+        self._deltas[since] = body
+        return body
+
+    def pois_body(self, encoding: Optional[str]) -> bytes:
+        """The full /pois JSON compressed with encoding (None: as is), each variant built once."""
+        body = self._all_encoded.get(encoding)
+        if body is None:
+            body = self.pois_json() if encoding is None else compress(self.pois_json(), encoding)
+            self._all_encoded[encoding] = body
+        return body
+
+
+# --------- CITY CATALOGS ---------
+# every city with a pois_<city>_seed.csv in POI_DATA_DIR can be planned (PlanReq.city)
+POI_DATA_DIR = os.environ.get("POI_DATA_DIR", BASE_DIR)
+DEFAULT_CITY = "Boston"
+# cities not listed start their days at the centroid of their POIs
+CITY_STARTS = {"boston": START_LOC}
+
+# precomputed catalog artifacts (.npy, memory-mapped by every process), one directory
+# per city and version; bump CATALOG_FORMAT_VERSION whenever their layout changes
+CATALOG_CACHE_DIR = os.environ.get("CATALOG_CACHE_DIR", os.path.join(BASE_DIR, "catalog_cache"))
+CATALOG_FORMAT_VERSION = 3
+# loaded catalogs past this are evicted, least recently used first
+CATALOG_MEMORY_MB = float(os.environ.get("CATALOG_MEMORY_MB", "512"))
+POI_RECORD_BYTES = 1024  # rough cost of one Poi, its strings and its /pois JSON
+
+# columns stored as arrays (dtype) and the CSV fields kept as strings
+POI_ARRAY_COLUMNS = {
+    "lat": np.float64, "lon": np.float64, "cost": np.float64,
+    "open_from": np.int16, "open_to": np.int16, "week_from": np.int16, "week_to": np.int16,
+    "dwell": np.int16, "cat": np.int16,
+}
+POI_STRING_COLUMNS = ("id", "name", "category", "price_tier", "open_from", "open_to", "hours")
+
+
+def city_key(city: str) -> str:
+    """Case- and spacing-insensitive city name: "New  York" -> "new_york"."""
+    return "_".join(city.lower().split())
+
+
+def city_csv_path(key: str) -> str:
+    return os.path.join(POI_DATA_DIR, f"pois_{key}_seed.csv")
+
+
+def catalog_digest(key: str) -> str:
+    """
+    Version of a city's artifacts: a hash of its CSV bytes plus everything
+    else they are computed from (format version, start location, strategy weights).
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([CATALOG_FORMAT_VERSION, CITY_STARTS.get(key), STRATEGY_WEIGHTS],
+                        sort_keys=True, default=sorted).encode())
+    with open(city_csv_path(key), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
 
-            # check time/budget constraints
-            cur_loc = {"lat": 42.3601, "lon": -71.0589}
-            if node.cur_idx >= 0:
-                cur_loc = cand_list[node.cur_idx]
 
-            base_travel = haversine_mins(cur_loc, p, speed_kmh=speed_kmh)
-            travel = adjust_travel_mins(base_travel, node.time, req.use_live_constraints)
-            arrive = node.time + travel
+def build_catalog_artifacts(key: str, digest: str, out_dir: str):
+    """
+    Precompute a city's catalog into out_dir:
+    - one .npy per POI_ARRAY_COLUMNS entry (opening hours in minutes, per weekday
+      as 7 x n arrays, categories coded in order of first appearance, matching
+      PoiColumns) plus strings.json
+    - km.npy / start_km.npy: the TravelMatrix distances (no km.npy past
+      TRAVEL_DENSE_MAX_POIS)
+    - base_score_<family>.npy: PoiColumns.base_score per strategy family
+    - manifest.json: start location, row count and source hash
+    The directory appears atomically, so concurrent workers never see half of it.
+    """
+    rows = read_poi_csv(city_csv_path(key))
+    codes: Dict[str, int] = {}
+    week = [parse_week_hours(r.get("hours"), minutes(r["open_from"]), minutes(r["open_to"])) for r in rows]
+    arrays = {
+        "lat": [r["lat"] for r in rows],
+        "lon": [r["lon"] for r in rows],
+        "cost": [r["admission_cost"] for r in rows],
+        "open_from": [minutes(r["open_from"]) for r in rows],
+        "open_to": [minutes(r["open_to"]) for r in rows],
+        "week_from": np.array([w[0] for w in week]).reshape(-1, 7).T,
+        "week_to": np.array([w[1] for w in week]).reshape(-1, 7).T,
+        "dwell": [r["avg_dwell_min"] for r in rows],
+        "cat": [codes.setdefault(r["category"].lower(), len(codes)) for r in rows],
+    }
+    start = CITY_STARTS.get(key) or {
+        "lat": float(np.mean(arrays["lat"])), "lon": float(np.mean(arrays["lon"])), "name": "Start"}
+    travel = TravelMatrix(start)
+    travel.add(arrays["lat"], arrays["lon"])
+
+    tmp = f"{out_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(tmp, exist_ok=True)
+    for name, dtype in POI_ARRAY_COLUMNS.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(arrays[name], dtype=dtype))
+    if travel.dense:
+        np.save(os.path.join(tmp, "km.npy"), travel.km)
+    np.save(os.path.join(tmp, "start_km.npy"), travel.start_km)
+    for fam, w in STRATEGY_WEIGHTS.items():
+        scores = [base_score(r["price_tier"], r["category"].lower(), w) for r in rows]
+        np.save(os.path.join(tmp, f"base_score_{fam}.npy"), np.asarray(scores, dtype=float))
+    with open(os.path.join(tmp, "strings.json"), "w") as f:
+        json.dump({col: [str(r.get(col) or "") for r in rows] for col in POI_STRING_COLUMNS}, f)
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump({"format": CATALOG_FORMAT_VERSION, "city": key, "rows": len(rows),
+                   "digest": digest, "start": start}, f)
+    try:
+        os.rename(tmp, out_dir)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # another process built it first
+        return
 
-            open_from = minutes(p["open_from"])
-            open_to = minutes(p["open_to"])
-            dwell = p["avg_dwell_min"]
+    # older versions of this city (files stay readable to processes still mapping them)
+    prefix = f"{key}-v"
+    for name in os.listdir(CATALOG_CACHE_DIR):
+        path = os.path.join(CATALOG_CACHE_DIR, name)
+        if name.startswith(prefix) and ".tmp-" not in name and path != out_dir:
+            shutil.rmtree(path, ignore_errors=True)
 
-            if not (open_from <= arrive <= open_to - dwell):
-                continue
 
-            if arrive + dwell > end:
-                continue
+def load_city_catalog(key: str) -> PoiCatalog:
+    """
+    PoiCatalog for a city from its artifacts, built first when none match
+    the current CSV (catalog_digest); every array is memory-mapped read-only.
+    """
+    t0 = time.perf_counter()
+    digest = catalog_digest(key)
+    data_dir = os.path.join(CATALOG_CACHE_DIR, f"{key}-v{CATALOG_FORMAT_VERSION}-{digest}")
+    source = "cache"
+    if not os.path.isdir(data_dir):
+        os.makedirs(CATALOG_CACHE_DIR, exist_ok=True)
+        build_catalog_artifacts(key, digest, data_dir)
+        source = "build"
+
+    def load(name: str) -> np.ndarray:
+        # a plain ndarray view of the mapping: indexing np.memmap itself is much slower
+        return np.load(os.path.join(data_dir, f"{name}.npy"), mmap_mode="r").view(np.ndarray)
+
+    arrays = {name: load(name) for name in (*POI_ARRAY_COLUMNS, "start_km")}
+    if os.path.exists(os.path.join(data_dir, "km.npy")):
+        arrays["km"] = load("km")
+    arrays["base_score"] = {fam: load(f"base_score_{fam}") for fam in STRATEGY_WEIGHTS}
+    with open(os.path.join(data_dir, "strings.json")) as f:
+        strings = json.load(f)
+    with open(os.path.join(data_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    lat, lon = arrays["lat"], arrays["lon"]
+    rows = [
+        {
+            **{col: strings[col][i] for col in POI_STRING_COLUMNS},
+            "lat": lat[i], "lon": lon[i],
+            "avg_dwell_min": arrays["dwell"][i], "admission_cost": arrays["cost"][i],
+        }
+        for i in range(manifest["rows"])
+    ]
+    catalog = PoiCatalog(rows, manifest["start"], city=key, arrays=arrays)
+    catalog.identity = os.path.basename(data_dir)  # every process mapping these artifacts agrees
+    CATALOG_CHANGES.record(key, digest, catalog)
+    CATALOG_LOAD_LATENCY.observe(time.perf_counter() - t0, source=source)
+    return catalog
+
+
+class CatalogRegistry:
+    """
+    Per-city PoiCatalogs, loaded the first time a city is asked for.
+    - once loaded catalogs add up to more than memory_mb, the least recently
+      used are dropped (plans still running on one keep it until they finish)
+      and reloaded from their artifacts when asked for again
+    - catalogs installed with use() or extended by add_pois() are never dropped
+    - each city loads once even when several requests ask for it together
+    """
 
-            if node.budget - p["admission_cost"] < 0:
+    def __init__(self, memory_mb: float = CATALOG_MEMORY_MB):
+        self.memory_bytes = int(memory_mb * 2 ** 20)
+        self._catalogs: "OrderedDict[str, PoiCatalog]" = OrderedDict()
+        self._pinned: set = set()
+        self._loading: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _reset_locks(self):
+        # a forked child has only the forking thread: locks another thread
+        # held (e.g. while loading a city) would never be released there
+        self._loading = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def peek(self, city: str) -> Optional[PoiCatalog]:
+        """The loaded catalog of city, if any, without loading or touching it."""
+        return self._catalogs.get(city_key(city))
+
+    def get(self, city: str) -> PoiCatalog:
+        """The city's catalog, loading it if needed; KeyError for cities without a dataset."""
+        key = city_key(city)
+        with self._lock:
+            catalog = self._catalogs.get(key)
+            if catalog is not None:
+                self._catalogs.move_to_end(key)
+                self._evict(keep=key)
+                return catalog
+            if not os.path.exists(city_csv_path(key)):
+                raise KeyError(f"unknown city {city!r}")
+            loading = self._loading[key]
+
+        with loading:
+            catalog = self._catalogs.get(key)
+            if catalog is None:
+                catalog = load_city_catalog(key)
+                with self._lock:
+                    self._catalogs[key] = catalog
+                    self._evict(keep=key)
+        return catalog
+
+    def use(self, city: str, catalog: PoiCatalog):
+        """Serve city from catalog (e.g. a synthetic one) until replaced."""
+        key = city_key(city)
+        catalog.city = key
+        with self._lock:
+            self._catalogs[key] = catalog
+            self._pinned.add(key)
+
+    def pin(self, city: str):
+        with self._lock:
+            self._pinned.add(city_key(city))
+
+    def loaded(self) -> List[PoiCatalog]:
+        with self._lock:
+            return list(self._catalogs.values())
+
+    def _evict(self, keep: str):
+        total = sum(c.nbytes() for c in self._catalogs.values())
+        for key in list(self._catalogs):
+            if total <= self.memory_bytes:
+                break
+            if key == keep or key in self._pinned:
                 continue
+            total -= self._catalogs.pop(key).nbytes()
+            CATALOG_EVICTIONS.inc(city=key)
 
-            # cost / score
-            poi_score = score(p, req.strategy)
-            new_g = node.g - poi_score  # negative sum of scores
-            new_time = arrive + dwell
-            new_budget = node.budget - p["admission_cost"]
-            new_mask = node.visited_mask | mask
-
-            # record route + legs
-            new_route = list(node.route)
-            new_legs = list(node.legs)
-
-            leg_from = "Start" if node.cur_idx < 0 else cand_list[node.cur_idx]["name"]
-            leg = {
-                "from": leg_from,
-                "to": p["name"],
-                "mode": req.mobility,
-                "eta_min": travel,
-                "day": day,
-            }
-            new_legs.append(leg)
-
-            start_str = f"{arrive // 60:02d}:{arrive % 60:02d}"
-            end_str = f"{new_time // 60:02d}:{new_time % 60:02d}"
-            new_route.append({
-                "poi_id": p["id"],
-                "name": p["name"],
-                "start": start_str,
-                "end": end_str,
-                "dwell_min": dwell,
-                "admission_est": p["admission_cost"],
-                "day": day,
-            })
-
-            # Heuristic: 0 (we could add optimistic future score, but not needed)
-            h = 0.0
-            f = new_g + h
-
-            state_key = (new_mask, i)
-            if state_key in visited_states and visited_states[state_key] <= new_g:
-                continue
-            visited_states[state_key] = new_g
-
-            new_node = AStarNode(
-                f=f,
-                g=new_g,
-                time=new_time,
-                budget=new_budget,
-                cur_idx=i,
-                visited_mask=new_mask,
-                route=new_route,
-                legs=new_legs,
-            )
-            heappush(frontier, new_node)
 
-    # best_node has the highest score (lowest negative g) found
-    return best_node.route, best_node.legs, expansions
+CATALOGS = CatalogRegistry()
 
 
-# --------- MULTI-DAY WRAPPERS ---------
-def plan_multi_day_greedy(req: PlanReq, days: int, speed_kmh: float, dow: Optional[int]):
-    used_pois = set()
-    all_stops = []
-    all_legs = []
-    total_evals = 0
+def registered_catalog(city: str, identity: Optional[str] = None) -> Optional[PoiCatalog]:
+    """
+    CATALOGS.get as a plain function (how registered catalogs unpickle).
+    None when this process has no catalog for city with that identity, e.g.
+    a PLAN_POOL worker forked before use_catalog() or add_pois(); run_counted
+    refuses such tasks (raising here would kill the worker instead).
+    """
+    try:
+        catalog = CATALOGS.get(city)
+    except KeyError:
+        return None
+    if identity is not None and catalog.identity != identity:
+        return None
+    return catalog
 
-    for day in range(1, days + 1):
-        route_day, legs_day, day_evals = greedy_plan_one_day(req, day, used_pois, speed_kmh, dow)
-        total_evals += day_evals
 
-        # if greedy fails to place anything, try CSP/backtracking as a fallback
-        if not route_day:
-            route_day, legs_day = csp_fill_day_by_backtracking(req, day, used_pois, dow)
+def add_pois(rows: List[Dict], city: str = DEFAULT_CITY):
+    """
+    Add parsed POI rows to a city's catalog; every index and matrix extends in
+    place, and rows with an id the catalog has already overwrite that POI.
+    """
+    catalog = CATALOGS.get(city)
+    before = catalog.version
+    catalog.add(rows)
+    if catalog.version != before:
+        # numbered by the change log, so no other process can hand out the same version
+        CATALOG_CHANGES.record_added(city_key(city), catalog, before)
+    CATALOGS.pin(city)
 
-        all_stops.extend(route_day)
-        all_legs.extend(legs_day)
 
-    cost_summary = {
-        "admissions": sum(s["admission_est"] for s in all_stops),
-        "transport": 0,
-        "total": sum(s["admission_est"] for s in all_stops),
-    }
-    return all_stops, all_legs, cost_summary, total_evals
+def use_catalog(catalog: PoiCatalog, city: str = DEFAULT_CITY):
+    """Point /pois and the planners at another catalog for city (benchmarks, synthetic data)."""
+    CATALOGS.use(city, catalog)
+    PLAN_CACHE.clear()
 
 
-def plan_multi_day_astar(req: PlanReq, days: int, speed_kmh: float, dow: Optional[int]):
-    used_pois = set()
-    all_stops = []
-    all_legs = []
-    total_expansions = 0
+# --------- CATALOG CHANGE LOG ---------
+# SQLite file with every city's catalog versions ("" keeps them in memory only);
+# shared by all worker processes so they number versions alike
+CATALOG_CHANGES_DB = os.environ.get("CATALOG_CHANGES_DB", os.path.join(BASE_DIR, "catalog_changes.db"))
+# versions kept per city; /pois?since= older than these answers with the full list
+CATALOG_CHANGES_KEPT = int(os.environ.get("CATALOG_CHANGES_KEPT", "256"))
 
-    for day in range(1, days + 1):
-        route_day, legs_day, day_exp = astar_plan_one_day(req, day, used_pois, speed_kmh, dow)
-        total_expansions += day_exp
 
-        # if A* fails to place anything, fall back to CSP, then greedy
-        if not route_day:
-            route_day, legs_day = csp_fill_day_by_backtracking(req, day, used_pois, dow)
+def poi_hash(poi_json: bytes) -> str:
+    return hashlib.blake2b(poi_json, digest_size=8).hexdigest()
 
-        if not route_day:
-            route_day, legs_day, _ = greedy_plan_one_day(req, day, used_pois, speed_kmh, dow)
 
-        for stop in route_day:
-            used_pois.add(stop["poi_id"])
+class CatalogChangeLog:
+    """
+    Versions of each city's catalog, one per CSV content change.
+    - record() runs when a city loads: a CSV digest not seen before becomes
+      the next version, with the POI ids added, changed (by a hash of their
+      /pois JSON) and removed since the previous one
+    - the first version of a city is a baseline without ids
+    - record_added() logs each add_pois() as a version of its own (digest
+      "add_pois"); a later CSV load then lists those POIs as removed
+    - writes take SQLite's write lock (BEGIN IMMEDIATE), so processes loading
+      the same new CSV together add one version, not two
+    """
 
-        all_stops.extend(route_day)
-        all_legs.extend(legs_day)
+    def __init__(self, path: str = CATALOG_CHANGES_DB, kept: int = CATALOG_CHANGES_KEPT):
+        self.path = path
+        self.kept = kept
+        self._memory: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.path:
+            db = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+        else:
+            if self._memory is None:
+                self._memory = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+            db = self._memory
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS catalog_versions ("
+            " city TEXT, version INTEGER, digest TEXT, baseline INTEGER,"
+            " added TEXT, changed TEXT, removed TEXT, created_at REAL,"
+            " PRIMARY KEY (city, version))"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS catalog_pois ("
+            " city TEXT, poi_id TEXT, hash TEXT, PRIMARY KEY (city, poi_id))"
+        )
+        return db
+
+    def record(self, key: str, digest: str, catalog: PoiCatalog):
+        """Log catalog (loaded from the CSV with digest) and give it its version history."""
+        with self._lock:
+            db = self._connect()
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                last = db.execute(
+                    "SELECT version, digest FROM catalog_versions WHERE city = ? ORDER BY version DESC LIMIT 1",
+                    (key,),
+                ).fetchone()
+                if last is None or last[1] != digest:
+                    self._add_version(db, key, digest, catalog, last[0] if last else None)
+                rows = db.execute(
+                    "SELECT version, baseline, added, changed, removed FROM catalog_versions"
+                    " WHERE city = ? ORDER BY version",
+                    (key,),
+                ).fetchall()
+                db.execute("COMMIT")
+            except BaseException:
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+                raise
+            finally:
+                if db is not self._memory:
+                    db.close()
+
+        # since= can reach back to the baseline, or to just before the oldest change kept
+        floor = rows[0][0] if rows[0][1] else rows[0][0] - 1
+        changes = [(version, json.loads(added), json.loads(changed), json.loads(removed))
+                   for version, baseline, added, changed, removed in rows if not baseline]
+        catalog.set_history(rows[-1][0], floor, changes)
+
+    def record_added(self, key: str, catalog: PoiCatalog, before: int):
+        """
+        Renumber the change catalog.add() just made (from version before) with
+        the next version in the log. When other processes logged versions in
+        between, this catalog never held them, so since= from any version
+        before the new one answers with the full list.
+        """
+        version, added, changed, removed = catalog.changes[-1]
+        with self._lock:
+            db = self._connect()
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                (last,) = db.execute("SELECT MAX(version) FROM catalog_versions WHERE city = ?", (key,)).fetchone()
+                version = max(last or 0, before) + 1
+                db.execute(
+                    "INSERT INTO catalog_versions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, version, "add_pois", 0, json.dumps(added), json.dumps(changed),
+                     json.dumps(removed), time.time()),
+                )
+                db.executemany("INSERT OR REPLACE INTO catalog_pois VALUES (?, ?, ?)",
+                               [(key, pid, poi_hash(catalog._poi_json[catalog.by_id[pid]]))
+                                for pid in (*added, *changed)])
+                db.execute("DELETE FROM catalog_versions WHERE city = ? AND version <= ?",
+                           (key, version - self.kept))
+                db.execute("COMMIT")
+            except BaseException:
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+                raise
+            finally:
+                if db is not self._memory:
+                    db.close()
+
+        floor = catalog.version_floor if version == before + 1 else version
+        catalog.set_history(version, floor, [*catalog.changes[:-1], (version, added, changed, removed)])
+
+    def _add_version(self, db: sqlite3.Connection, key: str, digest: str, catalog: PoiCatalog,
+                     last: Optional[int]):
+        hashes = {p.id: poi_hash(catalog._poi_json[p.index]) for p in catalog.records}
+        if last is None:
+            version, baseline, added, changed, removed = 1, 1, [], [], []
+        else:
+            old = dict(db.execute("SELECT poi_id, hash FROM catalog_pois WHERE city = ?", (key,)))
+            added = sorted(hashes.keys() - old.keys())
+            removed = sorted(old.keys() - hashes.keys())
+            changed = sorted(pid for pid, h in hashes.items() if pid in old and old[pid] != h)
+            if not (added or changed or removed):
+                # same POIs (e.g. only the artifact format changed): same version
+                db.execute("UPDATE catalog_versions SET digest = ? WHERE city = ? AND version = ?",
+                           (digest, key, last))
+                return
+            version, baseline = last + 1, 0
+
+        db.execute(
+            "INSERT INTO catalog_versions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, version, digest, baseline, json.dumps(added), json.dumps(changed),
+             json.dumps(removed), time.time()),
+        )
+        db.execute("DELETE FROM catalog_pois WHERE city = ?", (key,))
+        db.executemany("INSERT INTO catalog_pois VALUES (?, ?, ?)",
+                       [(key, pid, h) for pid, h in hashes.items()])
+        db.execute("DELETE FROM catalog_versions WHERE city = ? AND version <= ?",
+                   (key, version - self.kept))
 
-    cost_summary = {
-        "admissions": sum(s["admission_est"] for s in all_stops),
-        "transport": 0,
-        "total": sum(s["admission_est"] for s in all_stops),
-    }
-    return all_stops, all_legs, cost_summary, total_expansions
 
+CATALOG_CHANGES = CatalogChangeLog()
 
-# --------- ENDPOINTS ---------
-@app.get("/pois")
-def get_pois():
-    return {"pois": POIS}
 
+# --------- INSTRUMENTATION ---------
+# Counters and histograms are updated once per search or stage, never per
+# node, so they cost a lock and a few additions per day planned.
+LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+EFFORT_BUCKETS = (1, 10, 100, 500, 1000, 2500, 5000, 10000, 50000)
 
-@app.post("/plan")
-def plan(req: PlanReq):
+# strategies reported under their own label; anything else a client sends is "other"
+STRATEGY_LABELS = {"static_budget", "static_explorer", "astar_budget", "astar_explorer", "ils_budget", "ils_explorer"}
+
+
+def strategy_label(strategy: str) -> str:
+    return strategy if strategy in STRATEGY_LABELS else "other"
+
+
+def _label_str(names, values) -> str:
+    if not names:
+        return ""
+    esc = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, esc)) + "}"
+
+
+class _Metric:
     """
-    High-level planner:
-    - Normalizes preferences.like into CURRENT_PREFS_LIKE
-    - Chooses travel speed from mobility/has_car
-    - Strategy:
-        * "astar_*" -> A* planner
-        * otherwise -> greedy + CSP fallback
-    - Adds multi-day structure and cost summary
-    - Returns extra metrics for evaluation
+    A family of labelled series; every series is a fixed-width list of floats,
+    so snapshots of it can be subtracted and merged slot by slot.
+    """
+    kind = ""
+    width = 1
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series: Dict[tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, labels: dict) -> List[float]:
+        key = tuple(str(labels[l]) for l in self.labels)
+        s = self._series.get(key)
+        if s is None:
+            s = self._series[key] = [0.0] * self.width
+        return s
+
+    def snapshot(self) -> Dict[tuple, List[float]]:
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+    def merge(self, delta: Dict[tuple, List[float]]):
+        with self._lock:
+            for key, values in delta.items():
+                s = self._series.setdefault(key, [0.0] * self.width)
+                for slot, v in enumerate(values):
+                    s[slot] += v
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            self._get(labels)[0] += amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (value,) in sorted(self.snapshot().items()):
+            lines.append(f"{self.name}{_label_str(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Series slots: one count per bucket, one for +Inf, then the sum."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets, labels=()):
+        self.buckets = tuple(buckets)
+        self.width = len(self.buckets) + 2
+        super().__init__(name, help, labels)
+
+    def observe(self, value: float, **labels):
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._get(labels)
+            s[slot] += 1
+            s[-1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, values in sorted(self.snapshot().items()):
+            cumulative = 0.0
+            for bound, n in zip((*self.buckets, "+Inf"), values[:-1]):
+                cumulative += n
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_label_str((*self.labels, 'le'), (*key, le))} {cumulative:g}")
+            labels = _label_str(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {values[-1]:g}")
+            lines.append(f"{self.name}_count{labels} {cumulative:g}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    All metrics of this process. PLAN_POOL workers send back what they
+    counted during a task (delta_since) and the parent merges it, so
+    /metrics also covers searches that ran in worker processes.
     """
 
-    global CURRENT_PREFS_LIKE
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        return {name: m.snapshot() for name, m in self.metrics.items()}
+
+    def delta_since(self, before: dict) -> dict:
+        delta = {}
+        for name, now in self.snapshot().items():
+            old = before.get(name, {})
+            changed = {}
+            for key, values in now.items():
+                prev = old.get(key)
+                diff = values if prev is None else [a - b for a, b in zip(values, prev)]
+                if any(diff):
+                    changed[key] = diff
+            if changed:
+                delta[name] = changed
+        return delta
+
+    def merge(self, delta: dict):
+        for name, series in delta.items():
+            self.metrics[name].merge(series)
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics.values():
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+PLAN_REQUESTS = METRICS.register(Counter(
+    "plan_requests_total", "Plan requests by strategy and whether PLAN_CACHE answered them.",
+    ("strategy", "cache")))
+PLAN_LATENCY = METRICS.register(Histogram(
+    "plan_latency_seconds", "Planning time of uncached plan requests.", LATENCY_BUCKETS_S, ("strategy",)))
+REPLAN_LATENCY = METRICS.register(Histogram(
+    "replan_latency_seconds", "Time to re-plan the rest of a trip in /replan.", LATENCY_BUCKETS_S))
+PLAN_TIMEOUTS = METRICS.register(Counter(
+    "plan_timeouts_total", "Plans cut short by their deadline.", ("strategy",)))
+STAGE_LATENCY = METRICS.register(Histogram(
+    "planner_stage_seconds", "Time spent in each planner stage of a day (astar, ils, csp, greedy).",
+    LATENCY_BUCKETS_S, ("stage",)))
+DAY_SOURCE = METRICS.register(Counter(
+    "planner_day_source_total",
+    "Days by planner chain and the stage that produced the route (none = empty day).",
+    ("planner", "source")))
+CANDIDATE_EVALS = METRICS.register(Counter(
+    "planner_candidate_evaluations_total", "Candidate POIs tested for feasibility.", ("planner",)))
+ASTAR_EXPANSIONS = METRICS.register(Histogram(
+    "astar_expansions", "Nodes expanded per A* search.", EFFORT_BUCKETS, ("mode",)))
+ASTAR_FRONTIER_PEAK = METRICS.register(Histogram(
+    "astar_frontier_peak", "Largest open list (heap, beam layer or stack) per A* search.",
+    EFFORT_BUCKETS, ("mode",)))
+CSP_BACKTRACK_CALLS = METRICS.register(Histogram(
+    "csp_backtrack_calls", "Backtracking calls per CSP fallback search.", EFFORT_BUCKETS))
+ILS_ITERATIONS = METRICS.register(Histogram(
+    "ils_iterations", "Perturb-and-search rounds per ILS day.", EFFORT_BUCKETS))
+CATALOG_LOAD_LATENCY = METRICS.register(Histogram(
+    "catalog_load_seconds", "Time to load a city catalog, from cached artifacts or building them first.",
+    LATENCY_BUCKETS_S, ("source",)))
+CATALOG_EVICTIONS = METRICS.register(Counter(
+    "catalog_evictions_total", "City catalogs dropped to stay under CATALOG_MEMORY_MB.", ("city",)))
+ITINERARY_WRITES = METRICS.register(Counter(
+    "itinerary_writes_total", "Rows ITINERARIES wrote behind to SQLite, by table.", ("table",)))
+ITINERARY_WRITE_ERRORS = METRICS.register(Counter(
+    "itinerary_write_errors_total", "ITINERARIES flushes that failed and were queued again."))
+ITINERARY_FLUSH_LATENCY = METRICS.register(Histogram(
+    "itinerary_flush_seconds", "Time to write one batch of queued itineraries and feedback.", LATENCY_BUCKETS_S))
+
+# PlanReq.profile: stack samples per second and how many frames the report keeps
+PROFILE_INTERVAL_S = 0.005
+PROFILE_TOP_N = 15
+
+
+class SamplingProfiler:
+    """
+    Samples the calling thread's Python stack every interval from a side
+    thread while active. report() lists the hottest functions by samples
+    at the top of the stack (self) and anywhere on it (total).
+    """
 
-    # 1) preferences.like -> CURRENT_PREFS_LIKE (normalized to match CSV categories)
-    raw_like = []
-    if isinstance(req.preferences, dict):
-        raw_like = req.preferences.get("like", []) or []
-
-    CATEGORY_MAP = {
-        "museums": "museums",
-        "museum": "museums",
-        "restaurants": "food",
-        "restaurants + cafes": "food",
-        "cafes": "food",
-        "coffee": "food",
-        "seafood": "seafood",
-        "history": "history",
-        "outdoors": "outdoors",
-        "parks": "outdoors",
-        "park": "outdoors",
-        "nightlife": "nightlife",
-        "shopping": "shopping",
+    def __init__(self, interval: float = PROFILE_INTERVAL_S):
+        self.interval = interval
+        self.samples = 0
+        self._self: Dict[str, int] = defaultdict(int)
+        self._total: Dict[str, int] = defaultdict(int)
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="plan-profiler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            self.samples += 1
+            seen = set()
+            top = True
+            while frame is not None:
+                code = frame.f_code
+                where = f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+                if top:
+                    self._self[where] += 1
+                    top = False
+                if where not in seen:  # recursion counts once per sample
+                    seen.add(where)
+                    self._total[where] += 1
+                frame = frame.f_back
+
+    def report(self, top: int = PROFILE_TOP_N) -> dict:
+        def hottest(counts):
+            ranked = sorted(counts.items(), key=lambda kv: -kv[1])[:top]
+            return [{"frame": where, "samples": n} for where, n in ranked]
+
+        return {
+            "interval_ms": self.interval * 1000.0,
+            "samples": self.samples,
+            "self": hottest(self._self),
+            "total": hottest(self._total),
+        }
+
+
+# --------- A* SEARCH STRUCT ---------
+# A* planner knobs; PlanReq.search_mode / max_candidates override them per request.
+# Exact A* stays tractable up to ~12 candidates; the bounded-memory modes take far more
+# (up to ASTAR_CANDIDATE_CAP).
+ASTAR_MAX_CANDIDATES = {"astar": 12, "beam": 40, "dfbnb": 40}
+ASTAR_BEAM_WIDTH = 64
+ASTAR_MAX_EXPANSIONS = 10000
+
+
+class AStarNode:
+    """
+    One partial route. Nodes only store the last stop and a parent pointer;
+    the full route is rebuilt from the chain once the search is done.
+    """
+    __slots__ = ("f", "g", "time", "budget", "cur_idx", "visited_mask", "parent", "arrive", "travel")
+
+    def __init__(self, f, g, time, budget, cur_idx, visited_mask, parent=None, arrive=0, travel=0):
+        self.f = f                         # g - optimistic remaining score (lower is better)
+        self.g = g                         # negative total score so far (we minimize)
+        self.time = time                   # minute we leave the last stop
+        self.budget = budget
+        self.cur_idx = cur_idx             # index into candidates, -1 for "start"
+        self.visited_mask = visited_mask
+        self.parent = parent
+        self.arrive = arrive               # arrival minute at cur_idx
+        self.travel = travel               # travel minutes of the leg into cur_idx
+
+    def __lt__(self, other):
+        # on equal bounds prefer the deeper (higher-scoring) route
+        return (self.f, self.g) < (other.f, other.g)
+
+
+# --------- SINGLE-DAY GREEDY PLANNER ---------
+def greedy_plan_one_day(
+    req: PlanReq,
+    ctx: ScoringContext,
+    day: int,
+    used_pois: set,
+    mode: TravelMode,
+    dow: Optional[int],
+    origin: Optional[DayStart] = None,
+):
+    catalog = ctx.catalog
+    origin = origin or day_start(req, catalog)
+    end = day_end(req, origin)
+
+    t = origin.time
+    cur_name = origin.name
+    cur_lat, cur_lon = origin.lat, origin.lon
+    cur_idx = origin.idx
+    budget = origin.budget
+
+    route_day = []
+    legs_day = []
+
+    cols = catalog.columns
+    scores = cols.score_vector(ctx)
+    hours = cols.opening_index(dow, req.use_live_constraints)
+    open_from = cols.hours(dow, req.use_live_constraints)[0]
+    latest_arrival = cols.latest_arrival(dow, req.use_live_constraints)
+    closed = hours.first_enterable(t)
+    avail = np.zeros(cols.n, dtype=bool)
+    avail[hours.order[closed:]] = True
+    avail &= ~cols.mask_of(used_pois) & within_max_distance(req, catalog)
+
+    evals = 0
+    while True:
+        # POIs whose latest arrival has passed never come back
+        k = hours.first_enterable(t)
+        avail[hours.order[closed:k]] = False
+        closed = k
+
+        # only POIs reachable before the day ends are worth testing
+        near = catalog.spatial.within(cur_lat, cur_lon, reach_km(mode.reach_speed_kmh, end - t))
+        cand = near[avail[near]]
+        evals += len(cand)
+
+        # travel time for the mode, leaving now
+        if cur_idx is None:  # still at a point that is not a POI
+            travel_row = origin_minutes(catalog.travel, origin, mode, mode.slice_at(dow, t))[cand]
+        else:
+            travel_row = catalog.travel.row(cur_idx, mode, dow, t, to=cand)
+        arrive = t + travel_row
+
+        feasible = (
+            # must be open and have time for dwell
+            (open_from[cand] <= arrive) & (arrive <= latest_arrival[cand])
+            # respect daily budget
+            & (budget - cols.cost[cand] >= 0)
+            # must fit in this day's time window
+            & (arrive + cols.dwell[cand] <= end)
+        )
+        if not feasible.any():
+            break
+
+        # best score wins; cand is sorted, so argmax keeps the first POI on ties
+        k = int(np.argmax(np.where(feasible, scores[cand], -np.inf)))
+        i = int(cand[k])
+        p = catalog.records[i]
+        travel = int(travel_row[k])
+
+        # leg (movement between points)
+        legs_day.append({
+            "from": cur_name,
+            "to": p.name,
+            "mode": req.mobility,
+            "eta_min": travel,
+            "day": day,
+        })
+
+        t += travel
+        start_str = f"{t // 60:02d}:{t % 60:02d}"
+        end_t = t + p.avg_dwell_min
+        end_str = f"{end_t // 60:02d}:{end_t % 60:02d}"
+
+        # record the stop; include day
+        route_day.append({
+            "poi_id": p.id,
+            "name": p.name,
+            "start": start_str,
+            "end": end_str,
+            "dwell_min": p.avg_dwell_min,
+            "admission_est": p.admission_cost,
+            "day": day,
+        })
+
+        t += p.avg_dwell_min
+        budget -= p.admission_cost
+        cur_name, cur_lat, cur_lon = p.name, p.lat, p.lon
+        cur_idx = i
+        avail[i] = False
+        used_pois.add(p.id)
+
+    CANDIDATE_EVALS.inc(evals, planner="greedy")
+    return route_day, legs_day, evals
+
+
+# --------- CSP FALLBACK (BRANCH AND BOUND) ---------
+# pool size, search time per day, and the memo's grouping of states
+CSP_MAX_CANDIDATES = 32
+CSP_TIME_LIMIT_S = 0.05
+CSP_MAX_CALLS: Optional[int] = None  # also stop after this many calls (bench.py: effort independent of load)
+CSP_TIME_BUCKET_MIN = 15
+CSP_BUDGET_BUCKET = 5.0
+
+
+def csp_fill_day_by_backtracking(
+    req: PlanReq,
+    ctx: ScoringContext,
+    day: int,
+    used_pois: set,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float] = None,
+    origin: Optional[DayStart] = None,
+):
+    """
+    Branch-and-bound fallback over the best CSP_MAX_CANDIDATES POIs:
+    - candidates are taken in order of closing time; each is skipped or
+      scheduled after the previous stop, with travel time from the catalog's TravelMatrix
+      (rush hour included) and waiting allowed until it opens
+    - a branch is pruned when its optimistic bound (fractional knapsack
+      over the remaining candidates and time) cannot beat the best route
+    - states are memoized on (index, last stop, time bucket, budget bucket);
+      one no later, no poorer and with no less score dominates the rest
+    - stops after CSP_TIME_LIMIT_S (or CSP_MAX_CALLS), or at deadline, with the best route so far
+    Returns (route, legs, backtrack calls).
+    """
+
+    catalog = ctx.catalog
+    origin = origin or day_start(req, catalog)
+    start, budget_per_day = origin.time, origin.budget
+    end = day_end(req, origin)
+
+    cols = catalog.columns
+    scores = cols.score_vector(ctx)
+    open_from, open_to = cols.hours(dow, req.use_live_constraints)
+    latest_arrival = cols.latest_arrival(dow, req.use_live_constraints)
+
+    # best-scoring candidates that can fit the day on their own, earliest closing first
+    pool = day_candidate_mask(catalog, req, dow, start, end, budget_per_day, mode, origin) & ~cols.mask_of(used_pois)
+    pool_pos = np.flatnonzero(pool)
+    top = pool_pos[np.argsort(-scores[pool_pos], kind="stable")[:CSP_MAX_CANDIDATES]]
+    cand_pos = top[np.argsort(open_to[top], kind="stable")]
+    K = len(cand_pos)
+    if K == 0:
+        return [], [], 0
+
+    c_score = scores[cand_pos].tolist()
+    c_open = open_from[cand_pos].tolist()
+    c_latest = latest_arrival[cand_pos].tolist()
+    c_dwell = cols.dwell[cand_pos].tolist()
+    c_cost = cols.cost[cand_pos].tolist()
+
+    # travel minutes between candidates per time slice; the extra last row is the origin,
+    # so last == -1 reads it
+    base_np = candidate_travel(catalog.travel, cand_pos, mode, origin)
+    base = base_np.tolist()
+    # most extra score candidates idx.. could still add: upper_bound(0, time, budget, idx)
+    upper_bound = knapsack_bound(base_np, c_score, c_dwell, c_cost, c_latest, end)
+
+    stop_at = time.time() + CSP_TIME_LIMIT_S
+    if deadline is not None:
+        stop_at = min(stop_at, deadline)
+
+    best_score = 0.0
+    best_chain = None  # (idx, arrive, travel, previous chain) of the last chosen stop
+    memo: Dict[tuple, tuple] = {}  # key -> (score, time, budget) of the last state kept
+    calls = 0
+    max_calls = CSP_MAX_CALLS
+    out_of_time = False
+
+    def backtrack(idx: int, last: int, current_time: int, current_budget: float, score_sum: float, chain):
+        nonlocal best_score, best_chain, calls, out_of_time
+        calls += 1
+
+        if score_sum > best_score:
+            best_score, best_chain = score_sum, chain
+
+        if idx == K or out_of_time:
+            return
+        # the clock (and the call cap) is only checked every 256 calls
+        if calls % 256 == 0 and (time.time() > stop_at or (max_calls is not None and calls >= max_calls)):
+            out_of_time = True
+            return
+        if score_sum + upper_bound(0, current_time, current_budget, idx) <= best_score:
+            return
+
+        key = (idx, last, current_time // CSP_TIME_BUCKET_MIN, int(current_budget // CSP_BUDGET_BUCKET))
+        seen = memo.get(key)
+        if seen is not None and seen[0] >= score_sum and seen[1] <= current_time and seen[2] >= current_budget:
+            return
+        memo[key] = (score_sum, current_time, current_budget)
+
+        # Option 1: include this POI (tried first so good routes are found early)
+        travel = base[mode.slice_at(dow, current_time)][last][idx]
+        arrive = max(current_time + travel, c_open[idx])
+        if arrive <= c_latest[idx] and arrive + c_dwell[idx] <= end and current_budget - c_cost[idx] >= 0:
+            backtrack(
+                idx + 1,
+                idx,
+                arrive + c_dwell[idx],
+                current_budget - c_cost[idx],
+                score_sum + c_score[idx],
+                (idx, arrive, travel, chain),
+            )
+
+        # Option 2: skip this POI
+        backtrack(idx + 1, last, current_time, current_budget, score_sum, chain)
+
+    backtrack(0, -1, start, budget_per_day, 0.0, None)
+    CSP_BACKTRACK_CALLS.observe(calls)
+    CANDIDATE_EVALS.inc(K, planner="csp")
+
+    # unwind the chain of chosen stops
+    chosen = []
+    while best_chain is not None:
+        idx, arrive, travel, best_chain = best_chain
+        chosen.append((idx, arrive, travel))
+    chosen.reverse()
+
+    route_day = []
+    legs_day = []
+    cur_name = origin.name
+    for idx, arrive, travel in chosen:
+        p = catalog.records[cand_pos[idx]]
+        end_t = arrive + p.avg_dwell_min
+
+        legs_day.append({
+            "from": cur_name,
+            "to": p.name,
+            "mode": req.mobility,
+            "eta_min": travel,
+            "day": day,
+        })
+        cur_name = p.name
+
+        route_day.append({
+            "poi_id": p.id,
+            "name": p.name,
+            "start": f"{arrive // 60:02d}:{arrive % 60:02d}",
+            "end": f"{end_t // 60:02d}:{end_t % 60:02d}",
+            "dwell_min": p.avg_dwell_min,
+            "admission_est": p.admission_cost,
+            "day": day,
+        })
+        used_pois.add(p.id)
+
+    return route_day, legs_day, calls
+
+
+# --------- SINGLE-DAY A* PLANNER ---------
+def astar_plan_one_day(
+    req: PlanReq,
+    ctx: ScoringContext,
+    day: int,
+    used_pois: set,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float] = None,
+    origin: Optional[DayStart] = None,
+):
+    """
+    A* over the top-K candidates by score.
+    - State: (time, budget, visited_mask, last_idx)
+    - Cost g = -sum(score(p)) so far (we want to maximize score)
+    - Heuristic h = -(fractional knapsack of remaining scores over the time
+      left in the day), an optimistic bound, so pruning never loses the optimum
+    - routes may wait: for a stop to open (as in the CSP planner), or to
+      leave when a faster time slice begins (after a rush hour)
+    - search_mode "beam" keeps only the best beam_width nodes per depth and
+      "dfbnb" searches depth-first with the same bound; both use bounded memory
+    - stops after ASTAR_MAX_EXPANSIONS, or once time.time() passes deadline,
+      and returns the best route found so far
+    """
+
+    catalog = ctx.catalog
+    origin = origin or day_start(req, catalog)
+    start, budget_per_day = origin.time, origin.budget
+    end = day_end(req, origin)
+    search = req.search_mode if req.search_mode in ASTAR_MAX_CANDIDATES else "astar"
+    max_k = req.max_candidates or ASTAR_MAX_CANDIDATES[search]
+
+    cols = catalog.columns
+    scores = cols.score_vector(ctx)
+    open_from = cols.hours(dow, req.use_live_constraints)[0]
+    latest_arrival = cols.latest_arrival(dow, req.use_live_constraints)
+
+    # Candidate pool: open today, not previously used, and able to fit the day on its own
+    pool = day_candidate_mask(catalog, req, dow, start, end, budget_per_day, mode, origin) & ~cols.mask_of(used_pois)
+    pool_pos = np.flatnonzero(pool)
+
+    # limit to top K by static score to keep state small
+    cand_pos = pool_pos[np.argsort(-scores[pool_pos], kind="stable")[:max_k]]
+    K = len(cand_pos)
+    if K == 0:
+        return [], [], 0
+
+    c_score = scores[cand_pos].tolist()
+    c_open = open_from[cand_pos].tolist()
+    c_latest = latest_arrival[cand_pos].tolist()
+    c_dwell = cols.dwell[cand_pos].tolist()
+    c_cost = cols.cost[cand_pos].tolist()
+
+    # travel minutes between candidates per time slice; the extra last row is the origin,
+    # so cur_idx -1 reads it
+    base_np = candidate_travel(catalog.travel, cand_pos, mode, origin)
+    base = base_np.tolist()
+    # most extra score any extension of a state (visited mask) could still collect
+    upper_bound = knapsack_bound(base_np, c_score, c_dwell, c_cost, c_latest, end)
+
+    # (visited_mask, last_idx) -> earliest finish seen; the same set of stops
+    # always has the same score and cost, and since routes may wait, an earlier
+    # finish can do whatever a later one can: the later one is dominated
+    best_time: Dict[tuple, int] = {}
+
+    # (hour, last stop) -> earliest arrival at every candidate when leaving at
+    # the start of a later, faster slice (and that leg's minutes); None if no
+    # later slice is faster than the one of that hour
+    waits: Dict[tuple, Optional[tuple]] = {}
+
+    def wait_for_faster_slice(hour: int, cur: int) -> Optional[tuple]:
+        key = (hour, cur)
+        if key not in waits:
+            k = mode.slice_at(dow, hour * 60)
+            arrive, travel = [end + 1] * K, [0] * K
+            found = False
+            for h in range((hour + 1) * 60, end, 60):
+                later = mode.slice_at(dow, h)
+                if later < k:  # slice_factors ascend: a lower slice is faster
+                    k, found, row = later, True, base[later][cur]
+                    for j in range(K):
+                        if h + row[j] < arrive[j]:
+                            arrive[j], travel[j] = h + row[j], row[j]
+            waits[key] = (arrive, travel) if found else None
+        return waits[key]
+
+    sliced = len(mode.slice_factors) > 1
+
+    def expand(node: AStarNode) -> List[AStarNode]:
+        row = base[mode.slice_at(dow, node.time)][node.cur_idx]
+        later = wait_for_faster_slice(node.time // 60, node.cur_idx) if sliced else None
+        children = []
+        for j in range(K):
+            if node.visited_mask >> j & 1:
+                continue
+
+            travel = row[j]
+            arrive = node.time + travel
+            if later is not None and later[0][j] < arrive:
+                arrive, travel = later[0][j], later[1][j]
+            if arrive < c_open[j]:
+                arrive = c_open[j]
+            if arrive > c_latest[j]:
+                continue
+            if arrive + c_dwell[j] > end:
+                continue
+            if node.budget - c_cost[j] < 0:
+                continue
+
+            new_time = arrive + c_dwell[j]
+            new_mask = node.visited_mask | (1 << j)
+            key = (new_mask, j)
+            if best_time.get(key, end + 1) <= new_time:
+                continue
+            best_time[key] = new_time
+
+            new_g = node.g - c_score[j]
+            new_budget = node.budget - c_cost[j]
+            f = new_g - upper_bound(new_mask, new_time, new_budget)
+            children.append(AStarNode(f, new_g, new_time, new_budget, j, new_mask, node, arrive, travel))
+        return children
+
+    root = AStarNode(
+        f=-upper_bound(0, start, budget_per_day),
+        g=0.0,
+        time=start,
+        budget=budget_per_day,
+        cur_idx=-1,
+        visited_mask=0,
+    )
+    best_node = root
+    expansions = 0
+    peak = 1  # largest open list seen
+
+    def out_of_budget() -> bool:
+        if expansions >= ASTAR_MAX_EXPANSIONS:
+            return True
+        # the clock is only read every 64 expansions
+        return deadline is not None and expansions % 64 == 0 and time.time() > deadline
+
+    if search == "beam":
+        layer = [root]
+        while layer and not out_of_budget():
+            next_layer = []
+            for node in layer:
+                if expansions and out_of_budget():
+                    break
+                expansions += 1
+                for child in expand(node):
+                    if child.g < best_node.g:
+                        best_node = child
+                    next_layer.append(child)
+            peak = max(peak, len(next_layer))
+            next_layer.sort()
+            layer = [n for n in next_layer[:ASTAR_BEAM_WIDTH] if n.f < best_node.g]
+    elif search == "dfbnb":
+        stack = [root]
+        while stack and not out_of_budget():
+            node = stack.pop()
+            if node.f >= best_node.g:
+                continue
+            expansions += 1
+            children = expand(node)
+            for child in children:
+                if child.g < best_node.g:
+                    best_node = child
+            # most promising child goes on top of the stack
+            children.sort(reverse=True)
+            stack.extend(c for c in children if c.f < best_node.g)
+            peak = max(peak, len(stack))
+    else:
+        frontier: List[AStarNode] = [root]
+        while frontier and not out_of_budget():
+            node = heappop(frontier)
+            # every remaining node's bound is worse than the best route: done
+            if node.f >= best_node.g:
+                break
+            expansions += 1
+            for child in expand(node):
+                if child.g < best_node.g:  # remember g is negative total score
+                    best_node = child
+                if child.f < best_node.g:
+                    heappush(frontier, child)
+            peak = max(peak, len(frontier))
+
+    ASTAR_EXPANSIONS.observe(expansions, mode=search)
+    ASTAR_FRONTIER_PEAK.observe(peak, mode=search)
+
+    # walk the parent chain back to Start to rebuild the best route
+    chain = []
+    node = best_node
+    while node.parent is not None:
+        chain.append(node)
+        node = node.parent
+    chain.reverse()
+
+    route_day = []
+    legs_day = []
+    leg_from = origin.name
+    for node in chain:
+        p = catalog.records[cand_pos[node.cur_idx]]
+        legs_day.append({
+            "from": leg_from,
+            "to": p.name,
+            "mode": req.mobility,
+            "eta_min": node.travel,
+            "day": day,
+        })
+        route_day.append({
+            "poi_id": p.id,
+            "name": p.name,
+            "start": f"{node.arrive // 60:02d}:{node.arrive % 60:02d}",
+            "end": f"{node.time // 60:02d}:{node.time % 60:02d}",
+            "dwell_min": p.avg_dwell_min,
+            "admission_est": p.admission_cost,
+            "day": day,
+        })
+        leg_from = p.name
+
+    return route_day, legs_day, expansions
+
+
+# --------- SINGLE-DAY ILS PLANNER ---------
+# strategies "ils_*": the day as an orienteering problem with time windows
+ILS_MAX_CANDIDATES = 60
+ILS_TIME_LIMIT_S = 0.1   # search time per day unless PlanReq.ils_time_limit_s is set
+ILS_MAX_STALLS = 200     # perturbations in a row without a better route before stopping early
+ILS_MAX_ITERATIONS: Optional[int] = None  # also stop after this many (bench.py: effort independent of load)
+
+
+def ils_plan_one_day(
+    req: PlanReq,
+    ctx: ScoringContext,
+    day: int,
+    used_pois: set,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float] = None,
+    origin: Optional[DayStart] = None,
+):
+    """
+    Anytime iterated local search over the best ILS_MAX_CANDIDATES POIs:
+    - local search: insert the outsider with the best score^2 / added minutes
+      until none fits, then 2-opt the order to free time and replace stops by
+      better-scoring outsiders, inserting again after every improvement
+    - perturbation: drop a run of consecutive stops whose start and length
+      keep moving (Vansteenwegen et al.), then search again from there
+    - legs use the travel time slice of their actual departure, and a stop
+      reached before it opens waits
+    - runs for ILS_TIME_LIMIT_S (or req.ils_time_limit_s) and at most
+      ILS_MAX_ITERATIONS rounds, never past deadline, and returns the best route seen
+    Returns (route, legs, routes evaluated).
+    """
+    catalog = ctx.catalog
+    origin = origin or day_start(req, catalog)
+    start, budget_per_day = origin.time, origin.budget
+    end = day_end(req, origin)
+    limit = req.ils_time_limit_s if req.ils_time_limit_s is not None else ILS_TIME_LIMIT_S
+    stop_at = time.perf_counter() + limit
+    if deadline is not None:
+        stop_at = min(stop_at, time.perf_counter() + max(0.0, deadline - time.time()))
+
+    cols = catalog.columns
+    scores = cols.score_vector(ctx)
+    open_from = cols.hours(dow, req.use_live_constraints)[0]
+    latest_arrival = cols.latest_arrival(dow, req.use_live_constraints)
+
+    # only POIs that are worth a visit and could fit the day on their own
+    pool = day_candidate_mask(catalog, req, dow, start, end, budget_per_day, mode, origin) & ~cols.mask_of(used_pois)
+    pool_pos = np.flatnonzero(pool & (scores > 0))
+    cand_pos = pool_pos[np.argsort(-scores[pool_pos], kind="stable")[:ILS_MAX_CANDIDATES]]
+    K = len(cand_pos)
+    if K == 0:
+        return [], [], 0
+
+    c_score = scores[cand_pos].tolist()
+    c_open = open_from[cand_pos].tolist()
+    c_latest = latest_arrival[cand_pos].tolist()
+    c_dwell = cols.dwell[cand_pos].tolist()
+    c_cost = cols.cost[cand_pos].tolist()
+
+    # travel minutes between candidates per time slice; the extra last row is the origin
+    base = candidate_travel(catalog.travel, cand_pos, mode, origin).tolist()
+    slice_of_hour = mode.slice_of_hour
+    week_hour = (dow or 0) * 24
+    evals = 0
+
+    def schedule(route, first=0, t=start, last=-1, old_starts=None):
+        """
+        Visit start per stop from route[first:] on, leaving last (-1: origin) at t;
+        None if a window or the day end breaks. With old_starts (the route's
+        previous schedule) it stops early once a stop starts as before, since
+        everything after it is then unchanged; the rest of the list is None.
+        """
+        nonlocal evals
+        evals += 1
+        starts = []
+        for k in range(first, len(route)):
+            j = route[k]
+            s = t + base[slice_of_hour[(week_hour + t // 60) % HOURS_PER_WEEK]][last][j]
+            if s < c_open[j]:
+                s = c_open[j]
+            if s > c_latest[j]:
+                return None
+            if old_starts is not None and s == old_starts[k]:
+                return starts + [None] * (len(route) - k)
+            t = s + c_dwell[j]
+            if t > end:
+                return None
+            starts.append(s)
+            last = j
+        return starts
+
+    def finish(route, starts) -> int:
+        return starts[-1] + c_dwell[route[-1]] if route else start
+
+    def insert_best(route, starts, spent):
+        """Insert outsiders by best score^2 / added minutes until none fits."""
+        while time.perf_counter() < stop_at:
+            inside = set(route)
+            done = finish(route, starts)
+            best = None  # (ratio, j, position)
+            for j in range(K):
+                if j in inside or spent + c_cost[j] > budget_per_day:
+                    continue
+                for p in range(len(route) + 1):
+                    t = start if p == 0 else starts[p - 1] + c_dwell[route[p - 1]]
+                    last = -1 if p == 0 else route[p - 1]
+                    trial = route[:p] + [j] + route[p:]
+                    tail = schedule(trial, p, t, last, [None] * (p + 1) + starts[p:])
+                    if tail is None:
+                        continue
+                    new_starts = starts[:p] + [starts[k - 1] if s is None else s
+                                               for k, s in enumerate(tail, start=p)]
+                    added = max(finish(trial, new_starts) - done, 1)
+                    ratio = c_score[j] ** 2 / added
+                    if best is None or ratio > best[0]:
+                        best = (ratio, j, p, new_starts)
+            if best is None:
+                break
+            _, j, p, starts = best
+            route = route[:p] + [j] + route[p:]
+            spent += c_cost[j]
+        return route, starts, spent
+
+    def two_opt(route, starts):
+        """First reversal of a stretch of the route that ends the day earlier."""
+        done = finish(route, starts)
+        for i in range(len(route) - 1):
+            for k in range(i + 1, len(route)):
+                trial = route[:i] + route[i:k + 1][::-1] + route[k + 1:]
+                new_starts = schedule(trial)
+                if new_starts is not None and finish(trial, new_starts) < done:
+                    return trial, new_starts
+        return None
+
+    def replace_best(route, starts, spent):
+        """Swap one stop for the outsider that adds the most score and still fits."""
+        inside = set(route)
+        best = None  # (gain, route, starts, spent)
+        for p, i in enumerate(route):
+            for j in range(K):
+                gain = c_score[j] - c_score[i]
+                if j in inside or gain <= 0 or (best is not None and gain <= best[0]):
+                    continue
+                cost = spent - c_cost[i] + c_cost[j]
+                if cost > budget_per_day:
+                    continue
+                trial = route[:p] + [j] + route[p + 1:]
+                new_starts = schedule(trial)
+                if new_starts is not None:
+                    best = (gain, trial, new_starts, cost)
+        return None if best is None else best[1:]
+
+    def local_search(route, starts, spent):
+        route, starts, spent = insert_best(route, starts, spent)
+        while time.perf_counter() < stop_at:
+            moved = two_opt(route, starts)
+            if moved is not None:
+                route, starts = moved
+            else:
+                swapped = replace_best(route, starts, spent)
+                if swapped is None:
+                    break
+                route, starts, spent = swapped
+            route, starts, spent = insert_best(route, starts, spent)
+        return route, starts, spent
+
+    def total(route) -> float:
+        return sum(c_score[j] for j in route)
+
+    route, starts, spent = local_search([], [], 0.0)
+    best_route, best_starts = route, starts
+    best_key = (total(route), -finish(route, starts))
+
+    # shake: drop `size` stops from `at` on (wrapping), both moving after every round
+    at, size, stalls, iterations = 0, 1, 0, 0
+    max_iterations = ILS_MAX_ITERATIONS
+    while route and stalls < ILS_MAX_STALLS and time.perf_counter() < stop_at \
+            and (max_iterations is None or iterations < max_iterations):
+        iterations += 1
+        n = len(route)
+        at %= n
+        dropped = {route[(at + k) % n] for k in range(min(size, n))}
+        route = [j for j in route if j not in dropped]
+        starts = schedule(route)
+        if starts is None:
+            # a later departure can land in a slower slice; start over
+            route, starts = [], []
+        spent = sum(c_cost[j] for j in route)
+        route, starts, spent = local_search(route, starts, spent)
+
+        key = (total(route), -finish(route, starts))
+        if key > best_key:
+            best_route, best_starts, best_key = route, starts, key
+            stalls = 0
+            size = 1
+        else:
+            stalls += 1
+        at += size
+        size = size + 1 if size < max(1, n // 2) else 1
+    ILS_ITERATIONS.observe(iterations)
+
+    route_day = []
+    legs_day = []
+    cur_name, t, last = origin.name, start, -1
+    for j, arrive in zip(best_route, best_starts):
+        p = catalog.records[cand_pos[j]]
+        travel = base[slice_of_hour[(week_hour + t // 60) % HOURS_PER_WEEK]][last][j]
+        end_t = arrive + p.avg_dwell_min
+
+        legs_day.append({
+            "from": cur_name,
+            "to": p.name,
+            "mode": req.mobility,
+            "eta_min": travel,
+            "day": day,
+        })
+        route_day.append({
+            "poi_id": p.id,
+            "name": p.name,
+            "start": f"{arrive // 60:02d}:{arrive % 60:02d}",
+            "end": f"{end_t // 60:02d}:{end_t % 60:02d}",
+            "dwell_min": p.avg_dwell_min,
+            "admission_est": p.admission_cost,
+            "day": day,
+        })
+        cur_name, t, last = p.name, end_t, j
+
+    return route_day, legs_day, evals
+
+
+# --------- MUST-SEE PRESOLVE ---------
+# must_see POIs are pinned to days and slots before any search; planners fill the time around them
+MUST_SEE_MAX = 20
+
+
+@dataclass(frozen=True)
+class DayPins:
+    """
+    Must-see stops pinned to one day, in visiting order. latest[k] is the
+    latest start at pin k that still leaves time for the pins after it.
+    """
+    ids: tuple
+    idx: tuple
+    latest: tuple
+    costs: tuple
+
+    def without(self, ids) -> Optional["DayPins"]:
+        """These pins minus ids (None if none are left); later pins only get more room."""
+        keep = [k for k, pid in enumerate(self.ids) if pid not in ids]
+        if not keep:
+            return None
+        return DayPins(*(tuple(col[k] for k in keep) for col in (self.ids, self.idx, self.latest, self.costs)))
+
+
+def pinned_ids(pins: Dict[int, DayPins]) -> set:
+    return {pid for day_pins in pins.values() for pid in day_pins.ids}
+
+
+def presolve_must_see(req: PlanReq, catalog: PoiCatalog, mode: TravelMode, dow: Optional[int],
+                      days: int) -> Dict[int, DayPins]:
+    """
+    Pin req.must_see to days before planning (day -> DayPins):
+    - each must-see has to be open, within max_distance_miles, affordable on
+      the daily budget and reachable from the Start in time on its own
+    - tightest opening window first, each goes to the day and position that
+      adds the least time to that day's pinned stops; schedules are checked
+      with time-dependent travel, admissions against the daily budget
+    - latest starts are propagated back from the day end, with travel
+      between pins at its slowest time slice
+    Raises ValueError with the reason when the must-sees cannot all be kept.
+    """
+    ids = list(dict.fromkeys(req.must_see))
+    if not ids:
+        return {}
+    if len(ids) > MUST_SEE_MAX:
+        raise ValueError(f"at most {MUST_SEE_MAX} must_see POIs per trip")
+    pois = []
+    for pid in ids:
+        p = catalog.get(pid)
+        if p is None:
+            raise ValueError(f"unknown POI {pid!r}")
+        pois.append(p)
+
+    origin = day_start(req, catalog)
+    start, end, budget = origin.time, minutes(req.end_time), origin.budget
+    cols = catalog.columns
+    pos = np.array([p.index for p in pois])
+    is_open = cols.open_today_mask(dow, req.use_live_constraints)[pos].tolist()
+    in_range = within_max_distance(req, catalog)[pos].tolist()
+    for p, ok, near in zip(pois, is_open, in_range):
+        if not ok:
+            raise ValueError(f"{p.name} is closed on {req.date}")
+        if not near:
+            raise ValueError(f"{p.name} is farther than max_distance_miles ({req.max_distance_miles}) from the start")
+        if p.admission_cost > budget:
+            raise ValueError(f"{p.name} costs {p.admission_cost:g}, more than the daily budget of {budget:.2f}")
+
+    P = len(pois)
+    c_open = cols.hours(dow, req.use_live_constraints)[0][pos].tolist()
+    c_latest = np.minimum(cols.latest_arrival(dow, req.use_live_constraints)[pos], end - cols.dwell[pos]).tolist()
+    c_dwell = cols.dwell[pos].tolist()
+    c_cost = cols.cost[pos].tolist()
+    base_np = candidate_travel(catalog.travel, pos, mode, origin)
+    base = base_np.tolist()
+    slowest = base_np.max(axis=0).tolist()
+
+    def schedule(seq):
+        """Earliest start per pin of seq from the Start; None if one misses its window."""
+        starts, t, last = [], start, -1
+        for j in seq:
+            s = max(t + base[mode.slice_at(dow, t)][last][j], c_open[j])
+            if s > c_latest[j]:
+                return None
+            starts.append(s)
+            t, last = s + c_dwell[j], j
+        return starts
+
+    for j, p in enumerate(pois):
+        if schedule([j]) is None:
+            raise ValueError(f"{p.name} cannot be reached and visited between {req.start_time} and {req.end_time}")
+
+    seqs = [[] for _ in range(days)]
+    done = [start] * days
+    spent = [0.0] * days
+    for j in sorted(range(P), key=lambda j: c_latest[j] - c_open[j]):
+        best = None  # (added minutes, day, sequence, end of its last stop)
+        for d in range(days):
+            if spent[d] + c_cost[j] > budget:
+                continue
+            for k in range(len(seqs[d]) + 1):
+                trial = seqs[d][:k] + [j] + seqs[d][k:]
+                starts = schedule(trial)
+                if starts is None:
+                    continue
+                finish = starts[-1] + c_dwell[trial[-1]]
+                if best is None or finish - done[d] < best[0]:
+                    best = (finish - done[d], d, trial, finish)
+        if best is None:
+            if all(spent[d] + c_cost[j] > budget for d in range(days)):
+                raise ValueError(f"admissions do not fit the daily budget of {budget:.2f}")
+            raise ValueError(f"{pois[j].name} does not fit into {days} day(s) with the other must-sees")
+        _, d, seqs[d], done[d] = best
+        spent[d] += c_cost[j]
+
+    pins = {}
+    for d, seq in enumerate(seqs, start=1):
+        if not seq:
+            continue
+        earliest = schedule(seq)
+        latest = [0] * len(seq)
+        nxt = None
+        for k in range(len(seq) - 1, -1, -1):
+            j = seq[k]
+            bound = c_latest[j]
+            if nxt is not None:
+                bound = min(bound, latest[k + 1] - c_dwell[j] - slowest[j][nxt])
+            # arriving as early as possible is known to work even when slowest travel says otherwise
+            latest[k] = max(bound, earliest[k])
+            nxt = j
+        pins[d] = DayPins(
+            ids=tuple(ids[j] for j in seq),
+            idx=tuple(int(pos[j]) for j in seq),
+            latest=tuple(latest),
+            costs=tuple(c_cost[j] for j in seq),
+        )
+    return pins
+
+
+def fits_before(catalog: PoiCatalog, req: PlanReq, mode: TravelMode, dow: Optional[int], origin: DayStart,
+                pin: int, latest: int) -> np.ndarray:
+    """Mask of POIs that can be visited after leaving origin and still reach POI pin by latest."""
+    cols = catalog.columns
+    t = origin.time
+    open_from = cols.hours(dow, req.use_live_constraints)[0]
+    arrive = np.maximum(t + origin_minutes(catalog.travel, origin, mode, mode.slice_at(dow, t)), open_from)
+    leave = arrive + cols.dwell
+    slices = np.asarray(mode.slice_of_hour)[((dow or 0) * 24 + leave // 60) % HOURS_PER_WEEK]
+    into_pin = np.stack([catalog.travel.between(np.arange(cols.n), [pin], mode.speed_kmh, f)[:, 0]
+                         for f in mode.slice_factors])
+    return (
+        (arrive <= cols.latest_arrival(dow, req.use_live_constraints))
+        & (leave + into_pin[slices, np.arange(cols.n)] <= latest)
+    )
+
+
+# --------- MULTI-DAY WRAPPERS ---------
+def solve_day(
+    req: PlanReq,
+    ctx: ScoringContext,
+    planner: str,
+    day: int,
+    used_pois: set,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float] = None,
+    origin: Optional[DayStart] = None,
+    pins: Optional[DayPins] = None,
+):
+    """
+    Plan one day with a planner and its fallbacks (plan_stretch), around the
+    day's pinned must-see stops if it has any (plan_around_pins).
+    The day starts at origin (default: Start at start_time with the daily budget).
+    Adds the chosen POIs to used_pois; returns (route, legs, search effort, solve ms).
+    Each stage's time and the stage that produced the route are recorded in METRICS.
+    """
+    t0 = time.perf_counter()
+    if pins is not None:
+        route_day, legs_day, effort, source = plan_around_pins(
+            req, ctx, planner, day, used_pois, mode, dow, deadline, origin, pins)
+    else:
+        route_day, legs_day, effort, source = plan_stretch(
+            req, ctx, planner, day, used_pois, mode, dow, deadline, origin)
+    DAY_SOURCE.inc(planner=planner, source=source)
+
+    for stop in route_day:
+        used_pois.add(stop["poi_id"])
+
+    return route_day, legs_day, effort, (time.perf_counter() - t0) * 1000.0
+
+
+def plan_stretch(
+    req: PlanReq,
+    ctx: ScoringContext,
+    planner: str,
+    day: int,
+    used_pois: set,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float] = None,
+    origin: Optional[DayStart] = None,
+):
+    """
+    Plan from origin until its end with a planner and its fallbacks:
+    - "astar": A* -> CSP -> greedy (A* is skipped once the deadline has passed)
+    - "ils": ILS -> greedy (ILS stops at its time limit with its best route)
+    - "greedy": greedy -> CSP
+    Returns (route, legs, search effort, stage that produced the route or "none").
+    """
+    route_day, legs_day, effort = [], [], 0
+    source = "none"
+
+    def stage(name, fn, *args):
+        nonlocal source
+        t = time.perf_counter()
+        out = fn(*args)
+        STAGE_LATENCY.observe(time.perf_counter() - t, stage=name)
+        if out[0]:
+            source = name
+        return out
+
+    if planner == "astar":
+        # past the deadline, remaining days go straight to the cheap fallbacks
+        if deadline is None or time.time() < deadline:
+            route_day, legs_day, effort = stage(
+                "astar", astar_plan_one_day, req, ctx, day, used_pois, mode, dow, deadline, origin)
+
+        # if A* fails to place anything, fall back to CSP, then greedy
+        if not route_day:
+            route_day, legs_day, calls = stage(
+                "csp", csp_fill_day_by_backtracking, req, ctx, day, used_pois, mode, dow, deadline, origin)
+            effort += calls
+
+        if not route_day:
+            route_day, legs_day, _ = stage(
+                "greedy", greedy_plan_one_day, req, ctx, day, used_pois, mode, dow, origin)
+    elif planner == "ils":
+        route_day, legs_day, effort = stage(
+            "ils", ils_plan_one_day, req, ctx, day, used_pois, mode, dow, deadline, origin)
+
+        # ILS only comes back empty when its candidates cannot be reached in time
+        if not route_day:
+            route_day, legs_day, _ = stage(
+                "greedy", greedy_plan_one_day, req, ctx, day, used_pois, mode, dow, origin)
+    else:
+        route_day, legs_day, effort = stage(
+            "greedy", greedy_plan_one_day, req, ctx, day, used_pois, mode, dow, origin)
+
+        # if greedy fails to place anything, try CSP/backtracking as a fallback
+        if not route_day:
+            route_day, legs_day, calls = stage(
+                "csp", csp_fill_day_by_backtracking, req, ctx, day, used_pois, mode, dow, deadline, origin)
+            effort += calls
+
+    return route_day, legs_day, effort, source
+
+
+def plan_around_pins(
+    req: PlanReq,
+    ctx: ScoringContext,
+    planner: str,
+    day: int,
+    used_pois: set,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float],
+    origin: Optional[DayStart],
+    pins: DayPins,
+):
+    """
+    Plan a day around its pinned must-see stops:
+    - the time before each pin is a stretch of its own, ending at the pin's
+      latest start, over POIs that can still reach the pin from there
+      (fits_before); then the rest of the day after the last pin
+    - stretches get the budget left after every pin's admission
+    - fillers that would make their pin late are dropped from the end of
+      the stretch; a pin that cannot be made at all any more (a /replan late
+      in the day) is left out and frees its admission
+    Returns (route, legs, search effort, first stage that placed fillers or "must_see").
+    """
+    catalog = ctx.catalog
+    cols = catalog.columns
+    open_from = cols.hours(dow, req.use_live_constraints)[0]
+    latest_arrival = cols.latest_arrival(dow, req.use_live_constraints)
+    origin = origin or day_start(req, catalog)
+    end = day_end(req, origin)
+    all_ids = [p.id for p in catalog.records]
+    taken = set(used_pois) | set(pins.ids)
+    left = origin.budget - sum(pins.costs)
+
+    route_day, legs_day, effort = [], [], 0
+    source = "must_see"
+    cur = origin
+
+    def stretch(until: int, fits: Optional[np.ndarray]):
+        nonlocal effort, source
+        excluded = taken if fits is None else taken | {pid for pid, ok in zip(all_ids, fits.tolist()) if not ok}
+        route, legs, e, s = plan_stretch(
+            req, ctx, planner, day, set(excluded), mode, dow, deadline,
+            DayStart(cur.name, cur.lat, cur.lon, cur.time, left, cur.idx, end=until))
+        effort += e
+        if route and source == "must_see":
+            source = s
+        return route, legs
+
+    for i, latest, cost in zip(pins.idx, pins.latest, pins.costs):
+        p = catalog.records[i]
+        fill, fill_legs = stretch(latest, fits_before(catalog, req, mode, dow, cur, i, latest))
+        while True:
+            if fill:
+                last = catalog.get(fill[-1]["poi_id"])
+                at = DayStart(last.name, last.lat, last.lon, minutes(fill[-1]["end"]), 0.0, last.index)
+            else:
+                at = cur
+            travel = int(origin_minutes(catalog.travel, at, mode, mode.slice_at(dow, at.time))[i])
+            arrive = max(at.time + travel, int(open_from[i]))
+            if arrive <= latest or not fill:
+                break
+            fill.pop()
+            fill_legs.pop()
+
+        route_day.extend(fill)
+        legs_day.extend(fill_legs)
+        left -= sum(stop["admission_est"] for stop in fill)
+        taken.update(stop["poi_id"] for stop in fill)
+        if arrive > int(latest_arrival[i]) or arrive + p.avg_dwell_min > end:
+            left += cost
+            cur = at
+            continue
+
+        end_t = arrive + p.avg_dwell_min
+        legs_day.append({
+            "from": at.name,
+            "to": p.name,
+            "mode": req.mobility,
+            "eta_min": travel,
+            "day": day,
+        })
+        route_day.append({
+            "poi_id": p.id,
+            "name": p.name,
+            "start": f"{arrive // 60:02d}:{arrive % 60:02d}",
+            "end": f"{end_t // 60:02d}:{end_t % 60:02d}",
+            "dwell_min": p.avg_dwell_min,
+            "admission_est": p.admission_cost,
+            "day": day,
+        })
+        cur = DayStart(p.name, p.lat, p.lon, end_t, 0.0, i)
+
+    fill, fill_legs = stretch(end, None)
+    route_day.extend(fill)
+    legs_day.extend(fill_legs)
+    return route_day, legs_day, effort, source
+
+
+def summarize_costs(stops: list) -> dict:
+    admissions = sum(s["admission_est"] for s in stops)
+    return {
+        "admissions": admissions,
+        "transport": 0,
+        "total": admissions,
     }
 
+
+def iter_days_sequential(
+    req: PlanReq,
+    ctx: ScoringContext,
+    planner: str,
+    days: int,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float] = None,
+    pins: Optional[Dict[int, DayPins]] = None,
+):
+    """
+    Plan day 1..days in order; each day only sees POIs earlier days left
+    unused, and none that is pinned to a day (pins: presolve_must_see).
+    Yields (day, route, legs, effort, solve ms) as soon as each day is solved.
+    """
+    pins = pins or {}
+    used_pois = pinned_ids(pins)
+    for day in range(1, days + 1):
+        yield (day, *solve_day(req, ctx, planner, day, used_pois, mode, dow, deadline, pins=pins.get(day)))
+
+
+def collect_days(day_results):
+    """Merge per-day results (any order) into (stops, legs, cost summary, effort, per-day ms)."""
+    all_stops = []
+    all_legs = []
+    total_effort = 0
+    day_ms = []
+
+    for _, route_day, legs_day, effort, ms in sorted(day_results, key=lambda r: r[0]):
+        total_effort += effort
+        day_ms.append(ms)
+        all_stops.extend(route_day)
+        all_legs.extend(legs_day)
+
+    return all_stops, all_legs, summarize_costs(all_stops), total_effort, day_ms
+
+
+def plan_days_sequential(
+    req: PlanReq,
+    ctx: ScoringContext,
+    planner: str,
+    days: int,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float] = None,
+    pins: Optional[Dict[int, DayPins]] = None,
+):
+    return collect_days(iter_days_sequential(req, ctx, planner, days, mode, dow, deadline, pins))
+
+
+def plan_multi_day_greedy(req: PlanReq, ctx: ScoringContext, days: int, mode: TravelMode, dow: Optional[int],
+                          pins: Optional[Dict[int, DayPins]] = None):
+    return plan_days_sequential(req, ctx, "greedy", days, mode, dow, pins=pins)
+
+
+def plan_multi_day_astar(
+    req: PlanReq,
+    ctx: ScoringContext,
+    days: int,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float] = None,
+    pins: Optional[Dict[int, DayPins]] = None,
+):
+    return plan_days_sequential(req, ctx, "astar", days, mode, dow, deadline, pins)
+
+
+# --------- MULTI-DAY PARTITIONING ---------
+PARTITION_POOL_PER_DAY = 40  # top-scoring candidates per day that get balanced clustering
+PARTITION_ITERS = 8
+
+# fallback for partitioned days when PLAN_POOL is off (single CPU, or PLAN_POOL_WORKERS=0)
+DAY_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="plan-day")
+
+
+def _balanced_assign(dist: np.ndarray, cap: int) -> np.ndarray:
+    """Give each row its nearest column, closest pairs first, with at most cap rows per column."""
+    n, k = dist.shape
+    labels = np.full(n, -1)
+    counts = [0] * k
+    assigned = 0
+    for flat in np.argsort(dist, axis=None, kind="stable").tolist():
+        i, c = divmod(flat, k)
+        if labels[i] < 0 and counts[c] < cap:
+            labels[i] = c
+            counts[c] += 1
+            assigned += 1
+            if assigned == n:
+                break
+    return labels
+
+
+def partition_pois(travel: TravelMatrix, pool_pos: np.ndarray, scores: np.ndarray, days: int) -> List[np.ndarray]:
+    """
+    Split candidate POIs (catalog row indices) into one compact group per day.
+    - the top PARTITION_POOL_PER_DAY * days by score are split into groups of
+      near-equal size by balanced k-medoids on the travel matrix, so every
+      day gets a fair share of the best POIs
+    - the rest join the group of their nearest medoid
+    """
+    if days <= 1 or len(pool_pos) == 0:
+        return [pool_pos] + [pool_pos[:0]] * (days - 1)
+
+    ranked = pool_pos[np.argsort(-scores[pool_pos], kind="stable")]
+    top, rest = ranked[:PARTITION_POOL_PER_DAY * days], ranked[PARTITION_POOL_PER_DAY * days:]
+    n = len(top)
+    if n <= days:
+        return [top[k:k + 1] for k in range(days)]
+
+    dist = travel.km_between(top, top)
+    cap = -(-n // days)  # ceil(n / days)
+
+    # farthest-point seeding, starting from the POI nearest Start
+    medoids = [int(np.argmin(travel.start_km[top]))]
+    for _ in range(1, days):
+        medoids.append(int(np.argmax(dist[:, medoids].min(axis=1))))
+
+    for _ in range(PARTITION_ITERS):
+        labels = _balanced_assign(dist[:, medoids], cap)
+        new_medoids = []
+        for k in range(days):
+            members = np.flatnonzero(labels == k)
+            if len(members) == 0:
+                new_medoids.append(medoids[k])
+                continue
+            within = dist[np.ix_(members, members)].sum(axis=1)
+            new_medoids.append(int(members[np.argmin(within)]))
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+
+    groups = [top[labels == k] for k in range(days)]
+    if len(rest):
+        nearest = travel.km_between(rest, top[medoids]).argmin(axis=1)
+        groups = [np.concatenate([g, rest[nearest == k]]) for k, g in enumerate(groups)]
+    return groups
+
+
+def _solve_day_numbered(req, ctx, planner, day, used_pois, mode, dow, deadline, pins):
+    return (day, *solve_day(req, ctx, planner, day, used_pois, mode, dow, deadline, pins=pins))
+
+
+def _solve_day_in_group(req, ctx, planner, day, group, mode, dow, deadline, pins):
+    """_solve_day_numbered on the POIs at rows group only (rows travel to workers, not the ids left out)."""
+    allowed = np.zeros(len(ctx.catalog), dtype=bool)
+    allowed[group] = True
+    excluded = {p.id for p, ok in zip(ctx.catalog.records, allowed.tolist()) if not ok}
+    return _solve_day_numbered(req, ctx, planner, day, excluded, mode, dow, deadline, pins)
+
+
+def iter_days_partitioned(
+    req: PlanReq,
+    ctx: ScoringContext,
+    planner: str,
+    days: int,
+    mode: TravelMode,
+    dow: Optional[int],
+    deadline: Optional[float] = None,
+    pins: Optional[Dict[int, DayPins]] = None,
+):
+    """
+    Assign POIs to days up front (partition_pois), then solve every day on
+    its own group concurrently in PLAN_POOL (started by default on hosts with
+    more than one CPU). The planners are pure Python, so only processes run
+    days side by side: the DAY_EXECUTOR threads used without a pool still
+    stream days as they finish but take turns on the GIL. Pinned must-sees
+    stay out of the groups and go to their own day. Yields (day, route,
+    legs, effort, solve ms) in the order the days finish.
+    """
+    pins = pins or {}
+    start = minutes(req.start_time)
+    end = minutes(req.end_time)
+    catalog = ctx.catalog
+    cols = catalog.columns
+    pool = day_candidate_mask(catalog, req, dow, start, end, req.budget_total / days, mode)
+    pool &= ~cols.mask_of(pinned_ids(pins))
+    groups = partition_pois(catalog.travel, np.flatnonzero(pool), cols.score_vector(ctx), days)
+
+    in_pool = pool_plans(catalog)
+    futures = {}  # future -> its day's arguments
+    for day, group in enumerate(groups, start=1):
+        args = (req, ctx, planner, day, group, mode, dow, deadline, pins.get(day))
+        if in_pool:
+            futures[PLAN_POOL.submit(run_counted, _solve_day_in_group, *args)] = args
+        else:
+            futures[DAY_EXECUTOR.submit(_solve_day_in_group, *args)] = args
+
+    try:
+        for future in as_completed(futures):
+            if not in_pool:
+                yield future.result()
+                continue
+            try:
+                yield counted_result(future, catalog)
+            except StaleCatalogError:
+                yield _solve_day_in_group(*futures[future])
+    finally:
+        # a client that stopped listening does not need the remaining days
+        for future in futures:
+            future.cancel()
+
+
+# --------- A* PROCESS POOL ---------
+# worker processes for execution="process" and partitioned days: one per CPU by default,
+# none on a single CPU (nothing to run side by side); 0 disables the pool (requests then
+# run inline, partitioned days on DAY_EXECUTOR threads)
+CPU_COUNT = os.cpu_count() or 1
+PLAN_POOL_WORKERS = int(os.environ.get("PLAN_POOL_WORKERS", CPU_COUNT if CPU_COUNT > 1 else 0))
+PLAN_POOL_TIMEOUT_S = 10.0   # default deadline for pooled plans without timeout_s
+# extra wait for a worker to hand back its best-so-far plan; A* and CSP check the deadline
+# every 64 / 256 steps, so this is also the most a timed-out plan keeps its worker
+PLAN_POOL_GRACE_S = 1.0
+
+PLAN_POOL: Optional[ProcessPoolExecutor] = None
+# identities of catalogs the workers turned down (StaleCatalogError): planned in-process from then on
+PLAN_POOL_REFUSED: set = set()
+
+
+class StaleCatalogError(RuntimeError):
+    """A PLAN_POOL worker has no copy of the catalog a task was planned on."""
+
+
+def pool_plans(catalog: PoiCatalog) -> bool:
+    """Whether to send plans on catalog to PLAN_POOL (not when its workers refused it before)."""
+    return PLAN_POOL is not None and catalog.identity not in PLAN_POOL_REFUSED
+
+
+def warm_catalog(catalog: PoiCatalog):
+    """
+    Build the free-flow minutes of every travel mode (what plans without live
+    constraints use); rush-hour slices are built on first use. Catalogs past
+    TRAVEL_DENSE_MAX_POIS have no matrices to build.
+    """
+    if not catalog.travel.dense:
+        return
+    for mode in FREE_FLOW_MODES.values():
+        catalog.travel.slices(mode)
+
+
+def _warm_plan_worker():
+    """
+    Runs once per forked worker. The pool forks before WARMUP has loaded
+    anything, so each worker loads and warms PRELOAD_CITIES (and any catalog
+    it inherited) itself, mapping the same artifacts. That runs on a thread
+    so the pool is up at once; a task for a city still loading waits for it
+    in CATALOGS.
+    """
+    cities = dict.fromkeys([*map(city_key, PRELOAD_CITIES), *(c.city for c in CATALOGS.loaded())])
+    threading.Thread(target=WarmUp(list(cities)).run, name="worker-warm-up", daemon=True).start()
+
+
+def start_plan_pool(workers: int = PLAN_POOL_WORKERS):
+    """
+    Fork the A* worker pool and wait until every worker is up.
+    Workers warm PRELOAD_CITIES in the background (_warm_plan_worker) and
+    load other cities from the mapped artifacts on first use. A catalog
+    changed after the fork (add_pois, use_catalog) has another identity than
+    the workers' copies, so its plans run in-process (StaleCatalogError).
+    """
+    global PLAN_POOL
+    if workers <= 0 or PLAN_POOL is not None:
+        return
+    PLAN_POOL_REFUSED.clear()  # the new workers inherit every catalog loaded now
+    PLAN_POOL = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_warm_plan_worker,
+    )
+    for f in [PLAN_POOL.submit(time.sleep, 0) for _ in range(workers)]:
+        f.result()
+
+
+def run_counted(fn, *args, expires: Optional[float] = None):
+    """
+    Runs fn in a PLAN_POOL worker; returns (result, metrics it recorded).
+    A worker runs one task at a time, so the delta is exactly this task's.
+    Raises StaleCatalogError when the task's catalog did not unpickle here
+    (registered_catalog), instead of planning on other rows, and
+    FutureTimeout when the task only starts after expires (nobody waits
+    for it any more: cancel() cannot take back a task a worker picked up).
+    """
+    if expires is not None and time.time() > expires:
+        raise FutureTimeout("plan expired while queued")
+    if any(isinstance(a, ScoringContext) and a.catalog is None for a in args):
+        raise StaleCatalogError("worker has another copy of the city; plan it in-process")
+    before = METRICS.snapshot()
+    result = fn(*args)
+    return result, METRICS.delta_since(before)
+
+
+def counted_result(future, catalog: PoiCatalog, timeout: Optional[float] = None):
+    """
+    Result of a run_counted future, merging the worker's metrics here.
+    A StaleCatalogError also marks catalog as one to keep out of the pool.
+    """
+    try:
+        result, delta = future.result(timeout=timeout)
+    except StaleCatalogError:
+        PLAN_POOL_REFUSED.add(catalog.identity)
+        raise
+    METRICS.merge(delta)
+    return result
+
+
+def stop_plan_pool():
+    global PLAN_POOL
+    if PLAN_POOL is not None:
+        PLAN_POOL.shutdown(cancel_futures=True)
+        PLAN_POOL = None
+
+
+def plan_multi_day_astar_pooled(req: PlanReq, ctx: ScoringContext, days: int, mode: TravelMode,
+                                dow: Optional[int], deadline: float, pins: Optional[Dict[int, DayPins]] = None):
+    """
+    plan_multi_day_astar in a PLAN_POOL worker. The worker itself stops at
+    the deadline; if it still has not answered after the grace period, the
+    day is planned greedily here instead (and the worker drops the task if
+    it had not started it). Workers without this catalog (StaleCatalogError)
+    or a broken pool leave the plan to this process.
+    """
+    expires = deadline + PLAN_POOL_GRACE_S
+    try:
+        future = PLAN_POOL.submit(run_counted, plan_multi_day_astar, req, ctx, days, mode, dow, deadline, pins,
+                                  expires=expires)
+        return counted_result(future, ctx.catalog, timeout=max(0.0, expires - time.time()))
+    except FutureTimeout:
+        future.cancel()
+        return plan_multi_day_greedy(req, ctx, days, mode, dow, pins)
+    except (StaleCatalogError, BrokenProcessPool):
+        return plan_multi_day_astar(req, ctx, days, mode, dow, deadline, pins)
+
+
+# --------- STARTUP ---------
+# cities loaded (and their travel slices built) before /ready reports ready
+PRELOAD_CITIES = [c.strip() for c in os.environ.get("PRELOAD_CITIES", DEFAULT_CITY).split(",") if c.strip()]
+
+
+class WarmUp:
+    """
+    Heavy startup work, run on a background thread so the server accepts
+    connections at once: load PRELOAD_CITIES (building their artifacts if
+    the CSV changed) and warm them (warm_catalog). Requests that arrive
+    earlier still work; they wait for the city they need. PLAN_POOL workers
+    are forked before this starts and map the same artifacts on first use.
+    """
+
+    def __init__(self, cities=PRELOAD_CITIES):
+        self.cities = list(cities)
+        self.done = threading.Event()
+        self.error: Optional[str] = None
+        self.seconds: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        t0 = time.perf_counter()
+        try:
+            for city in self.cities:
+                warm_catalog(CATALOGS.get(city))
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        self.seconds = time.perf_counter() - t0
+        self.done.set()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def ready(self) -> bool:
+        return self.done.is_set() and self.error is None
+
+
+WARMUP = WarmUp()
+
+
+# --------- PLAN CACHE ---------
+# UI labels -> CSV categories for preferences.like
+CATEGORY_MAP = {
+    "museums": "museums",
+    "museum": "museums",
+    "restaurants": "food",
+    "restaurants + cafes": "food",
+    "cafes": "food",
+    "coffee": "food",
+    "seafood": "seafood",
+    "history": "history",
+    "outdoors": "outdoors",
+    "parks": "outdoors",
+    "park": "outdoors",
+    "nightlife": "nightlife",
+    "shopping": "shopping",
+}
+
+PLAN_CACHE_SIZE = 1024
+PLAN_CACHE_TTL_S = 300.0
+
+
+def normalize_likes(preferences) -> set:
+    """preferences.like -> set of CSV categories."""
+    raw_like = []
+    if isinstance(preferences, dict):
+        raw_like = preferences.get("like", []) or []
+
     normalized = set()
     for x in raw_like:
         key = str(x).strip().lower()
         normalized.add(CATEGORY_MAP.get(key, key))
+    return normalized
+
+
+def plan_cache_key(req: PlanReq, likes: set) -> str:
+    """
+    Hash of the request with preferences.like replaced by its normalized form
+    and the version of its city's catalog, so adding or changing POIs
+    (add_pois, a new CSV) never answers with a plan made without them.
+    """
+    # how the plan is executed does not change the finished plan
+    fields = req.model_dump(exclude={"execution", "timeout_s", "profile"})
+    fields["catalog_version"] = catalog_for(req.city).version
+    prefs = dict(fields["preferences"]) if isinstance(fields["preferences"], dict) else {}
+    prefs["like"] = sorted(likes)
+    fields["preferences"] = prefs
+    fields["days"] = req.days or 1
+    canonical = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+class PlanCache:
+    """
+    LRU + TTL cache of /plan responses.
+    - entries expire after ttl seconds; the least recently used is evicted past maxsize
+    - each entry lists the categories its plan depends on, so feedback for
+      one category only drops the plans it could have changed
+    """
+
+    def __init__(self, maxsize: int = PLAN_CACHE_SIZE, ttl: float = PLAN_CACHE_TTL_S):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, result, categories)
+        self._by_category: Dict[str, set] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, result: dict, categories: set):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, result, categories)
+            for cat in categories:
+                self._by_category[cat].add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_category(self, cat: str):
+        with self._lock:
+            for key in list(self._by_category.get(cat, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_category.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _drop(self, key: str):
+        _, _, categories = self._entries.pop(key)
+        for cat in categories:
+            keys = self._by_category.get(cat)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_category[cat]
+
+
+PLAN_CACHE = PlanCache()
+
+
+# --------- ITINERARY REGISTRY ---------
+# issued itineraries kept in memory (the hot tier); the least recently used are dropped past this
+ITINERARY_STORE_SIZE = 10000
+# SQLite file issued itineraries and their feedback are written behind to ("" keeps them in memory only)
+ITINERARY_DB = os.environ.get("ITINERARY_DB", os.path.join(BASE_DIR, "itineraries.db"))
+# queued writes are flushed this often, or as soon as this many are queued
+ITINERARY_FLUSH_S = float(os.environ.get("ITINERARY_FLUSH_S", "0.5"))
+ITINERARY_FLUSH_BATCH = 512
+
+
+@dataclass
+class StoredItinerary:
+    """An issued itinerary with the request and normalized likes it was planned for."""
+    req: PlanReq
+    likes: frozenset
+    result: dict
+
+
+class ItineraryStore:
+    """
+    Issued itineraries by itinerary_id, in two tiers:
+    - hot: an in-memory LRU of maxsize entries; put() and get() of them never touch disk
+    - SQLite (path): put() and add_feedback() only queue the write; a writer
+      thread flushes the queue in one transaction every flush_s (sooner once
+      batch writes are queued), so persisting adds no latency to /plan
+    - get() falls back to the queue, then to SQLite, and promotes what it
+      finds, so itineraries outlive LRU eviction and restarts
+    An id put again before a flush (/replan) is written once, with its latest result.
+    load() opens the file and starts the writer; close() flushes and stops it.
+    """
+
+    def __init__(self, maxsize: int = ITINERARY_STORE_SIZE, path: str = ITINERARY_DB,
+                 flush_s: float = ITINERARY_FLUSH_S, batch: int = ITINERARY_FLUSH_BATCH):
+        self.maxsize = maxsize
+        self.path = path
+        self.flush_s = flush_s
+        self.batch = batch
+        self._entries: "OrderedDict[str, StoredItinerary]" = OrderedDict()
+        self._pending: Dict[str, tuple] = {}   # id -> (entry, time of its first and of its last put)
+        self._flushing: Dict[str, tuple] = {}  # taken by a flush, not committed yet
+        self._feedback: List[tuple] = []
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()  # the connection, and one flush at a time
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+    @staticmethod
+    def new_id(req: PlanReq) -> str:
+        return f"{req.city[:3].lower()}-{req.date}-{uuid.uuid4().hex[:12]}"
+
+    def load(self):
+        if not self.path:
+            return
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS itineraries ("
+            " id TEXT PRIMARY KEY, city TEXT, date TEXT, req TEXT, likes TEXT,"
+            " result BLOB, created_at REAL, updated_at REAL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS itinerary_feedback ("
+            " itinerary_id TEXT, poi_id TEXT, rating INTEGER, segment TEXT, created_at REAL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS itinerary_feedback_id ON itinerary_feedback (itinerary_id)")
+        with self._db_lock:
+            self._db = db
+        self._stop.clear()
+        self._writer = threading.Thread(target=self._run, name="itinerary-writer", daemon=True)
+        self._writer.start()
+
+    def close(self):
+        if self._writer is not None:
+            self._stop.set()
+            self._wake.set()
+            self._writer.join()
+            self._writer = None
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get(self, itinerary_id: str) -> Optional[StoredItinerary]:
+        with self._lock:
+            entry = self._entries.get(itinerary_id)
+            if entry is not None:
+                self._entries.move_to_end(itinerary_id)
+                return entry
+            queued = self._pending.get(itinerary_id) or self._flushing.get(itinerary_id)
+
+        entry = queued[0] if queued else self._read(itinerary_id)
+        if entry is None:
+            return None
+        with self._lock:
+            # a put() since the lookup is newer than what was read
+            current = self._entries.get(itinerary_id)
+            if current is not None:
+                return current
+            self._insert(itinerary_id, entry)
+        return entry
+
+    def put(self, itinerary_id: str, entry: StoredItinerary):
+        with self._lock:
+            self._insert(itinerary_id, entry)
+            if self._db is not None:
+                now = time.time()
+                queued = self._pending.get(itinerary_id)
+                self._pending[itinerary_id] = (entry, queued[1] if queued else now, now)
+                if len(self._pending) >= self.batch:
+                    self._wake.set()
+
+    def add_feedback(self, fb: "Feedback"):
+        """Queue a rating for the itinerary_feedback table (joined to itineraries offline)."""
+        with self._lock:
+            if self._db is not None:
+                self._feedback.append((fb.itinerary_id, fb.poi_id, fb.rating, fb.segment, time.time()))
+
+    def flush(self):
+        """Write everything queued so far in one transaction."""
+        with self._db_lock:
+            if self._db is None:
+                return
+            with self._lock:
+                items, self._pending = self._pending, {}
+                feedback, self._feedback = self._feedback, []
+                self._flushing = items
+            if not items and not feedback:
+                return
+
+            t0 = time.perf_counter()
+            rows = [
+                (iid, e.req.city, e.req.date, e.req.model_dump_json(), json.dumps(sorted(e.likes)),
+                 encode_json(e.result), created_at, updated_at)
+                for iid, (e, created_at, updated_at) in items.items()
+            ]
+            try:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT INTO itineraries VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                        " ON CONFLICT (id) DO UPDATE SET req = excluded.req, likes = excluded.likes,"
+                        " result = excluded.result, updated_at = excluded.updated_at",
+                        rows,
+                    )
+                    self._db.executemany("INSERT INTO itinerary_feedback VALUES (?, ?, ?, ?, ?)", feedback)
+            except sqlite3.Error:
+                # keep them queued for the next flush; newer puts of an id win
+                with self._lock:
+                    for iid, queued in items.items():
+                        self._pending.setdefault(iid, queued)
+                    self._feedback[:0] = feedback
+                ITINERARY_WRITE_ERRORS.inc()
+                return
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            ITINERARY_WRITES.inc(len(rows), table="itineraries")
+            ITINERARY_WRITES.inc(len(feedback), table="itinerary_feedback")
+            ITINERARY_FLUSH_LATENCY.observe(time.perf_counter() - t0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_s)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def _read(self, itinerary_id: str) -> Optional[StoredItinerary]:
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT req, likes, result FROM itineraries WHERE id = ?", (itinerary_id,)).fetchone()
+        if row is None:
+            return None
+        req, likes, result = row
+        return StoredItinerary(PlanReq.model_validate_json(req), frozenset(json.loads(likes)), json.loads(result))
+
+    def _insert(self, itinerary_id: str, entry: StoredItinerary):
+        self._entries[itinerary_id] = entry
+        self._entries.move_to_end(itinerary_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+ITINERARIES = ItineraryStore()
+
+
+def register_itinerary(req: PlanReq, likes, result: dict) -> dict:
+    """Store a copy of result under a fresh itinerary_id and return it."""
+    result = {**result, "itinerary_id": ITINERARIES.new_id(req)}
+    ITINERARIES.put(result["itinerary_id"], StoredItinerary(req, frozenset(likes), result))
+    return result
+
+
+# --------- RESPONSE ENCODING ---------
+COMPRESS_MIN_BYTES = 1024      # smaller bodies are not worth compressing
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5             # 11 is the maximum, and far too slow per request
+STREAM_CHUNK_BYTES = 64 * 1024
+# format=compact: one row per stop; from is only there when the leg does not start at the previous stop
+COMPACT_STOP_FIELDS = ["poi_id", "start", "end", "eta_min", "from"]
+
+
+def negotiate_encoding(request: Request, size: int) -> Optional[str]:
+    """The Content-Encoding to send size bytes with: br (if installed), then gzip, else None."""
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    accepted = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def etag_of(body: bytes) -> str:
+    # weak: the same JSON is sent gzip-, br- or un-encoded under one tag
+    return 'W/"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match names etag (weak comparison) or is "*"."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip() == "*" or tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def encoded_response(request: Request, body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    """body (JSON bytes), compressed when the client accepts it."""
+    headers = {"Vary": "Accept-Encoding", **(headers or {})}
+    encoding = negotiate_encoding(request, len(body))
+    if encoding is not None:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def json_response(request: Request, obj) -> Response:
+    """
+    obj as JSON, skipping FastAPI's jsonable_encoder/response_model pass over
+    plain dicts (the models on the routes only document the body).
+    """
+    return encoded_response(request, encode_json(obj))
 
-    CURRENT_PREFS_LIKE = normalized
 
-    # 2) travel speed and date info
-    speed_kmh = get_speed_kmh(req)
+def compact_plan(result: dict) -> dict:
+    """
+    format=compact body of a /plan response: stops grouped by day as rows of
+    COMPACT_STOP_FIELDS instead of stop and leg dicts. Names come from /pois
+    by poi_id, the mode is given once, dwell is end - start, and a row has
+    no "from" when its leg starts at the previous stop (Start for the day's first).
+    """
+    days = {d: [] for d in range(1, len(result["metrics"]["day_solve_ms"]) + 1)}
+    prev = {}
+    for stop, leg in zip(result["stops"], result["legs"]):
+        day = stop["day"]
+        row = [stop["poi_id"], stop["start"], stop["end"], leg["eta_min"]]
+        if leg["from"] != prev.get(day, "Start"):
+            row.append(leg["from"])
+        days.setdefault(day, []).append(row)
+        prev[day] = stop["name"]
+    return {
+        "itinerary_id": result["itinerary_id"],
+        "format": "compact",
+        "stop_fields": COMPACT_STOP_FIELDS,
+        "mode": result["legs"][0]["mode"] if result["legs"] else None,
+        "days": [{"day": d, "stops": rows} for d, rows in sorted(days.items())],
+        "cost_summary": result["cost_summary"],
+        "metrics": result["metrics"],
+    }
+
+
+def plan_body(result: dict, fmt: str) -> dict:
+    """A plan in the requested response format ("full" or "compact")."""
+    return compact_plan(result) if fmt == "compact" else result
+
+
+def buffer_chunks(body: bytes):
+    for k in range(0, len(body), STREAM_CHUNK_BYTES):
+        yield body[k:k + STREAM_CHUNK_BYTES]
+
+
+# --------- ENDPOINTS ---------
+def catalog_for(city: str) -> PoiCatalog:
+    """CATALOGS.get, answering 404 for cities without a dataset."""
+    try:
+        return CATALOGS.get(city)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"unknown city {city!r}")
+
+
+@app.get("/pois", response_model=Union[PoisOut, PoisDeltaOut])
+def get_pois(
+    request: Request,
+    city: str = DEFAULT_CITY,
+    near: Optional[str] = None,
+    radius_km: Optional[float] = None,
+    k: Optional[int] = None,
+    bbox: Optional[str] = None,
+    since: Optional[int] = Query(None, ge=0),
+):
+    """
+    All POIs of a city, or a spatial subset:
+    - near="lat,lon" with radius_km and/or k: POIs around a point, nearest first
+    - bbox="min_lat,min_lon,max_lat,max_lon": POIs inside a box
+    - since=<version>: only what changed after that catalog version (PoiCatalog.delta_json)
+    Every body carries the catalog version (also in X-Catalog-Version) and an
+    ETag; If-None-Match with the current one answers 304 without a body.
+    The full list streams from the catalog's pre-encoded (and pre-compressed) buffer.
+    """
+    catalog = catalog_for(city)
+    if since is not None and (near is not None or bbox is not None):
+        raise HTTPException(status_code=400, detail="since cannot be combined with near or bbox")
+
+    headers = {"X-Catalog-Version": str(catalog.version)}
+    if since is None and near is None and bbox is None:
+        headers["ETag"] = catalog.pois_etag()
+        if etag_matches(request, headers["ETag"]):
+            return Response(status_code=304, headers={"Vary": "Accept-Encoding", **headers})
+        encoding = negotiate_encoding(request, len(catalog.pois_json()))
+        body = catalog.pois_body(encoding)
+        headers.update({"Vary": "Accept-Encoding", "Content-Length": str(len(body))})
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return StreamingResponse(buffer_chunks(body), media_type="application/json", headers=headers)
+
+    if since is not None:
+        body = catalog.delta_json(since)
+    else:
+        spatial = catalog.spatial
+        try:
+            if bbox is not None:
+                min_lat, min_lon, max_lat, max_lon = (float(x) for x in bbox.split(","))
+                idx = spatial.bbox(min_lat, min_lon, max_lat, max_lon)
+            else:
+                lat, lon = (float(x) for x in near.split(","))
+                if radius_km is None and k is None:
+                    raise ValueError("near needs radius_km and/or k")
+                if k is not None:
+                    idx = spatial.nearest(lat, lon, k)
+                    if radius_km is not None:
+                        idx = idx[spatial.distances_km(lat, lon, idx) <= radius_km]
+                else:
+                    idx = spatial.within(lat, lon, radius_km)
+                    idx = idx[np.argsort(spatial.distances_km(lat, lon, idx), kind="stable")]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        body = catalog.pois_json(idx.tolist())
+
+    headers["ETag"] = etag_of(body)
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers={"Vary": "Accept-Encoding", **headers})
+    return encoded_response(request, body, headers)
+
+
+@dataclass
+class PlanRun:
+    """Per-request planning setup shared by /plan and /plan/stream."""
+    req: PlanReq
+    ctx: ScoringContext
+    cache_key: str
+    planner: str
+    mode: TravelMode
+    days: int
+    dow: Optional[int]
+    deadline: Optional[float]
+    pins: Dict[int, DayPins]
+
+
+def start_plan_run(req: PlanReq, likes: set, cache_key: str) -> PlanRun:
+    """Set up planning for req; must-sees that cannot all be kept are a 400 with the reason."""
+    catalog = catalog_for(req.city)
+    # travel speed and date info
+    mode = get_travel_mode(req)
     days = req.days or 1
     dow = parse_day_of_week(req.date)
+    try:
+        pins = presolve_must_see(req, catalog, mode, dow, days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"must_see: {e}")
+    return PlanRun(
+        req=req,
+        ctx=make_scoring_context(req.strategy, likes, req.segment, catalog),
+        cache_key=cache_key,
+        planner=strategy_planner(req.strategy),
+        mode=mode,
+        days=days,
+        dow=dow,
+        deadline=time.time() + req.timeout_s if req.timeout_s else None,
+        pins=pins,
+    )
 
-    # 3) choose planner + measure runtime
-    t0 = time.perf_counter()
-    if req.strategy.startswith("astar"):
-        stops, legs, summary, search_effort = plan_multi_day_astar(req, days, speed_kmh, dow)
-        planner_name = "astar"
-    else:
-        stops, legs, summary, search_effort = plan_multi_day_greedy(req, days, speed_kmh, dow)
-        planner_name = "greedy"
-    t1 = time.perf_counter()
-    runtime_ms = (t1 - t0) * 1000.0
+
+def iter_plan_days(run: PlanRun):
+    """Yield (day, route, legs, effort, solve ms) per day as the days get solved."""
+    args = (run.req, run.ctx, run.planner, run.days, run.mode, run.dow, run.deadline, run.pins)
+    if run.req.multi_day_mode == "partitioned" and run.days > 1:
+        return iter_days_partitioned(*args)
+    return iter_days_sequential(*args)
+
+
+def itinerary_result(run: PlanRun, stops, legs, summary, search_effort, day_ms, runtime_ms: float,
+                     timed_out: bool) -> dict:
+    """The /plan response body for a finished itinerary (itinerary_id is set on registration)."""
+    ctx = run.ctx
 
     # Total score for this itinerary
     total_score = 0.0
     for s in stops:
-        poi = next((p for p in POIS if p["id"] == s["poi_id"]), None)
+        poi = ctx.catalog.get(s["poi_id"])
         if poi:
-            total_score += score(poi, req.strategy)
+            total_score += score(poi, ctx)
 
     total_travel_min = sum(l["eta_min"] for l in legs)
 
     metrics = {
-        "planner": planner_name,
+        "planner": run.planner,
         "runtime_ms": runtime_ms,
         "total_stops": len(stops),
         "total_travel_min": total_travel_min,
         "total_score": total_score,
         "search_effort": search_effort,
+        "cache_hit": False,
+        "timed_out": timed_out,
+        "day_solve_ms": day_ms,
     }
 
     return {
-        "itinerary_id": f"bos-{req.date}-001",
+        "itinerary_id": None,
         "stops": stops,
         "legs": legs,
         "cost_summary": summary,
@@ -702,16 +4114,371 @@ def plan(req: PlanReq):
     }
 
 
+def finish_plan(run: PlanRun, stops, legs, summary, search_effort, day_ms, runtime_ms: float) -> dict:
+    """Score and measure a finished itinerary, register it and cache the /plan response."""
+    req = run.req
+    timed_out = run.deadline is not None and time.time() > run.deadline
+    result = register_itinerary(
+        req, run.ctx.likes,
+        itinerary_result(run, stops, legs, summary, search_effort, day_ms, runtime_ms, timed_out),
+    )
+
+    label = strategy_label(req.strategy)
+    PLAN_LATENCY.observe(runtime_ms / 1000.0, strategy=label)
+    if timed_out:
+        PLAN_TIMEOUTS.inc(strategy=label)
+
+    # the plan can change if learned ratings move for any category it could have picked
+    cols = run.ctx.catalog.columns
+    open_mask = cols.open_today_mask(run.dow, req.use_live_constraints)
+    depends_on = {cols.categories[c] for c in np.unique(cols.cat[open_mask])}
+    # a plan cut short by its deadline is not the answer to this request
+    if not timed_out and not req.profile:
+        PLAN_CACHE.put(run.cache_key, result, depends_on)
+
+    return result
+
+
+@app.post("/plan", response_model=Union[PlanOut, CompactPlanOut])
+def post_plan(
+    req: PlanReq,
+    request: Request,
+    fmt: str = Query("full", alias="format", pattern="^(full|compact)$"),
+):
+    """
+    Plan a trip (see plan()). format=compact answers with compact_plan's
+    encoding; bodies are gzip/br compressed when the client accepts it.
+    """
+    return json_response(request, plan_body(plan(req), fmt))
+
+
+def plan(req: PlanReq):
+    """
+    High-level planner:
+    - Normalizes preferences.like into a per-request ScoringContext
+    - Serves repeats of the same normalized request from PLAN_CACHE
+    - Plans over req.city's catalog (404 for cities without a dataset)
+    - Chooses travel speed from mobility/has_car
+    - Pins must_see POIs to days first (presolve_must_see); 400 with the
+      reason when they cannot all be kept
+    - Strategy:
+        * "astar_*" -> A* planner
+        * "ils_*" -> iterated local search (orienteering)
+        * otherwise -> greedy + CSP fallback
+    - Adds multi-day structure and cost summary
+    - Returns extra metrics for evaluation (profile=true adds metrics.profile)
+    """
+
+    # 1) preferences.like -> ScoringContext (normalized to match CSV categories)
+    return plan_with_likes(req, normalize_likes(req.preferences))
+
+
+def plan_with_likes(req: PlanReq, normalized: set) -> dict:
+    """/plan for a request whose preferences.like is already normalized."""
+    cache_key = plan_cache_key(req, normalized)
+    cached = None if req.profile else PLAN_CACHE.get(cache_key)
+    PLAN_REQUESTS.inc(strategy=strategy_label(req.strategy), cache="miss" if cached is None else "hit")
+    if cached is not None:
+        return register_itinerary(req, normalized, {**cached, "metrics": {**cached["metrics"], "cache_hit": True}})
+
+    run = start_plan_run(req, normalized, cache_key)
+
+    # 2) choose planner + measure runtime
+    with SamplingProfiler() if req.profile else nullcontext() as profiler:
+        t0 = time.perf_counter()
+        if run.planner == "astar" and req.execution == "process" and pool_plans(run.ctx.catalog) \
+                and req.multi_day_mode != "partitioned":
+            run.deadline = run.deadline or time.time() + PLAN_POOL_TIMEOUT_S
+            planned = plan_multi_day_astar_pooled(req, run.ctx, run.days, run.mode, run.dow, run.deadline, run.pins)
+        else:
+            planned = collect_days(iter_plan_days(run))
+        runtime_ms = (time.perf_counter() - t0) * 1000.0
+
+    result = finish_plan(run, *planned, runtime_ms)
+    if profiler:
+        result["metrics"]["profile"] = profiler.report()
+    return result
+
+
+# most plans one /plan/batch call may ask for, and the threads they run on
+PLAN_BATCH_MAX = 16
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="plan-batch")
+
+
+@app.post("/plan/batch", response_model=PlanBatchOut)
+async def plan_batch(
+    batch: PlanBatchReq,
+    request: Request,
+    fmt: str = Query("full", alias="format", pattern="^(full|compact)$"),
+):
+    """
+    Several plans in one call, solved concurrently on BATCH_EXECUTOR:
+    - trip + strategies: one trip under each strategy; its preferences are
+      normalized once, and open-today masks, score vectors and travel
+      matrices are shared through the city catalog's caches
+    - trips: independent trips (each may set its own strategy)
+    Returns one /plan response per plan, in request order, tagged with its
+    trip index (trip is 0, trips follow) and strategy (format as for /plan).
+    """
+    jobs = []  # (trip index, request, normalized likes)
+    if batch.trip is not None:
+        likes = normalize_likes(batch.trip.preferences)
+        for strategy in batch.strategies or [batch.trip.strategy]:
+            jobs.append((0, batch.trip.model_copy(update={"strategy": strategy}), likes))
+    first = 1 if batch.trip is not None else 0
+    for k, trip in enumerate(batch.trips, start=first):
+        jobs.append((k, trip, normalize_likes(trip.preferences)))
+
+    if not jobs:
+        raise HTTPException(status_code=400, detail="nothing to plan: send trip and/or trips")
+    if len(jobs) > PLAN_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"at most {PLAN_BATCH_MAX} plans per batch")
+
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(BATCH_EXECUTOR, plan_with_likes, req, likes) for _, req, likes in jobs
+    ))
+    runtime_ms = (time.perf_counter() - t0) * 1000.0
+
+    return json_response(request, {
+        "results": [{"trip": k, "strategy": req.strategy, **plan_body(result, fmt)}
+                    for (k, req, _), result in zip(jobs, results)],
+        "metrics": {"plans": len(jobs), "runtime_ms": runtime_ms},
+    })
+
+
+def _ndjson(event: dict) -> bytes:
+    return encode_json(event) + b"\n"
+
+
+@app.post("/plan/stream")
+def plan_stream(req: PlanReq):
+    """
+    Same plan as /plan, streamed as NDJSON so clients can show day 1 early:
+    - one {"type": "day", "day", "stops", "legs", "solve_ms"} line per solved day
+      (partitioned plans send days in the order they finish)
+    - then {"type": "summary", "itinerary_id", "cost_summary", "metrics"}
+    A client that disconnects stops the remaining days from being planned.
+    """
+    normalized = normalize_likes(req.preferences)
+    cache_key = plan_cache_key(req, normalized)
+    cached = PLAN_CACHE.get(cache_key)
+    PLAN_REQUESTS.inc(strategy=strategy_label(req.strategy), cache="miss" if cached is None else "hit")
+
+    def summary_event(result: dict) -> bytes:
+        return _ndjson({
+            "type": "summary",
+            "itinerary_id": result["itinerary_id"],
+            "cost_summary": result["cost_summary"],
+            "metrics": result["metrics"],
+        })
+
+    # an unknown city or must-sees that do not fit have to fail here, before the 200 response starts streaming
+    run = None if cached is not None else start_plan_run(req, normalized, cache_key)
+
+    def events():
+        if cached is not None:
+            for day, ms in enumerate(cached["metrics"]["day_solve_ms"], start=1):
+                yield _ndjson({
+                    "type": "day",
+                    "day": day,
+                    "stops": [s for s in cached["stops"] if s["day"] == day],
+                    "legs": [l for l in cached["legs"] if l["day"] == day],
+                    "solve_ms": ms,
+                })
+            yield summary_event(register_itinerary(
+                req, normalized, {**cached, "metrics": {**cached["metrics"], "cache_hit": True}}))
+            return
+
+        t0 = time.perf_counter()
+        solved = []
+        for day_result in iter_plan_days(run):
+            day, route_day, legs_day, _, ms = day_result
+            solved.append(day_result)
+            yield _ndjson({"type": "day", "day": day, "stops": route_day, "legs": legs_day, "solve_ms": ms})
+        runtime_ms = (time.perf_counter() - t0) * 1000.0
+
+        yield summary_event(finish_plan(run, *collect_days(solved), runtime_ms))
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/replan", response_model=Union[PlanOut, CompactPlanOut])
+def replan(
+    rr: ReplanReq,
+    request: Request,
+    fmt: str = Query("full", alias="format", pattern="^(full|compact)$"),
+):
+    """
+    Re-plan the rest of one day of an issued itinerary from where the user is:
+    - earlier days and the stops done today stay as they are
+    - the rest of the day is planned again from (lat, lon) at current_time, with
+      the budget the done stops left, by the itinerary's own planner
+    - later days keep their plans unless one of their stops was done or
+      skipped already; only those days are planned again
+    Returns the updated itinerary under the same itinerary_id (format as for /plan).
+    """
+    entry = ITINERARIES.get(rr.itinerary_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="unknown itinerary_id")
+    try:
+        now = minutes(rr.current_time)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="current_time must be HH:MM")
+    if (rr.lat is None) != (rr.lon is None):
+        raise HTTPException(status_code=400, detail="lat and lon must be given together")
+
+    req, old = entry.req, entry.result
+    days = req.days or 1
+    done, gone = set(rr.done), set(rr.done) | set(rr.skip)
+    unknown = done - {s["poi_id"] for s in old["stops"]}
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"done stops not in itinerary: {sorted(unknown)}")
+    day = rr.day or next((s["day"] for s in old["stops"] if s["poi_id"] not in done), days)
+    if not 1 <= day <= days:
+        raise HTTPException(status_code=400, detail=f"day must be between 1 and {days}")
+
+    run = start_plan_run(req, entry.likes, cache_key="")
+    t0 = time.perf_counter()
+
+    # stops and the legs into them, per day (every stop has exactly one leg into it)
+    by_day = {d: [] for d in range(1, days + 1)}
+    for stop, leg in zip(old["stops"], old["legs"]):
+        by_day[stop["day"]].append((stop, leg))
+
+    later = [d for d in range(day + 1, days + 1) if any(s["poi_id"] in gone for s, _ in by_day[d])]
+    used = gone | {s["poi_id"] for d, pairs in by_day.items() if d != day and d not in later for s, _ in pairs}
+    used |= pinned_ids(run.pins)
+
+    def pins_for(d: int) -> Optional[DayPins]:
+        # must-sees done or skipped are not pinned any more
+        return run.pins[d].without(gone) if d in run.pins else None
+
+    # keep the stops done today (including ones planned for a later day), chaining their legs
+    kept, prev = [], "Start"
+    for d in (day, *later):
+        for stop, leg in by_day[d]:
+            if stop["poi_id"] in done:
+                kept.append(({**stop, "day": day}, {**leg, "from": prev, "day": day}))
+                prev = stop["name"]
+
+    budget = req.budget_total / days - sum(s["admission_est"] for s, _ in kept)
+    if rr.lat is not None:
+        origin = DayStart("Current location", rr.lat, rr.lon, now, budget, idx=None)
+    elif kept:
+        p = run.ctx.catalog.get(kept[-1][0]["poi_id"])
+        origin = DayStart(p.name, p.lat, p.lon, now, budget, p.index)
+    else:
+        start = run.ctx.catalog.start
+        origin = DayStart("Start", start["lat"], start["lon"], now, budget)
+
+    day_ms = list(old["metrics"]["day_solve_ms"])
+    route, legs, effort, day_ms[day - 1] = solve_day(
+        req, run.ctx, run.planner, day, used, run.mode, run.dow, run.deadline, origin, pins_for(day))
+    by_day[day] = kept + list(zip(route, legs))
+
+    for d in later:
+        route, legs, day_effort, day_ms[d - 1] = solve_day(
+            req, run.ctx, run.planner, d, used, run.mode, run.dow, run.deadline, pins=pins_for(d))
+        by_day[d] = list(zip(route, legs))
+        effort += day_effort
+
+    stops = [s for d in range(1, days + 1) for s, _ in by_day[d]]
+    legs = [l for d in range(1, days + 1) for _, l in by_day[d]]
+    runtime_ms = (time.perf_counter() - t0) * 1000.0
+    REPLAN_LATENCY.observe(runtime_ms / 1000.0)
+
+    timed_out = run.deadline is not None and time.time() > run.deadline
+    result = itinerary_result(run, stops, legs, summarize_costs(stops), effort, day_ms, runtime_ms, timed_out)
+    result["itinerary_id"] = rr.itinerary_id
+    result["metrics"]["replanned_days"] = [day, *later]
+    ITINERARIES.put(rr.itinerary_id, StoredItinerary(req, entry.likes, result))
+    return json_response(request, plan_body(result, fmt))
+
+
+@app.get("/itinerary/{itinerary_id}", response_model=Union[PlanOut, CompactPlanOut])
+def get_itinerary(
+    itinerary_id: str,
+    request: Request,
+    fmt: str = Query("full", alias="format", pattern="^(full|compact)$"),
+):
+    """An issued itinerary as last planned or re-planned, without solving it again (format as for /plan)."""
+    entry = ITINERARIES.get(itinerary_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="unknown itinerary_id")
+    return json_response(request, plan_body(entry.result, fmt))
+
+
 @app.post("/feedback")
-def feedback(fb: Feedback):
+def feedback(fb: Union[Feedback, List[Feedback]]):
     """
     Simple preference learning:
-    - Look up POI by id
-    - Add rating to that category's history
-    - score() uses CATEGORY_RATINGS to bias scores
-    """
-    poi = next((p for p in POIS if p["id"] == fb.poi_id), None)
-    if poi:
-        cat = poi["category"].lower()
-        CATEGORY_RATINGS[cat].append(fb.rating)
-    return {"ok": True}
+    - takes one rating or a list of them
+    - each rating updates the running stats of its POI's category, for its
+      segment and overall (PREFERENCES); score() biases by the mean rating
+    - a rating counts only for a stop of the itinerary it names; the others
+      come back under "rejected" with the reason
+    - accepted ratings are also stored with their itinerary_id (ITINERARIES)
+    """
+    batch = fb if isinstance(fb, list) else [fb]
+    ratings, rejected = [], []
+    for f in batch:
+        entry = ITINERARIES.get(f.itinerary_id)
+        if entry is None:
+            reason = "unknown itinerary_id"
+        elif all(s["poi_id"] != f.poi_id for s in entry.result["stops"]):
+            reason = "poi_id not in itinerary"
+        else:
+            try:
+                poi = CATALOGS.get(entry.req.city).get(f.poi_id)
+            except KeyError:
+                poi = None
+            if poi is not None:
+                ratings.append((f.segment, poi.cat, f.rating))
+                ITINERARIES.add_feedback(f)
+                continue
+            reason = "unknown poi_id"
+        rejected.append({"itinerary_id": f.itinerary_id, "poi_id": f.poi_id, "reason": reason})
+    PREFERENCES.add(ratings)
+    for cat in {cat for _, cat, _ in ratings}:
+        PLAN_CACHE.invalidate_category(cat)
+    return {"ok": True, "accepted": len(ratings), "rejected": rejected}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until WARMUP has finished (or if it failed), then the loaded cities."""
+    if not WARMUP.ready:
+        detail = WARMUP.error or "warming up"
+        raise HTTPException(status_code=503, detail=detail)
+    return {
+        "ready": True,
+        "cities": [c.city for c in CATALOGS.loaded()],
+        "warmup_s": WARMUP.seconds,
+        "plan_pool_workers": PLAN_POOL_WORKERS if PLAN_POOL is not None else 0,
+    }
+
+
+@app.get("/plan/cache")
+def plan_cache_stats():
+    return PLAN_CACHE.stats()
+
+
+@app.get("/metrics")
+def metrics():
+    """Planner counters and histograms plus PLAN_CACHE stats, in Prometheus text format."""
+    cache = PLAN_CACHE.stats()
+    lines = [
+        "# HELP plan_cache_hits_total Plan requests answered from PLAN_CACHE.",
+        "# TYPE plan_cache_hits_total counter",
+        f"plan_cache_hits_total {cache['hits']}",
+        "# HELP plan_cache_misses_total Plan cache lookups that had to plan.",
+        "# TYPE plan_cache_misses_total counter",
+        f"plan_cache_misses_total {cache['misses']}",
+        "# HELP plan_cache_entries Plans currently held in PLAN_CACHE.",
+        "# TYPE plan_cache_entries gauge",
+        f"plan_cache_entries {cache['size']}",
+    ]
+    body = METRICS.render() + "\n".join(lines) + "\n"
+    return Response(content=body, media_type="text/plain; version=0.0.4")
@@ -0,0 +1,66 @@
+"""Exact A* (search_mode "astar") finds the best route over its candidates, waiting where that helps."""
+import numpy as np
+import pytest
+
+import main
+
+K = 8
+
+
+def best_by_enumeration(req, ctx, mode, dow) -> float:
+    """
+    Best score of any order of the same K candidates. Legs may leave at any
+    minute after the last stop; travel times only change on the hour, so
+    leaving right away or on a later hour covers every choice.
+    """
+    catalog = ctx.catalog
+    cols = catalog.columns
+    origin = main.day_start(req, catalog)
+    end = main.day_end(req, origin)
+    scores = cols.score_vector(ctx)
+    open_from = cols.hours(dow, req.use_live_constraints)[0]
+    latest = cols.latest_arrival(dow, req.use_live_constraints)
+    pool = np.flatnonzero(main.day_candidate_mask(catalog, req, dow, origin.time, end, origin.budget, mode, origin))
+    cand = pool[np.argsort(-scores[pool], kind="stable")[:K]].tolist()
+
+    def search(last, t, budget, left) -> float:
+        best = 0.0
+        for j in left:
+            arrive = min(d + catalog.travel.travel_mins(last, j, mode, dow, d)
+                         for d in [t, *range((t // 60 + 1) * 60, end, 60)])
+            arrive = max(arrive, open_from[j])
+            if arrive > latest[j] or arrive + cols.dwell[j] > end or budget < cols.cost[j]:
+                continue
+            best = max(best, scores[j] + search(j, arrive + cols.dwell[j], budget - cols.cost[j], left - {j}))
+        return best
+
+    return search(main.START, origin.time, origin.budget, frozenset(cand))
+
+
+@pytest.mark.parametrize("live", [False, True])
+@pytest.mark.parametrize("trip", [
+    dict(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=60),
+    dict(date="2025-06-07", start_time="07:30", end_time="13:00", budget_total=30, has_car=True),
+    dict(date="2025-06-01", start_time="15:00", end_time="23:30", budget_total=80, mobility="mbta"),
+    # explorer's best candidates are all closed at 07:30: the route has to wait
+    dict(date="2025-06-03", start_time="07:30", end_time="18:00", budget_total=80, strategy="astar_explorer"),
+])
+def test_astar_route_is_the_best_order(catalog, trip, live):
+    req = main.PlanReq(**{"strategy": "astar_budget", **trip}, max_candidates=K, use_live_constraints=live)
+    ctx = main.make_scoring_context(req.strategy, catalog=catalog)
+    mode, dow = main.get_travel_mode(req), main.parse_day_of_week(req.date)
+    route, _, _ = main.astar_plan_one_day(req, ctx, 1, set(), mode, dow)
+
+    scores = catalog.columns.score_vector(ctx)
+    got = sum(scores[catalog.by_id[s["poi_id"]]] for s in route)
+    assert got == pytest.approx(best_by_enumeration(req, ctx, mode, dow))
+
+
+def test_astar_waits_for_a_stop_to_open(catalog):
+    # one early start, nothing else to do before the only POI opens at 10:00
+    row = {**catalog.get("castle-island").to_dict(), "open_from": "10:00"}
+    only = main.PoiCatalog([{**row, "lat": main.START_LOC["lat"], "lon": main.START_LOC["lon"] + 0.001}], city="boston")
+    req = main.PlanReq(date="2025-06-03", start_time="08:00", end_time="18:00", budget_total=100, strategy="astar_budget")
+    ctx = main.make_scoring_context(req.strategy, catalog=only)
+    route, _, _ = main.astar_plan_one_day(req, ctx, 1, set(), main.get_travel_mode(req), 1)
+    assert [(s["poi_id"], s["start"]) for s in route] == [("castle-island", "10:00")]
@@ -0,0 +1,104 @@
+"""Catalog updates through add_pois: one row per id, seen by /pois (ETags, since= deltas) and the planners."""
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+TRIP = dict(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=600, days=6)
+
+
+def test_readding_an_id_replaces_the_poi(catalog):
+    row = catalog.get("old-north").to_dict()
+    n = len(catalog)
+    main.add_pois([{**row, "name": "Old North Church (restored)", "lat": row["lat"] + 0.002, "category": "Museum"}])
+
+    ids = [p["id"] for p in client.get("/pois").json()["pois"]]
+    assert len(ids) == len(set(ids)) == n
+    poi = catalog.get("old-north")
+    assert poi.name == "Old North Church (restored)"
+    assert catalog.columns.lat[poi.index] == poi.lat
+    assert poi.index in catalog.by_category["museum"]
+    assert poi.index not in catalog.by_category.get(row["category"].lower(), [])
+
+    delta = client.get("/pois", params={"since": catalog.version - 1}).json()
+    assert [p["id"] for p in delta["pois"]] == ["old-north"] and delta["removed"] == []
+
+
+def test_multi_day_plans_do_not_repeat_readded_pois(catalog):
+    main.add_pois([p.to_dict() for p in catalog.records[:10]])
+    for strategy in ("static_budget", "astar_budget"):
+        stops = [s["poi_id"] for s in client.post("/plan", json={**TRIP, "strategy": strategy}).json()["stops"]]
+        assert stops and len(stops) == len(set(stops))
+
+
+def test_added_pois_are_not_hidden_by_the_plan_cache(catalog):
+    first = client.post("/plan", json=TRIP).json()
+    assert client.post("/plan", json=TRIP).json()["metrics"]["cache_hit"]
+
+    # a free copy of the first stop, right next to it: the new plan has to pick one of the two
+    stop = catalog.get(first["stops"][0]["poi_id"]).to_dict()
+    main.add_pois([{**stop, "id": "annex", "name": "Annex", "lat": stop["lat"] + 1e-4, "admission_cost": 0.0}])
+    again = client.post("/plan", json=TRIP).json()
+    assert not again["metrics"]["cache_hit"]
+    assert len(again["stops"]) == len({s["poi_id"] for s in again["stops"]})
+    assert {"annex", stop["id"]} & {s["poi_id"] for s in again["stops"]}
+
+
+def test_pois_etag_answers_304_until_the_catalog_changes(catalog):
+    res = client.get("/pois")
+    etag = res.headers["etag"]
+    assert res.headers["x-catalog-version"] == str(catalog.version)
+    assert client.get("/pois", headers={"If-None-Match": etag}).status_code == 304
+
+    row = catalog.get("old-north").to_dict()
+    main.add_pois([{**row, "id": "annex", "name": "Annex"}])
+    res = client.get("/pois", headers={"If-None-Match": etag})
+    assert res.status_code == 200 and res.headers["etag"] != etag
+    assert res.headers["x-catalog-version"] == str(catalog.version)
+    assert "annex" in {p["id"] for p in res.json()["pois"]}
+
+
+def test_since_returns_only_what_changed(catalog):
+    before = catalog.version
+    row = catalog.get("old-north").to_dict()
+    main.add_pois([{**row, "id": "annex", "name": "Annex"}, {**row, "name": "Old North (renamed)"}])
+
+    delta = client.get("/pois", params={"since": before})
+    body = delta.json()
+    assert body["version"] == catalog.version and body["since"] == before and not body["reset"]
+    assert sorted(p["id"] for p in body["pois"]) == ["annex", "old-north"] and body["removed"] == []
+    assert client.get("/pois", params={"since": before},
+                      headers={"If-None-Match": delta.headers["etag"]}).status_code == 304
+
+    assert client.get("/pois", params={"since": catalog.version}).json()["pois"] == []
+    # a version this catalog never had: the client starts over from the full list
+    reset = client.get("/pois", params={"since": catalog.version + 5}).json()
+    assert reset["reset"] and len(reset["pois"]) == len(catalog)
+
+
+def test_since_cannot_be_combined_with_a_spatial_filter(catalog):
+    res = client.get("/pois", params={"since": 0, "near": "42.36,-71.06", "k": 3})
+    assert res.status_code == 400
+
+
+def test_added_versions_are_numbered_by_the_change_log(catalog, tmp_path, monkeypatch):
+    log = main.CatalogChangeLog(path=str(tmp_path / "changes.db"))
+    monkeypatch.setattr(main, "CATALOG_CHANGES", log)
+    row = catalog.get("old-north").to_dict()
+
+    # another process adds to its own copy of the city first
+    other = main.PoiCatalog(main.read_poi_csv(main.CSV_PATH), city="boston")
+    other.add([{**row, "id": "elsewhere"}])
+    log.record_added("boston", other, 0)
+
+    main.add_pois([{**row, "id": "annex"}])
+    assert (other.version, catalog.version) == (1, 2)
+    # this catalog never held version 1: a client at it gets the full list
+    assert client.get("/pois", params={"since": 1}).json()["reset"]
+
+    main.add_pois([{**row, "id": "annex-2"}])
+    delta = client.get("/pois", params={"since": 2}).json()
+    assert catalog.version == 3 and not delta["reset"] and [p["id"] for p in delta["pois"]] == ["annex-2"]
+    with main.sqlite3.connect(log.path) as db:
+        assert db.execute("SELECT version, added FROM catalog_versions ORDER BY version").fetchall() == [
+            (1, '["elsewhere"]'), (2, '["annex"]'), (3, '["annex-2"]')]
@@ -0,0 +1,39 @@
+"""/feedback: ratings outside 1-5 are rejected before they reach the learned scores."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+TRIP = dict(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=100)
+
+
+@pytest.fixture()
+def stop():
+    """(itinerary_id, poi_id) of the first stop of a fresh plan."""
+    plan = client.post("/plan", json=TRIP).json()
+    return plan["itinerary_id"], plan["stops"][0]["poi_id"]
+
+
+@pytest.mark.parametrize("rating", [0, 6, 500, -3])
+def test_out_of_range_rating_is_rejected(stop, rating):
+    itinerary_id, poi_id = stop
+    before = main.PREFERENCES.stats()
+    res = client.post("/feedback", json=dict(itinerary_id=itinerary_id, poi_id=poi_id, rating=rating))
+    assert res.status_code == 422
+    assert main.PREFERENCES.stats() == before
+
+
+def test_list_with_an_out_of_range_rating_is_rejected(stop):
+    itinerary_id, poi_id = stop
+    before = main.PREFERENCES.stats()
+    res = client.post("/feedback", json=[dict(itinerary_id=itinerary_id, poi_id=poi_id, rating=4),
+                                         dict(itinerary_id=itinerary_id, poi_id=poi_id, rating=500)])
+    assert res.status_code == 422
+    assert main.PREFERENCES.stats() == before
+
+
+def test_rating_in_range_is_accepted(stop):
+    itinerary_id, poi_id = stop
+    res = client.post("/feedback", json=[dict(itinerary_id=itinerary_id, poi_id=poi_id, rating=r) for r in (1, 5)])
+    assert res.status_code == 200 and res.json()["accepted"] == 2
@@ -0,0 +1,84 @@
+"""ItineraryStore: writes go behind to SQLite and come back after eviction or a restart."""
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+REQ = main.PlanReq(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=100)
+
+
+def entry(n: int = 0) -> main.StoredItinerary:
+    return main.StoredItinerary(REQ, frozenset({"museums"}), {"stops": [], "n": n})
+
+
+def stored_ids(path) -> list:
+    with sqlite3.connect(path) as db:
+        return [row[0] for row in db.execute("SELECT id FROM itineraries ORDER BY id")]
+
+
+@pytest.fixture()
+def store(tmp_path):
+    # a long flush interval: only flush() and close() write
+    store = main.ItineraryStore(maxsize=2, path=str(tmp_path / "itin.db"), flush_s=3600.0)
+    store.load()
+    yield store
+    store.close()
+
+
+def test_put_is_written_behind_not_through(store):
+    store.put("a", entry())
+    assert store.get("a").result["n"] == 0
+    assert stored_ids(store.path) == []
+    store.flush()
+    assert stored_ids(store.path) == ["a"]
+
+
+def test_latest_put_before_a_flush_is_written_once(store):
+    store.put("a", entry(1))
+    store.put("a", entry(2))
+    store.flush()
+    with sqlite3.connect(store.path) as db:
+        (result,) = db.execute("SELECT result FROM itineraries WHERE id = 'a'").fetchone()
+    assert b'"n":2' in result and stored_ids(store.path) == ["a"]
+
+
+def test_evicted_itineraries_come_back_from_the_queue_and_from_sqlite(store):
+    for iid in ("a", "b", "c"):  # maxsize=2: a leaves the hot tier
+        store.put(iid, entry())
+    assert store.get("a") is not None  # still queued
+    store.flush()
+    store.put("d", entry())
+    store.put("e", entry())
+    found = store.get("b")
+    assert found is not None and found.req == REQ and found.likes == frozenset({"museums"})
+
+
+def test_itineraries_and_feedback_survive_a_restart(tmp_path):
+    path = str(tmp_path / "itin.db")
+    first = main.ItineraryStore(path=path, flush_s=3600.0)
+    first.load()
+    first.put("a", entry(7))
+    first.add_feedback(main.Feedback(itinerary_id="a", poi_id="mfa", rating=4))
+    first.close()  # flushes what is queued
+
+    second = main.ItineraryStore(path=path)
+    second.load()
+    try:
+        assert second.get("a").result["n"] == 7
+        assert second.get("zzz") is None
+    finally:
+        second.close()
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT itinerary_id, poi_id, rating FROM itinerary_feedback").fetchall() == [("a", "mfa", 4)]
+
+
+def test_get_itinerary_endpoint(catalog):
+    plan = client.post("/plan", json=REQ.model_dump()).json()
+    res = client.get(f"/itinerary/{plan['itinerary_id']}")
+    assert res.status_code == 200 and res.json()["stops"] == plan["stops"]
+    compact = client.get(f"/itinerary/{plan['itinerary_id']}", params={"format": "compact"}).json()
+    assert compact["itinerary_id"] == plan["itinerary_id"]
+    assert client.get("/itinerary/nope").status_code == 404
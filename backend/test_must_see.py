@@ -0,0 +1,58 @@
+"""must_see: presolve_must_see pins what it can keep and rejects the rest with the reason."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+TRIP = dict(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=300)
+
+
+@pytest.mark.parametrize("strategy", ["static_budget", "astar_budget", "ils_budget"])
+@pytest.mark.parametrize("multi_day_mode", ["sequential", "partitioned"])
+def test_must_sees_are_in_the_plan(catalog, strategy, multi_day_mode):
+    must = ["mfa", "castle-island", "jfk-lib"]
+    res = client.post("/plan", json={**TRIP, "days": 2, "strategy": strategy, "multi_day_mode": multi_day_mode,
+                                     "must_see": must, "ils_time_limit_s": 0.02})
+    assert res.status_code == 200, res.text
+    ids = [s["poi_id"] for s in res.json()["stops"]]
+    assert set(must) <= set(ids) and len(ids) == len(set(ids))
+
+
+def test_pins_keep_their_order_and_latest_starts(catalog):
+    req = main.PlanReq(**{**TRIP, "end_time": "23:00"}, must_see=["night-seaport", "mfa"])
+    mode = main.get_travel_mode(req)
+    pins = main.presolve_must_see(req, catalog, mode, main.parse_day_of_week(req.date), 1)
+    day = pins[1]
+    assert set(day.ids) == {"night-seaport", "mfa"}
+    assert [catalog.records[i].id for i in day.idx] == list(day.ids)
+    # the first pin has to leave time for the second one after it
+    first, second = (catalog.get(pid) for pid in day.ids)
+    assert day.latest[0] + first.avg_dwell_min <= day.latest[1]
+
+
+def test_duplicate_must_sees_count_once(catalog):
+    req = main.PlanReq(**TRIP, must_see=["mfa", "mfa"])
+    pins = main.presolve_must_see(req, catalog, main.get_travel_mode(req), 1, 1)
+    assert pins[1].ids == ("mfa",)
+
+
+@pytest.mark.parametrize("must, extra, reason", [
+    (["nope"], {}, "unknown POI"),
+    (["mfa"], dict(date="2025-06-01", use_live_constraints=True), "closed"),
+    (["castle-island"], dict(max_distance_miles=1), "farther than max_distance_miles"),
+    (["night-seaport"], dict(end_time="16:00"), "cannot be reached and visited"),
+    (["mfa", "mos"], dict(budget_total=40), "daily budget"),
+    (["mfa", "mos", "neaq", "jfk-lib", "isgm", "bmfa", "ica"], {}, "does not fit"),
+])
+def test_must_sees_that_cannot_be_kept_are_rejected(catalog, must, extra, reason):
+    for path in ("/plan", "/plan/stream"):
+        res = client.post(path, json={**TRIP, "must_see": must, **extra})
+        assert res.status_code == 400
+        assert res.json()["detail"].startswith("must_see: ") and reason in res.json()["detail"]
+
+
+def test_too_many_must_sees_are_rejected(catalog):
+    ids = [p.id for p in catalog.records[:main.MUST_SEE_MAX + 1]]
+    res = client.post("/plan", json={**TRIP, "must_see": ids})
+    assert res.status_code == 400 and f"at most {main.MUST_SEE_MAX}" in res.json()["detail"]
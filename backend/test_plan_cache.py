@@ -0,0 +1,84 @@
+"""PlanCache and plan_cache_key: what shares a cached plan, and what drops one."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+TRIP = dict(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=100)
+
+
+def key(likes=(), **fields) -> str:
+    req = main.PlanReq(**{**TRIP, **fields, "preferences": {"like": list(likes)}})
+    return main.plan_cache_key(req, main.normalize_likes(req.preferences))
+
+
+def test_key_uses_normalized_likes():
+    assert key(["parks"]) == key(["outdoors"]) == key([" Park ", "outdoors"])
+    assert key(["restaurants", "museum"]) == key(["museums", "cafes"])
+    assert key(["parks"]) != key(["museums"]) != key()
+
+
+def test_key_ignores_how_the_plan_is_executed():
+    assert key() == key(execution="process", timeout_s=2.0, profile=True)
+    assert key() != key(budget_total=101) != key(days=2)
+    assert key(days=1) == key()
+
+
+def test_key_follows_the_catalog_version(catalog):
+    before = key()
+    main.add_pois([{**catalog.get("old-north").to_dict(), "id": "annex"}])
+    assert key() != before
+
+
+def test_synonym_likes_hit_the_same_cached_plan(catalog):
+    first = client.post("/plan", json={**TRIP, "preferences": {"like": ["parks"]}}).json()
+    second = client.post("/plan", json={**TRIP, "preferences": {"like": ["Outdoors"]}}).json()
+    assert not first["metrics"]["cache_hit"] and second["metrics"]["cache_hit"]
+    assert second["stops"] == first["stops"] and second["itinerary_id"] != first["itinerary_id"]
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = main.PlanCache(maxsize=4, ttl=10.0)
+    cache.put("a", {"plan": 1}, set())
+    clock[0] += 9.0
+    assert cache.get("a") == {"plan": 1}
+    clock[0] += 2.0
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 1}
+
+
+def test_least_recently_used_is_evicted_first(clock):
+    cache = main.PlanCache(maxsize=2, ttl=60.0)
+    cache.put("a", {"plan": "a"}, {"museums"})
+    cache.put("b", {"plan": "b"}, {"food"})
+    assert cache.get("a") is not None  # b is now the least recently used
+    cache.put("c", {"plan": "c"}, set())
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
+    cache.invalidate_category("food")  # b's category index went with it
+    assert cache.stats()["size"] == 2
+
+
+def test_invalidate_category_drops_only_plans_that_depend_on_it():
+    cache = main.PlanCache(maxsize=8, ttl=60.0)
+    cache.put("museums", {}, {"museums", "history"})
+    cache.put("food", {}, {"food"})
+    cache.invalidate_category("history")
+    assert cache.get("museums") is None and cache.get("food") is not None
+
+
+def test_feedback_drops_cached_plans_of_its_category(catalog):
+    plan = client.post("/plan", json=TRIP).json()
+    assert client.post("/plan", json=TRIP).json()["metrics"]["cache_hit"]
+
+    stop = plan["stops"][0]["poi_id"]
+    res = client.post("/feedback", json=dict(itinerary_id=plan["itinerary_id"], poi_id=stop, rating=5))
+    assert res.json()["accepted"] == 1
+    assert not client.post("/plan", json=TRIP).json()["metrics"]["cache_hit"]
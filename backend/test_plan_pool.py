@@ -0,0 +1,65 @@
+"""Plans sent to PLAN_POOL workers run on the same catalog the request sees."""
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+TRIP = dict(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=300, days=3,
+            strategy="astar_budget")
+POOLED = [dict(execution="process"), dict(multi_day_mode="partitioned")]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def plan_pool():
+    main.use_catalog(main.load_city_catalog("boston"))  # what the workers load, whatever ran before
+    main.start_plan_pool(2)
+    yield
+    main.stop_plan_pool()
+
+
+def stop_ids(extra: dict) -> list:
+    res = client.post("/plan", json={**TRIP, **extra})
+    assert res.status_code == 200
+    return [s["poi_id"] for s in res.json()["stops"]]
+
+
+@pytest.mark.parametrize("extra", POOLED)
+def test_catalog_loaded_from_artifacts_is_planned_in_the_pool(extra):
+    catalog = main.load_city_catalog("boston")
+    main.use_catalog(catalog)
+    ids = stop_ids(extra)
+    assert ids and all(catalog.get(pid) for pid in ids)
+    assert catalog.identity not in main.PLAN_POOL_REFUSED
+
+
+@pytest.mark.parametrize("extra", POOLED)
+def test_catalog_changed_after_the_fork_is_not_planned_on_stale_rows(extra):
+    rows = [{**r, "id": f"syn-{r['id']}"} for r in main.read_poi_csv(main.CSV_PATH)]
+    catalog = main.PoiCatalog(rows)
+    main.use_catalog(catalog)
+    ids = stop_ids(extra)
+    assert ids and all(pid.startswith("syn-") for pid in ids)
+    assert not main.pool_plans(catalog)  # later plans go straight to this process
+
+
+def test_pin_on_a_poi_added_after_the_fork():
+    main.use_catalog(main.PoiCatalog(main.read_poi_csv(main.CSV_PATH)))
+    row = main.catalog_for("Boston").get("old-north").to_dict()
+    main.add_pois([{**row, "id": "north-annex", "name": "North Annex", "lat": row["lat"] + 1e-4}])
+    assert "north-annex" in stop_ids(dict(execution="process", must_see=["north-annex"]))
+
+
+def test_partitioned_days_plan_alike_in_the_pool_and_on_threads(monkeypatch):
+    main.use_catalog(main.load_city_catalog("boston"))
+    trip = dict(multi_day_mode="partitioned", days=4, profile=True)  # profile: not from the plan cache
+    pooled = stop_ids(trip)
+    monkeypatch.setattr(main, "PLAN_POOL", None)
+    assert stop_ids(trip) == pooled
+
+
+def test_task_picked_up_after_its_plan_gave_up_is_dropped():
+    with pytest.raises(main.FutureTimeout):
+        main.run_counted(main.plan_multi_day_astar, expires=time.time() - 1.0)
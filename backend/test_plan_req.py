@@ -0,0 +1,33 @@
+"""PlanReq bounds: knobs that set how long or how wide a search runs are rejected (422) out of range."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+TRIP = dict(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=100)
+
+
+@pytest.mark.parametrize("limit", [0, -1, main.ILS_MAX_LIMIT_S + 0.5, 1e9])
+def test_ils_time_limit_out_of_range_is_rejected(limit):
+    trip = {**TRIP, "strategy": "ils_budget", "ils_time_limit_s": limit}
+    assert client.post("/plan", json=trip).status_code == 422
+    assert client.post("/plan/batch", json={"trips": [trip]}).status_code == 422
+
+
+def test_ils_time_limit_in_range_is_used(catalog):
+    res = client.post("/plan", json={**TRIP, "strategy": "ils_budget", "ils_time_limit_s": 0.01})
+    assert res.status_code == 200 and res.json()["stops"]
+
+
+@pytest.mark.parametrize("k", [0, -3, main.ASTAR_CANDIDATE_CAP + 1, 10**6])
+def test_max_candidates_out_of_range_is_rejected(k):
+    trip = {**TRIP, "strategy": "astar_budget", "search_mode": "beam", "max_candidates": k}
+    assert client.post("/plan", json=trip).status_code == 422
+    assert client.post("/plan/batch", json={"trips": [trip]}).status_code == 422
+
+
+def test_max_candidates_at_the_cap_is_planned(catalog):
+    trip = {**TRIP, "strategy": "astar_budget", "search_mode": "dfbnb", "max_candidates": main.ASTAR_CANDIDATE_CAP}
+    res = client.post("/plan", json=trip)
+    assert res.status_code == 200 and res.json()["stops"]
@@ -0,0 +1,76 @@
+"""/replan: the rest of a day is planned again around what is done, skipped or still planned."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+TRIP = dict(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=120, days=3)
+
+
+def minutes(hhmm: str) -> int:
+    h, m = hhmm.split(":")
+    return int(h) * 60 + int(m)
+
+
+def day_stops(plan: dict, day: int) -> list:
+    return [s for s in plan["stops"] if s["day"] == day]
+
+
+@pytest.fixture(params=["static_budget", "astar_budget"])
+def plan(request, catalog):
+    return client.post("/plan", json={**TRIP, "strategy": request.param}).json()
+
+
+def replan(plan: dict, **body) -> dict:
+    res = client.post("/replan", json={"itinerary_id": plan["itinerary_id"], **body})
+    assert res.status_code == 200, res.text
+    return res.json()
+
+
+def test_done_stops_stay_and_the_rest_starts_after_current_time(plan):
+    done = [s["poi_id"] for s in day_stops(plan, 1)[:2]]
+    new = replan(plan, current_time="13:00", done=done)
+
+    ids = [s["poi_id"] for s in new["stops"]]
+    assert len(ids) == len(set(ids))
+    today = day_stops(new, 1)
+    assert [s["poi_id"] for s in today[:2]] == done
+    for stop in today[2:]:
+        assert minutes(stop["start"]) >= minutes("13:00") and minutes(stop["end"]) <= minutes(TRIP["end_time"])
+    assert sum(s["admission_est"] for s in today) <= TRIP["budget_total"] / TRIP["days"] + 1e-9
+
+    # later days had nothing done or skipped: kept as planned
+    assert new["metrics"]["replanned_days"] == [1]
+    assert day_stops(new, 2) == day_stops(plan, 2) and day_stops(new, 3) == day_stops(plan, 3)
+    assert new["itinerary_id"] == plan["itinerary_id"]
+
+
+def test_skipped_stops_are_dropped_and_their_days_replanned(plan):
+    first, second = day_stops(plan, 1)[:2]
+    later = day_stops(plan, 3)[0]
+    new = replan(plan, current_time="12:30", done=[first["poi_id"]], skip=[second["poi_id"], later["poi_id"]],
+                 lat=42.35, lon=-71.07)
+    ids = {s["poi_id"] for s in new["stops"]}
+    assert first["poi_id"] in ids and not ids & {second["poi_id"], later["poi_id"]}
+    assert new["metrics"]["replanned_days"] == [1, 3]
+    for stop in day_stops(new, 1)[1:]:
+        assert minutes(stop["start"]) >= minutes("12:30")
+
+
+def test_replanned_itinerary_is_what_get_itinerary_returns(plan):
+    new = replan(plan, current_time="10:00", done=[day_stops(plan, 1)[0]["poi_id"]])
+    stored = client.get(f"/itinerary/{plan['itinerary_id']}").json()
+    assert stored["stops"] == new["stops"]
+
+
+@pytest.mark.parametrize("body, status", [
+    (dict(itinerary_id="nope", current_time="10:00"), 404),
+    (dict(current_time="10am"), 400),
+    (dict(current_time="10:00", lat=42.35), 400),
+    (dict(current_time="10:00", done=["not-a-stop"]), 400),
+    (dict(current_time="10:00", day=4), 400),
+])
+def test_bad_requests_are_rejected(plan, body, status):
+    res = client.post("/replan", json={"itinerary_id": plan["itinerary_id"], **body})
+    assert res.status_code == status
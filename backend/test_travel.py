@@ -0,0 +1,49 @@
+"""TravelMatrix past TRAVEL_DENSE_MAX_POIS: legs computed on demand match the dense matrices."""
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+TRIP = dict(date="2025-06-03", start_time="09:00", end_time="18:00", budget_total=150, days=2)
+
+
+def on_demand(catalog: main.PoiCatalog) -> main.TravelMatrix:
+    travel = main.TravelMatrix(catalog.start, dense_max=0)
+    travel.add(catalog.columns.lat, catalog.columns.lon)
+    return travel
+
+
+def test_on_demand_legs_match_the_dense_matrix(catalog):
+    dense, lazy = catalog.travel, on_demand(catalog)
+    assert dense.dense and not lazy.dense and lazy.nbytes() < dense.nbytes()
+    mode = main.TRAVEL_MODES["car"]
+    rows, cols = np.array([0, 5, 9]), np.arange(len(catalog))
+    for f in mode.slice_factors:
+        assert np.array_equal(lazy.between(rows, cols, mode.speed_kmh, f), dense.between(rows, cols, mode.speed_kmh, f))
+        for i in (main.START, 3):
+            assert np.array_equal(lazy.from_poi(i, mode.speed_kmh, f), dense.from_poi(i, mode.speed_kmh, f))
+    assert np.array_equal(lazy.km_between(rows, cols), dense.km_between(rows, cols))
+    assert lazy.travel_mins(2, 7, mode, 1, 8 * 60) == dense.travel_mins(2, 7, mode, 1, 8 * 60)
+
+
+@pytest.mark.parametrize("strategy, multi_day_mode", [
+    ("static_budget", "sequential"), ("astar_budget", "sequential"), ("astar_budget", "partitioned"),
+])
+def test_plans_do_not_depend_on_how_legs_are_stored(catalog, strategy, multi_day_mode):
+    req = {**TRIP, "strategy": strategy, "multi_day_mode": multi_day_mode, "use_live_constraints": True,
+           "must_see": ["castle-island"], "profile": True}
+    dense = client.post("/plan", json=req).json()
+    catalog.travel = on_demand(catalog)
+    lazy = client.post("/plan", json=req).json()
+    assert lazy["stops"] == dense["stops"] and lazy["stops"]
+
+
+def test_growing_past_the_limit_drops_the_matrices(catalog):
+    travel = main.TravelMatrix(catalog.start, dense_max=len(catalog) + 2)
+    travel.add(catalog.columns.lat, catalog.columns.lon)
+    assert travel.dense and travel.km.shape == (len(catalog),) * 2
+    travel.add([42.36, 42.37, 42.38], [-71.06, -71.05, -71.04])
+    assert not travel.dense and travel.n == len(catalog) + 3
+    assert travel.from_poi(main.START, 5.0).shape == (travel.n,)